@@ -0,0 +1,104 @@
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+LOCAL_TIMEZONE = ZoneInfo("America/New_York")
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class Analytics:
+    """Aggregate booking counts per week and per weekly time slot, kept
+    up to date as bookings are inserted, canceled and validated so that
+    reports read a handful of precomputed rows instead of scanning history.
+
+    Weeks start on Monday and slots are the local weekday and hour in which
+    a booking starts, which is how rooms are scheduled."""
+
+    COUNTERS = ("booked", "canceled", "invalidPIDs")
+
+    def __init__(self, cur: sqlite3.Cursor):
+        self._cur = cur
+
+    def create(self):
+        counters = ", ".join(f"{c} INTEGER NOT NULL DEFAULT 0" for c in self.COUNTERS)
+        self._cur.execute(
+            f"""CREATE TABLE IF NOT EXISTS stats_weekly (
+                week TEXT PRIMARY KEY,
+                {counters}
+            )"""
+        )
+        self._cur.execute(
+            f"""CREATE TABLE IF NOT EXISTS stats_slots (
+                weekday INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                {counters},
+                PRIMARY KEY (weekday, hour)
+            )"""
+        )
+
+    def is_empty(self) -> bool:
+        return self._cur.execute("SELECT 1 FROM stats_weekly LIMIT 1").fetchone() is None
+
+    @staticmethod
+    def _keys(start: datetime) -> tuple[str, int, int]:
+        local = start.astimezone(LOCAL_TIMEZONE)
+        week = (local - timedelta(days=local.weekday())).date().isoformat()
+        return week, local.weekday(), local.hour
+
+    def record(self, start: datetime, counter: str, n: int = 1):
+        """Adds n to a counter for the week and slot of a booking starting
+        at start. The caller commits, so the aggregates change in the same
+        transaction as the bookings they describe."""
+        if counter not in self.COUNTERS:
+            raise ValueError(f"Unknown counter {counter}")
+        week, weekday, hour = self._keys(start)
+        self._cur.execute(
+            f"""INSERT INTO stats_weekly (week, {counter}) VALUES (?, ?)
+            ON CONFLICT (week) DO UPDATE SET {counter}={counter}+excluded.{counter}""",
+            (week, n),
+        )
+        self._cur.execute(
+            f"""INSERT INTO stats_slots (weekday, hour, {counter}) VALUES (?, ?, ?)
+            ON CONFLICT (weekday, hour)
+            DO UPDATE SET {counter}={counter}+excluded.{counter}""",
+            (weekday, hour, n),
+        )
+
+    def weekly(self, weeks: int = None) -> list[tuple[str, int, int, int]]:
+        """Returns (week, booked, canceled, invalidPIDs), most recent first"""
+        q = f"""SELECT week, {", ".join(self.COUNTERS)}
+            FROM stats_weekly ORDER BY week DESC LIMIT ?"""
+        return self._cur.execute(q, (-1 if weeks is None else weeks,)).fetchall()
+
+    def slots(self) -> list[tuple[int, int, int, int, int]]:
+        """Returns (weekday, hour, booked, canceled, invalidPIDs) for every
+        slot that has had a booking"""
+        q = f"""SELECT weekday, hour, {", ".join(self.COUNTERS)}
+            FROM stats_slots ORDER BY weekday, hour"""
+        return self._cur.execute(q).fetchall()
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Booking reports")
+    parser.add_argument("db", help="path to the CTE database")
+    parser.add_argument("report", choices=["weekly", "slots"])
+    parser.add_argument("--weeks", type=int, default=12, help="weeks to show")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    analytics = Analytics(conn.cursor())
+    if args.report == "weekly":
+        print(f"{'week':<12}{'booked':>8}{'canceled':>10}{'invalid PIDs':>14}")
+        for week, booked, canceled, invalid in analytics.weekly(args.weeks):
+            print(f"{week:<12}{booked:>8}{canceled:>10}{invalid:>14}")
+    else:
+        print(f"{'slot':<11}{'booked':>8}{'canceled':>10}{'cancel rate':>13}")
+        for weekday, hour, booked, canceled, _ in analytics.slots():
+            rate = f"{canceled / booked:.0%}" if booked else "-"
+            print(f"{WEEKDAYS[weekday]} {hour:02}:00  {booked:>8}{canceled:>10}{rate:>13}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
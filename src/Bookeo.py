@@ -0,0 +1,393 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from time import monotonic, sleep
+
+import requests
+from ResponseCache import CacheEntry, ResponseCache
+
+BOOKEO_API_URL = "https://api.bookeo.com/v2"
+ZULU_FORMAT = r"%Y-%m-%dT%H:%M:00Z"
+USERAGENT = "ERIC-CTE/1.0 (nolanwelch@outlook.com)"
+
+FETCH_WINDOW = timedelta(days=7)
+ITEMS_PER_PAGE = 100
+# Windows with more bookings than this whose participants are needed are
+# fetched again with participants, rather than booking by booking
+DETAIL_BATCH_THRESHOLD = 8
+MAX_WORKERS = 4
+MIN_REQUEST_INTERVAL = 0.25  # seconds between requests, across all threads
+MAX_REQUEST_INTERVAL = 8.0  # the most that rate limiting backs the spacing off to
+BACKOFF_RECOVERY = 0.9  # share of the backed-off spacing kept after a success
+MAX_RETRIES = 3  # retries of a request answered with 429
+MAX_RETRY_WAIT = 10.0  # seconds; Bookeo asking for a longer pause fails the request
+
+
+class RateLimited(requests.RequestException):
+    """Raised instead of blocking when Bookeo asks for a long pause"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited by Bookeo for another {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str) -> float:
+    """Returns the seconds to wait from a Retry-After header, which is
+    either a number of seconds or an HTTP date, or None if it's missing"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        until = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    return max(0.0, (until - datetime.now(timezone.utc)).total_seconds())
+
+
+class Bookeo:
+    def __init__(
+        self,
+        logger: Logger,
+        secret_key: str,
+        api_key: str,
+        max_workers: int = MAX_WORKERS,
+        cache_dir: str = None,
+        session: requests.Session = None,
+    ):
+        if "" in (api_key, secret_key):
+            raise ValueError("Bookeo keys cannot be empty")
+
+        self._logger = logger
+        self._secret_key = secret_key
+        self._api_key = api_key
+        self._session = session or requests.Session()
+        self._session.headers.update({"User-Agent": USERAGENT})
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="bookeo")
+        self._throttle_lock = threading.Lock()
+        self._next_request = 0.0
+        # Spacing between requests while backing off, and when Bookeo
+        # will next accept a request (both on the monotonic clock)
+        self._interval = 0.0
+        self._blocked_until = 0.0
+        self._cache = ResponseCache(cache_dir) if cache_dir is not None else None
+
+    def retry_after(self) -> float:
+        """Returns the seconds until Bookeo will accept requests again"""
+        return max(0.0, self._blocked_until - monotonic())
+
+    def _throttle(self):
+        """Spaces out requests from all threads to stay under the rate limit.
+        Raises RateLimited rather than wait longer than MAX_RETRY_WAIT."""
+        with self._throttle_lock:
+            now = monotonic()
+            if self._blocked_until - now > MAX_RETRY_WAIT:
+                raise RateLimited(self._blocked_until - now)
+            start = max(now, self._next_request, self._blocked_until)
+            self._next_request = start + max(MIN_REQUEST_INTERVAL, self._interval)
+        if start > now:
+            sleep(start - now)
+
+    def _back_off(self, res: requests.Response) -> float:
+        """Slows all requests down after a 429. Returns the seconds until
+        the request may be retried."""
+        retry_after = parse_retry_after(res.headers.get("Retry-After"))
+        with self._throttle_lock:
+            now = monotonic()
+            # Requests rejected together count as one signal to slow down
+            if now >= self._blocked_until:
+                self._interval = min(
+                    max(2 * self._interval, 2 * MIN_REQUEST_INTERVAL),
+                    MAX_REQUEST_INTERVAL,
+                )
+            if retry_after is None:
+                retry_after = self._interval
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+        return retry_after
+
+    def _recover(self):
+        """Speeds requests back up, one successful request at a time"""
+        if not self._interval:
+            return
+        with self._throttle_lock:
+            self._interval *= BACKOFF_RECOVERY
+            if self._interval <= MIN_REQUEST_INTERVAL:
+                self._interval = 0.0
+
+    def _get(self, path: str, params: dict, headers: dict = None) -> requests.Response:
+        """GET a Bookeo endpoint, retrying requests answered with 429 after
+        the pause Bookeo asks for. Raises RateLimited if the pause is too
+        long or the retries run out."""
+        for _ in range(MAX_RETRIES + 1):
+            self._throttle()
+            res = self._session.get(
+                f"{BOOKEO_API_URL}{path}",
+                params={
+                    **params,
+                    "secretKey": self._secret_key,
+                    "apiKey": self._api_key,
+                },
+                **({"headers": headers} if headers else {}),
+            )
+            if res.status_code != 429:
+                self._recover()
+                return res
+            wait = self._back_off(res)
+            self._logger.warning(f"Rate limited by Bookeo for {wait:.1f}s")
+        raise RateLimited(self.retry_after())
+
+    def _fetch_window(
+        self,
+        start: datetime,
+        end: datetime,
+        params: dict,
+        changed_only: bool = False,
+        cache_scope: str = None,
+    ) -> tuple[list[dict], tuple[str, CacheEntry, list[dict]]]:
+        """Fetches every page of bookings between start and end. Returns the
+        bookings, or None if any request failed, along with the (key, entry,
+        data) to save to the cache for the window, if any. If changed_only
+        is set, a window whose bookings match the cached ones is returned
+        as []. Without a cache_scope, the cache isn't used at all."""
+        params = {
+            **params,
+            "startTime": start.strftime(ZULU_FORMAT),
+            "endTime": end.strftime(ZULU_FORMAT),
+            "itemsPerPage": ITEMS_PER_PAGE,
+        }
+        key = entry = None
+        headers = {}
+        if self._cache is not None and cache_scope is not None:
+            key = ResponseCache.key(f"{cache_scope}/bookings", params)
+            entry = self._cache.get(key)
+        # Page navigation tokens change on every request, so validators are
+        # only meaningful when the whole window fits on one page
+        if entry is not None and entry.pages == 1:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        res = self._get("/bookings", params, headers)
+        if res.status_code == 304 and entry is not None:
+            if changed_only:
+                return [], None
+            data = self._cache.get_data(key)
+            if data is not None:
+                return data, None
+            # The cached data can't be read, so it is fetched again in full
+            self._logger.warning("Cached bookings are unreadable, fetching them again")
+            res = self._get("/bookings", params)
+        if res.status_code != 200:
+            self._logger.error(
+                f"Could not fetch bookings from Bookeo (status code {res.status_code})"
+            )
+            return None, None
+
+        first_headers = res.headers
+        body = res.json()
+        data = body["data"]
+        info = body.get("info", {})
+        pages = info.get("totalPages", 1)
+        for page in range(2, pages + 1):
+            res = self._get(
+                "/bookings",
+                {"pageNavigationToken": info["pageNavigationToken"], "pageNumber": page},
+            )
+            if res.status_code != 200:
+                self._logger.error(
+                    f"Could not fetch page {page} of bookings from Bookeo "
+                    f"(status code {res.status_code})"
+                )
+                return None, None
+            data += res.json()["data"]
+
+        if key is None:
+            return data, None
+        # Only the bookings are hashed, as the first page also carries a
+        # page navigation token that is new on every request
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        pending = (
+            key,
+            CacheEntry(
+                first_headers.get("ETag"),
+                first_headers.get("Last-Modified"),
+                digest,
+                pages,
+            ),
+            data,
+        )
+        if changed_only and entry is not None and entry.digest == digest:
+            return [], pending
+        return data, pending
+
+    def fetch_bookings(
+        self,
+        start: datetime,
+        end: datetime,
+        window: timedelta = FETCH_WINDOW,
+        changed_only: bool = False,
+        cache_scope: str = "",
+        pending: list = None,
+        **params,
+    ) -> list[dict]:
+        """Fetches the raw bookings between start and end, split into
+        windows that are requested concurrently. Returns None if any
+        window could not be fetched.
+
+        If changed_only is set, windows identical to the last time they
+        were fetched are left out of the result. Every fetch updates what
+        counts as unchanged, so callers that fetch the same windows for a
+        different purpose should use their own cache_scope.
+
+        If pending is given, the fetched windows are added to it instead of
+        being saved to the cache, so that a caller can pass it to
+        save_windows once it has stored the bookings. Otherwise a changed
+        window the caller then fails to store would count as unchanged."""
+        windows = self._windows(start, end, window)
+        futures = [
+            self._pool.submit(self._fetch_window, *w, params, changed_only, cache_scope)
+            for w in windows
+        ]
+        try:
+            results = [f.result() for f in futures]
+        except requests.RequestException as e:
+            self._logger.error(f"Error fetching bookings from Bookeo: {e}")
+            return None
+        if any(data is None for data, _ in results):
+            return None
+
+        fetched = [p for _, p in results if p is not None]
+        if pending is None:
+            self.save_windows(fetched)
+        else:
+            pending.extend(fetched)
+
+        # A booking spanning a window boundary is returned by both windows
+        bookings = {}
+        for data, _ in results:
+            for b in data:
+                if start <= datetime.fromisoformat(b["startTime"]) < end:
+                    bookings.setdefault(b["bookingNumber"], b)
+        self._logger.info(
+            f"Fetched {len(bookings)} booking(s) from Bookeo in {len(windows)} window(s)"
+        )
+        return list(bookings.values())
+
+    @staticmethod
+    def _windows(
+        start: datetime, end: datetime, window: timedelta
+    ) -> list[tuple[datetime, datetime]]:
+        """Splits start to end into windows. They are aligned to whole days
+        so that the same windows (and cache keys) are requested on every
+        sync throughout the day."""
+        t = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        windows = []
+        while t < end:
+            windows.append((t, t + window))
+            t += window
+        return windows
+
+    def close(self):
+        self._pool.shutdown()
+
+    def save_windows(self, pending: list):
+        """Saves windows collected through fetch_bookings' pending list to
+        the cache, so that they count as unchanged from now on"""
+        if self._cache is None:
+            return
+        for key, entry, data in pending:
+            self._cache.put(key, entry, data)
+
+    def fetch_participants(
+        self,
+        start: datetime,
+        end: datetime,
+        bookings: list[dict],
+        booking_numbers: list[str],
+        window: timedelta = FETCH_WINDOW,
+    ) -> dict[str, dict]:
+        """Fetches the given bookings, out of bookings fetched without
+        participants between start and end, with their participants, keyed
+        by booking number. Returns None if any request failed.
+
+        Each request is throttled, so when more of a window's bookings are
+        needed than it takes pages to list the whole window (e.g. on the
+        first sync), the window is fetched again with participants. Only a
+        few bookings in a window are fetched one by one."""
+        windows = self._windows(start, end, window)
+        listed: dict[int, int] = {}
+        wanted: dict[int, list[str]] = {}
+        numbers = set(booking_numbers)
+        for b in bookings:
+            i = min(
+                int((datetime.fromisoformat(b["startTime"]) - windows[0][0]) / window),
+                len(windows) - 1,
+            )
+            listed[i] = listed.get(i, 0) + 1
+            if b["bookingNumber"] in numbers:
+                wanted.setdefault(i, []).append(b["bookingNumber"])
+
+        window_futures = {}
+        single = []
+        for i, window_numbers in wanted.items():
+            pages = -(-listed[i] // ITEMS_PER_PAGE)
+            if len(window_numbers) > max(DETAIL_BATCH_THRESHOLD, pages):
+                window_futures[i] = self._pool.submit(
+                    self._fetch_window, *windows[i], {"expandParticipants": True}
+                )
+            else:
+                single += window_numbers
+        details = self.fetch_booking_details(single, expandParticipants=True)
+
+        try:
+            results = {i: f.result()[0] for i, f in window_futures.items()}
+        except requests.RequestException as e:
+            self._logger.error(f"Error fetching bookings from Bookeo: {e}")
+            return None
+        if details is None or None in results.values():
+            return None
+        # A booking missing from its window was canceled in the meantime
+        for i, data in results.items():
+            window_numbers = set(wanted[i])
+            details.update(
+                (b["bookingNumber"], b)
+                for b in data
+                if b["bookingNumber"] in window_numbers
+            )
+        return details
+
+    def _fetch_booking(self, booking_number: str, params: dict) -> dict:
+        res = self._get(f"/bookings/{booking_number}", params)
+        if res.status_code != 200:
+            self._logger.error(
+                f"Could not fetch booking {booking_number} from Bookeo "
+                f"(status code {res.status_code})"
+            )
+            return None
+        return res.json()
+
+    def fetch_booking_details(
+        self, booking_numbers: list[str], **params
+    ) -> dict[str, dict]:
+        """Concurrently fetches individual bookings, keyed by booking number.
+        Returns None if any booking could not be fetched."""
+        futures = {
+            n: self._pool.submit(self._fetch_booking, n, params) for n in booking_numbers
+        }
+        try:
+            results = {n: f.result() for n, f in futures.items()}
+        except requests.RequestException as e:
+            self._logger.error(f"Error fetching bookings from Bookeo: {e}")
+            return None
+        if None in results.values():
+            return None
+        return results
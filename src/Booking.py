@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Callable
 
 from PID import PID
 
@@ -11,6 +12,7 @@ class Booking:
         on_campus_pids: list[PID],
         last_change: datetime,
         email,
+        end: datetime = None,
     ):
         if id < 0:
             raise ValueError("Booking ID cannot be negative")
@@ -18,11 +20,45 @@ class Booking:
             raise TypeError("start must be a datetime")
         elif not isinstance(last_change, datetime):
             raise TypeError("last_change must be a datetime")
+        elif end is not None and not isinstance(end, datetime):
+            raise TypeError("end must be a datetime")
         self.id = id
         self.start = start
         self.on_campus_pids = on_campus_pids
         self.last_change = last_change
         self.email = email
+        self.end = end if end is not None else start
 
     def __eq__(self, other):
         return isinstance(other, Booking) and other.id == self.id
+
+
+class LazyBooking(Booking):
+    """A Booking read from the database whose PIDs are only queried when
+    first accessed, since most callers only need its ID and times.
+
+    load_pids runs on first access, so a LazyBooking must only be used on
+    the thread that owns the database connection until its PIDs are loaded."""
+
+    def __init__(
+        self,
+        id: int,
+        start: datetime,
+        last_change: datetime,
+        email,
+        end: datetime = None,
+        load_pids: Callable[[int], list[PID]] = None,
+    ):
+        self._load_pids = load_pids
+        super().__init__(id, start, None, last_change, email, end)
+
+    @property
+    def on_campus_pids(self) -> list[PID]:
+        if self._on_campus_pids is None:
+            self._on_campus_pids = self._load_pids(self.id)
+        return self._on_campus_pids
+
+    @on_campus_pids.setter
+    def on_campus_pids(self, pids: list[PID]):
+        # None leaves the PIDs to be loaded on first access
+        self._on_campus_pids = pids
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from Booking import Booking
+from PID import PID
+
+
+class BookingDiff:
+    def __init__(
+        self,
+        booking: Booking,
+        start: tuple[datetime, datetime] = None,
+        email: tuple[str, str] = None,
+        added: list[PID] = None,
+        removed: list[PID] = None,
+    ):
+        # The Booking as it is now stored
+        self.booking = booking
+        # (old, new) pairs, or None if the field didn't change
+        self.start = start
+        self.email = email
+        self.added = added or []
+        self.removed = removed or []
+
+    def to_dict(self) -> dict:
+        """The changed fields, for the event log"""
+        changes = {}
+        if self.start is not None:
+            changes["start"] = [t.timestamp() for t in self.start]
+        if self.email is not None:
+            changes["email"] = list(self.email)
+        if self.added:
+            changes["addedPIDs"] = [p.id for p in self.added]
+        if self.removed:
+            changes["removedPIDs"] = [p.id for p in self.removed]
+        return changes
+
+    def __bool__(self):
+        return bool(self.start or self.email or self.added or self.removed)
+
+    def __repr__(self):
+        return f"BookingDiff({self.booking.id}, {self.to_dict()})"
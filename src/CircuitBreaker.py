@@ -0,0 +1,59 @@
+from datetime import timedelta
+from time import monotonic
+
+FAILURE_THRESHOLD = 3
+RESET_TIMEOUT = timedelta(minutes=2)
+
+
+class CircuitBreaker:
+    """Tracks the health of one upstream service.
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls are refused until reset_timeout has passed. A single trial call
+    is then allowed through (half-open): success closes the circuit, while
+    failure opens it again for another reset_timeout."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        reset_timeout: timedelta = RESET_TIMEOUT,
+    ):
+        if failure_threshold < 1:
+            raise ValueError("Failure threshold must be at least 1")
+
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout.total_seconds()
+        self._failures = 0
+        self._opened_at: float = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        elif monotonic() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """Returns whether a call to the upstream should be attempted"""
+        return self.state != self.OPEN
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        """Counts a failed call. Returns True if this opened the circuit."""
+        was_open = self._opened_at is not None
+        self._failures += 1
+        if was_open or self._failures >= self._failure_threshold:
+            # A failed trial call restarts the timeout
+            self._opened_at = monotonic()
+            return not was_open
+        return False
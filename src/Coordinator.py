@@ -0,0 +1,645 @@
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import os
+import socket
+import uuid
+from logging import Logger
+from time import monotonic
+from typing import Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from Booking import Booking
+from CircuitBreaker import CircuitBreaker
+from Database import Database
+from DatabaseWorker import DatabaseWorker
+from PIDMatcher import PIDMatch
+from SlackApp import SlackApp
+from Sling import Sling
+
+LOCAL_TIMEZONE = ZoneInfo("America/New_York")
+
+FETCH_DELTA = dt.timedelta(days=31)
+SYNC_INTERVAL = dt.timedelta(minutes=5)
+MIN_SYNC_INTERVAL = dt.timedelta(minutes=1)
+MAX_SYNC_INTERVAL = dt.timedelta(minutes=30)
+UPCOMING_WINDOW = dt.timedelta(hours=2)  # bookings this close are synced most often
+BUSINESS_HOURS = (dt.time(hour=9), dt.time(hour=23))  # local time
+IDLE_BACKOFF = 1.5  # interval growth per sync that found nothing new
+SHIFT_SYNC_INTERVAL = dt.timedelta(hours=1)
+ROSTER_INTERVAL = dt.timedelta(minutes=1)
+CLEANUP_INTERVAL = dt.timedelta(seconds=30)
+OUTBOX_INTERVAL = dt.timedelta(minutes=1)
+RETENTION_INTERVAL = dt.timedelta(hours=6)
+CANCELLATION_INTERVAL = dt.timedelta(minutes=15)
+SLACK_CONCURRENCY = 4  # messages being posted at once
+LEADER_LEASE = "leader"
+LEASE_TTL = dt.timedelta(seconds=30)
+LEASE_RENEW_INTERVAL = dt.timedelta(seconds=10)
+STATUS_HOST = "127.0.0.1"
+STATUS_PORT = 8765
+
+
+def invalid_pids_message(b: Booking, matches: list[PIDMatch]) -> str:
+    booking_datetime = b.start.astimezone(LOCAL_TIMEZONE)
+    booking_date = booking_datetime.strftime("%A, %B %-d")
+    described = []
+    for match in matches:
+        p = match.pid
+        d = f"*{p.id}* ({p.last_name}, {p.first_name})"
+        if match.suggestion is not None:
+            s = match.suggestion
+            d += f" - did they mean *{s.id}* ({s.last_name}, {s.first_name})?"
+        described.append(d)
+    m = f":x: There are some invalid on-campus PIDs in booking *{b.id}* on {booking_date}. "
+    m += f"They are: {', '.join(described)}. "
+    m += f"Contact email: {b.email}"
+    return m
+
+
+def sync_interval(
+    now: dt.datetime, booking_soon: bool, idle_syncs: int, retry_after: float = 0
+) -> dt.timedelta:
+    """Returns how long to wait before the next booking sync: often when a
+    booking starts soon, backing off during business hours while syncs keep
+    finding nothing new, rarely overnight, and never before Bookeo will
+    accept requests again"""
+    opens, closes = BUSINESS_HOURS
+    if booking_soon:
+        interval = MIN_SYNC_INTERVAL
+    elif opens <= now.astimezone(LOCAL_TIMEZONE).time() < closes:
+        backoff = IDLE_BACKOFF ** min(idle_syncs, 10)
+        interval = min(SYNC_INTERVAL * backoff, MAX_SYNC_INTERVAL)
+    else:
+        interval = MAX_SYNC_INTERVAL
+    return max(interval, dt.timedelta(seconds=retry_after))
+
+
+def cancellations_message(bookings: list[Booking]) -> str:
+    described = []
+    for b in sorted(bookings, key=lambda b: b.start):
+        booking_datetime = b.start.astimezone(LOCAL_TIMEZONE)
+        booking_date = booking_datetime.strftime("%A, %B %-d at %-I:%M %p")
+        described.append(f"*{b.id}* on {booking_date}")
+    if len(described) == 1:
+        return f":wastebasket: Booking {described[0]} was canceled."
+    m = f":wastebasket: {len(described)} bookings were canceled: "
+    return m + "; ".join(described) + "."
+
+
+class NotLeader(Exception):
+    """Raised by leader-only work that finds, before a side effect, that
+    this process's leader lease may have expired"""
+
+
+class Notification:
+    def __init__(
+        self,
+        slack_ids: list[str],
+        message: str,
+        on_sent: Callable[[Database], None] = None,
+        on_failed: Callable[[Database], None] = None,
+    ):
+        self.slack_ids = slack_ids
+        self.message = message
+        # Run on the database thread once the message has been sent, or
+        # once sending it has failed
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+
+
+class Coordinator:
+    """Runs syncing, validation, notification and cleanup as independent
+    asyncio tasks, plus a small local HTTP endpoint for status and webhooks.
+
+    Blocking HTTP clients run in the default executor and all database
+    access goes through a DatabaseWorker, so a slow upstream only delays
+    the task that is waiting on it. That includes Bookeo, whose requests
+    are made off the database thread even though the Database owns the
+    client.
+
+    Several coordinators may share one database, e.g. as hot standbys.
+    Only the holder of the leader lease syncs from upstream, and alerts
+    are claimed atomically in the database before being sent, so each is
+    sent by exactly one process. Leader-only work checks that the lease
+    can't have expired before each side effect, so a leader held up past
+    its lease never acts alongside the one that took over.
+
+    Each upstream has a circuit breaker. While one is down, local work
+    carries on: cached bookings are still validated against the roster,
+    and Slack messages are journaled in the database and replayed in
+    order once Slack is reachable again."""
+
+    def __init__(
+        self,
+        logger: Logger,
+        db: DatabaseWorker,
+        slack: SlackApp,
+        sling: Sling,
+        status_port: int = STATUS_PORT,
+    ):
+        self._logger = logger
+        self._db = db
+        self._slack = slack
+        self._sling = sling
+        self._status_port = status_port
+        self._admin_slack_ids: list[str] = []
+        self._synced: asyncio.Queue = None
+        self._outbox: asyncio.Queue = None
+        self._sync_now: asyncio.Event = None
+        self._status: dict[str, dict] = {}
+        self._holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._is_leader = False
+        # When the lease runs out unless renewed, on the monotonic clock
+        self._lease_expires = 0.0
+        self._breakers = {
+            name: CircuitBreaker(name) for name in ("bookeo", "sling", "slack")
+        }
+        # Consecutive syncs that found no new or changed bookings, and how
+        # long until Bookeo accepts requests again, for adaptive polling
+        self._idle_syncs = 0
+        self._bookeo_retry_after = 0.0
+        self._sync_interval = SYNC_INTERVAL
+
+    async def run(self):
+        self._synced = asyncio.Queue()
+        self._outbox = asyncio.Queue()
+        self._sync_now = asyncio.Event()
+
+        await self.load_admins()
+
+        server = await self._serve_status()
+        try:
+            async with server or contextlib.nullcontext(), asyncio.TaskGroup() as tg:
+                tg.create_task(
+                    self._every("leader", LEASE_RENEW_INTERVAL, self.renew_leadership)
+                )
+                tg.create_task(self._every("cleanup", CLEANUP_INTERVAL, self.cleanup))
+                tg.create_task(
+                    self._every(
+                        "shifts", SHIFT_SYNC_INTERVAL, self.sync_shifts, leader_only=True
+                    )
+                )
+                tg.create_task(
+                    self._every(
+                        "roster", ROSTER_INTERVAL, self.refresh_roster, leader_only=True
+                    )
+                )
+                tg.create_task(
+                    self._every(
+                        "sync",
+                        lambda: self._sync_interval,
+                        self.sync_bookings,
+                        self._sync_now,
+                        leader_only=True,
+                    )
+                )
+                tg.create_task(
+                    self._every(
+                        "cancellations",
+                        lambda: max(
+                            CANCELLATION_INTERVAL,
+                            dt.timedelta(seconds=self._bookeo_retry_after),
+                        ),
+                        self.notify_cancellations,
+                        leader_only=True,
+                    )
+                )
+                tg.create_task(
+                    self._every(
+                        "retention",
+                        RETENTION_INTERVAL,
+                        self.purge_archive,
+                        leader_only=True,
+                    )
+                )
+                tg.create_task(
+                    self._every(
+                        "outbox", OUTBOX_INTERVAL, self.replay_outbox, leader_only=True
+                    )
+                )
+                tg.create_task(self._validate_forever())
+                tg.create_task(self._notify_forever())
+        finally:
+            await self.step_down()
+
+    async def _serve_status(self) -> asyncio.Server:
+        """Starts the status endpoint and returns its server, or None if the
+        port is taken, e.g. by a standby's leader on the same host"""
+        try:
+            server = await asyncio.start_server(
+                self._handle_status_request, STATUS_HOST, self._status_port
+            )
+        except OSError as e:
+            self._logger.warning(
+                f"Not serving status on {STATUS_HOST}:{self._status_port}: {e}"
+            )
+            return None
+        self._logger.info(f"Serving status on {STATUS_HOST}:{self._status_port}")
+        return server
+
+    async def load_admins(self):
+        admins = await self._db.call("get_admins")
+        self._admin_slack_ids = [
+            await self._db.call("get_slack_id", a.employee_id) for a in admins
+        ]
+
+    async def _every(
+        self,
+        name: str,
+        interval: dt.timedelta | Callable[[], dt.timedelta],
+        fn: Callable[[], Awaitable[None]],
+        trigger: asyncio.Event = None,
+        leader_only: bool = False,
+    ):
+        """Runs fn every interval (or as soon as trigger is set), recording
+        the outcome for the status endpoint. Errors are logged rather than
+        allowed to stop the other tasks. If leader_only is set, fn is
+        skipped while this process is not the leader. interval may be a
+        function, called after each run, for tasks that adapt their pace."""
+        while True:
+            status = self._status.setdefault(name, {})
+            if leader_only and not self._holds_lease():
+                status["skipped"] = "standby"
+                await asyncio.sleep(LEASE_RENEW_INTERVAL.total_seconds())
+                continue
+            status.pop("skipped", None)
+            try:
+                await fn()
+                status["lastSuccess"] = dt.datetime.now(dt.timezone.utc).isoformat()
+                status.pop("lastError", None)
+            except NotLeader:
+                self._logger.warning(f"Leader lease lapsed during the {name} task")
+                status["skipped"] = "lease lapsed"
+            except Exception as e:
+                self._logger.exception(f"Error in {name} task")
+                status["lastError"] = str(e)
+            status["lastRun"] = dt.datetime.now(dt.timezone.utc).isoformat()
+            wait = (interval() if callable(interval) else interval).total_seconds()
+            status["interval"] = wait
+
+            if trigger is None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await asyncio.wait_for(trigger.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            trigger.clear()
+
+    async def renew_leadership(self):
+        was_leader = self._is_leader
+        # The lease runs out no sooner than TTL after it was requested
+        requested = monotonic()
+        try:
+            self._is_leader = await self._db.acquire_lease(
+                LEADER_LEASE, self._holder, LEASE_TTL
+            )
+            if self._is_leader:
+                self._lease_expires = requested + LEASE_TTL.total_seconds()
+        except Exception:
+            # Step down rather than risk two leaders while the database is unusable
+            self._is_leader = False
+            raise
+        finally:
+            if self._is_leader != was_leader:
+                role = "leader" if self._is_leader else "standby"
+                self._logger.info(f"{self._holder} is now the {role}")
+
+    async def step_down(self):
+        """Releases the leader lease, if held, so that a standby can take
+        over without waiting for it to expire"""
+        if self._is_leader:
+            await self._db.release_lease(LEADER_LEASE, self._holder)
+            self._is_leader = False
+
+    def _holds_lease(self) -> bool:
+        """Whether this process is the leader and its lease can't have
+        expired since it was last renewed"""
+        return self._is_leader and monotonic() < self._lease_expires
+
+    def _check_lease(self):
+        """Raises NotLeader unless _holds_lease(). Called by leader-only
+        work right before it writes or sends anything."""
+        if not self._holds_lease():
+            raise NotLeader(f"{self._holder} may no longer hold the leader lease")
+
+    def _record(self, upstream: str, ok: bool):
+        breaker = self._breakers[upstream]
+        if ok:
+            if breaker.state != breaker.CLOSED:
+                self._logger.info(f"{upstream} is reachable again")
+            breaker.record_success()
+        elif breaker.record_failure():
+            self._logger.warning(f"{upstream} is unreachable, working offline")
+
+    async def cleanup(self):
+        await self._db.call("clear")
+
+    async def purge_archive(self):
+        purged = await self._db.call("purge_archive")
+        if purged:
+            self._logger.info(f"Purged {purged} archived booking(s)")
+
+    async def sync_shifts(self):
+        # Shifts are cached locally so bookings never wait on Sling
+        if not self._breakers["sling"].allow():
+            return  # keep using the cached shifts
+        start = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=1)
+        shifts = await asyncio.to_thread(self._sling.fetch_shifts, FETCH_DELTA, start)
+        self._record("sling", shifts is not None)
+        if shifts is None:
+            raise ConnectionError("Could not fetch shifts from Sling")
+
+        def replace(db: Database):
+            self._check_lease()
+            db.replace_shifts(shifts, start, start + FETCH_DELTA)
+
+        await self._db.run(replace)
+
+    async def sync_bookings(self):
+        synced = None
+        if self._breakers["bookeo"].allow():
+            synced = await self._fetch_and_store_bookings()
+            self._record("bookeo", synced is not None)
+        if synced is not None:
+            bookings, new_bookings, changed = synced
+            self._idle_syncs = 0 if new_bookings or changed else self._idle_syncs + 1
+        else:
+            # Bookeo is down, but cached bookings can still be checked for
+            # PIDs that have become invalid
+            bookings = await self._db.call("get_upcoming_bookings", FETCH_DELTA)
+            new_bookings = []
+        await self._synced.put((bookings, new_bookings))
+        await self._schedule_sync()
+        if synced is None and self._breakers["bookeo"].allow():
+            raise ConnectionError("Could not fetch bookings from Bookeo")
+
+    async def _fetch_and_store_bookings(self):
+        """Fetches bookings from Bookeo and stores them, returning the
+        bookings, the new ones and the changes to stored ones, or None if
+        Bookeo could not be reached. Requests are made off the database
+        thread, which only looks up and stores bookings in between."""
+        start = dt.datetime.now(dt.timezone.utc)
+        pending = []
+        data = await self._db.fetch(
+            "fetch_booking_list",
+            FETCH_DELTA,
+            start,
+            changed_only=True,
+            two_phase=True,
+            pending=pending,
+        )
+        if data is None:
+            return None
+        stale = await self._db.call("get_stale_booking_numbers", data)
+        details = await self._db.fetch(
+            "fetch_participants", FETCH_DELTA, start, data, stale
+        )
+        if details is None:
+            return None
+
+        def store(db: Database):
+            self._check_lease()
+            db.new_cycle()
+            bookings = db.parse_fetched_bookings(data, details)
+            new_bookings = db.insert_new_bookings(bookings)
+            # Changed bookings with new PIDs become eligible for another alert
+            changed = db.update_changed_bookings(bookings)
+            # Only now that they are stored may the windows count as unchanged
+            db.save_fetched_windows(pending)
+            return bookings, new_bookings, changed
+
+        return await self._db.run(store)
+
+    async def _schedule_sync(self):
+        """Sets the interval until the next sync from booking activity"""
+        soon = await self._db.call("get_upcoming_bookings", UPCOMING_WINDOW)
+        self._bookeo_retry_after = await self._db.call("bookeo_retry_after")
+        now = dt.datetime.now(dt.timezone.utc)
+        self._sync_interval = sync_interval(
+            now, bool(soon), self._idle_syncs, self._bookeo_retry_after
+        )
+
+    async def refresh_roster(self):
+        # Only bookings with PIDs affected by a roster change need revalidating
+        def revalidate(db: Database) -> list[tuple[Booking, list[PIDMatch]]]:
+            self._check_lease()
+            diff = db.refresh_roster()
+            if not diff:
+                return []
+            invalid = []
+            for booking_id, pids in db.revalidate_bookings(diff).items():
+                b = db.get_booking(booking_id)
+                matches = [m for m in db.match_pids(pids) if m.status != m.VALID]
+                if b is not None and matches:
+                    # A roster change warrants a fresh alert even if one was sent
+                    db.mark_admin_notified_pids(b)
+                    invalid.append((b, matches))
+            return invalid
+
+        for b, matches in await self._db.run(revalidate):
+            await self._outbox.put(self._invalid_pids_notification(b, matches))
+
+    async def notify_cancellations(self):
+        """Detects canceled bookings and sends each admin, and each employee
+        on shift at a canceled booking, one message listing all of theirs"""
+        if not self._breakers["bookeo"].allow():
+            return
+
+        start = dt.datetime.now(dt.timezone.utc)
+        ids = await self._db.fetch("fetch_booking_ids", FETCH_DELTA, start)
+        self._record("bookeo", ids is not None)
+        if ids is None:
+            raise ConnectionError("Could not fetch bookings from Bookeo")
+
+        def detect(db: Database):
+            self._check_lease()
+            canceled = db.remove_canceled_bookings(ids, FETCH_DELTA, start)
+            if not canceled:
+                return canceled, []
+            return canceled, db.get_on_shift_slack_ids([b.start for b in canceled])
+
+        canceled, staff = await self._db.run(detect)
+
+        recipients: dict[str, list[Booking]] = {}
+        for b, slack_ids in zip(canceled, staff):
+            for slack_id in dict.fromkeys([*self._admin_slack_ids, *slack_ids]):
+                recipients.setdefault(slack_id, []).append(b)
+        if canceled:
+            self._logger.info(
+                f"{len(canceled)} booking(s) canceled, alerting {len(recipients)} people"
+            )
+
+        limit = asyncio.Semaphore(SLACK_CONCURRENCY)
+
+        async def send(slack_id: str, bookings: list[Booking]):
+            m = cancellations_message(bookings)
+            async with limit:
+                failed = await self._send([slack_id], m)
+            if failed:
+                await self._db.call("journal_message", failed, m)
+
+        await asyncio.gather(*(send(i, bs) for i, bs in recipients.items()))
+
+    def _invalid_pids_notification(
+        self, b: Booking, matches: list[PIDMatch]
+    ) -> Notification:
+        # The booking has already been claimed through claim_admin_notification
+        def on_sent(db: Database):
+            for m in matches:
+                db.remove_pid(m.pid)
+            db.record_invalid_pids(b, len(matches))
+
+        def on_failed(db: Database):
+            db.release_admin_notification(b)
+
+        return Notification(
+            self._admin_slack_ids,
+            invalid_pids_message(b, matches),
+            on_sent,
+            on_failed,
+        )
+
+    async def _validate_forever(self):
+        """Turns each batch of synced bookings into notifications"""
+        while True:
+            bookings, new_bookings = await self._synced.get()
+            try:
+                for n in await self._db.run(
+                    lambda db: self.validate(db, bookings, new_bookings)
+                ):
+                    await self._outbox.put(n)
+            except Exception:
+                self._logger.exception("Error validating bookings")
+
+    def validate(
+        self,
+        db: Database,
+        bookings: list[Booking],
+        new_bookings: list[Booking],
+        claim: bool = True,
+    ) -> list[Notification]:
+        """Returns the notifications due for the given bookings. Invalid-PID
+        alerts are claimed so no other process sends them, unless claim is
+        unset (e.g. for a dry run), in which case nothing is written."""
+        notifications = []
+
+        # Notify employees of bookings made during their shift. lastChange is
+        # the creation time for bookings we haven't seen before.
+        now = dt.datetime.now(dt.timezone.utc)
+        for b in new_bookings:
+            if now - b.last_change > dt.timedelta(hours=1):
+                continue  # made before we started watching, e.g. on first sync
+            employees = db.get_on_shift_employees(b.last_change)
+            slack_ids = [db.get_slack_id(e.employee_id) for e in employees]
+            slack_ids = [i for i in slack_ids if i]
+            if slack_ids:
+                booking_datetime = b.start.astimezone(LOCAL_TIMEZONE)
+                booking_date = booking_datetime.strftime("%A, %B %-d at %-I:%M %p")
+                m = f":calendar: Booking *{b.id}* for {booking_date} was made during your shift."
+                notifications.append(Notification(slack_ids, m))
+
+        # Check for invalid on-campus PIDs
+        invalid_pids = db.get_invalid_pids([b.id for b in bookings])
+        for b in bookings:
+            # Differences in case, spacing or punctuation aren't worth an alert
+            matches = db.match_pids(invalid_pids.get(b.id, []))
+            matches = [m for m in matches if m.status != m.VALID]
+            if not matches:
+                continue
+            elif claim and not db.claim_admin_notification(b):
+                continue
+            elif not claim and db.admin_notified_pids(b):
+                continue
+            notifications.append(self._invalid_pids_notification(b, matches))
+        return notifications
+
+    async def _send(self, slack_ids: list[str], message: str) -> list[str]:
+        """Sends a message to each Slack ID, returning the IDs it could not
+        be sent to. Nothing is attempted while the Slack circuit is open."""
+        if not slack_ids:
+            return []
+        elif not self._breakers["slack"].allow():
+            return slack_ids
+        responses = await asyncio.to_thread(self._slack.send_multiple, slack_ids, message)
+        failed = [i for i, r in zip(slack_ids, responses) if r is None]
+        self._record("slack", len(failed) < len(slack_ids))
+        return failed
+
+    async def replay_outbox(self):
+        """Sends journaled messages, oldest first, stopping at the first
+        one that still can't be sent so their order is kept"""
+        for id, slack_ids, message in await self._db.call("get_journaled_messages"):
+            self._check_lease()
+            failed = await self._send(slack_ids, message)
+            if failed == slack_ids:
+                return
+
+            def done(db: Database):
+                db.remove_journaled_message(id)
+                if failed:
+                    db.journal_message(failed, message)
+
+            await self._db.run(done)
+            if failed:
+                return
+
+    async def deliver(self, n: Notification):
+        """Sends a notification, journaling it for the recipients it
+        couldn't be sent to, then runs its on_sent (or on_failed) callback"""
+        try:
+            failed = await self._send(n.slack_ids, n.message)
+            if failed:
+                # A journaled message will be delivered, so it counts as sent
+                await self._db.call("journal_message", failed, n.message)
+            if n.on_sent is not None:
+                await self._db.run(n.on_sent)
+        except Exception:
+            self._logger.exception("Error sending notification")
+            if n.on_failed is not None:
+                await self._db.run(n.on_failed)
+
+    async def _notify_forever(self):
+        while True:
+            await self.deliver(await self._outbox.get())
+
+    async def _handle_status_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Answers GET /status with the state of each task, and
+        POST /webhook (e.g. from Bookeo) by syncing bookings immediately"""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass  # headers and body are not needed
+            method, path = request_line[:2] if len(request_line) >= 2 else ("", "")
+
+            if method == "GET" and path == "/status":
+                code, body = "200 OK", {
+                    "holder": self._holder,
+                    "leader": self._holds_lease(),
+                    "upstreams": {n: b.state for n, b in self._breakers.items()},
+                    "tasks": self._status,
+                    "queued": {
+                        "synced": self._synced.qsize(),
+                        "outbox": self._outbox.qsize(),
+                        "journaled": await self._db.call("count_journaled_messages"),
+                    },
+                }
+            elif method == "POST" and path == "/webhook":
+                self._sync_now.set()
+                code, body = "202 Accepted", {"ok": True}
+            else:
+                code, body = "404 Not Found", {"ok": False}
+
+            payload = json.dumps(body).encode()
+            writer.write(
+                f"HTTP/1.1 {code}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+                + payload
+            )
+            await writer.drain()
+        finally:
+            writer.close()
@@ -1,19 +1,33 @@
+import json
 import os
 import sqlite3
+import zlib
 from csv import DictReader
 from datetime import datetime, timedelta, timezone
+from itertools import islice
 from logging import Logger
+from typing import Callable
 
-import requests
-from Booking import Booking
+from Analytics import Analytics
+from Bookeo import Bookeo
+from Booking import Booking, LazyBooking
+from BookingDiff import BookingDiff
 from Employee import Employee
+from EventLog import BookingEvent, EventLog
+from IntervalIndex import IntervalIndex
+from Leases import Leases
 from PID import PID
+from PIDMatcher import PIDMatch, PIDMatcher
+from RosterDiff import RosterDiff
+from RosterSnapshot import RosterSnapshot
+from Shift import Shift
 
 CLEAR_DELAY = timedelta(days=1)
-ZULU_FORMAT = r"%Y-%m-%dT%H:%M:00Z"
-USERAGENT = "ERIC-CTE/1.0 (nolanwelch@outlook.com)"
-
-# TODO: Split Bookeo and Database into two classes
+BUSY_TIMEOUT = 30  # seconds to wait for another process's write lock
+ROSTER_CHUNK_SIZE = 5000
+# Bump whenever _create_tables changes, so existing files are migrated
+SCHEMA_REVISION = 1
+VACUUM_PAGES = 1000  # free pages returned to the OS per retention run
 
 # TIMESTAMP GUIDELINES (from https://stackoverflow.com/a/64886073/8344620)
 # Reading:
@@ -36,6 +50,9 @@ class Database:
         roster_filepath: str,
         bookeo_secret_key: str,
         bookeo_api_key: str,
+        on_campus_category_ids: list[str] = None,
+        archive_retention: timedelta = None,
+        bookeo_session=None,
     ):
         if not os.path.exists(db_filepath):
             raise IOError("Database filepath not found")
@@ -49,107 +66,436 @@ class Database:
             if f.read(100)[:16].decode() != "SQLite format 3\x00":
                 raise IOError("Database file is not a SQLite file")
 
-        self._conn: sqlite3.Connection = sqlite3.connect(db_filepath)
+        self._conn: sqlite3.Connection = sqlite3.connect(
+            db_filepath, timeout=BUSY_TIMEOUT
+        )
         self._cur: sqlite3.Cursor = self._conn.cursor()
+        # WAL lets other processes keep reading while one of them writes
+        self._cur.execute("PRAGMA journal_mode=WAL")
         self._logger = logger
         self._logger.info("Successfully connected to SQLite database")
+        self._shift_index = IntervalIndex(self._cur, "shift_intervals")
+        self._booking_index = IntervalIndex(self._cur, "booking_intervals")
+        self._analytics = Analytics(self._cur)
+        self._events = EventLog(self._cur)
+        # One Booking object per ID, and memoized reads keyed by (kind, ID),
+        # for the current cycle (see new_cycle)
+        self._identity_map: dict[int, LazyBooking] = {}
+        self._cycle_cache: dict[tuple, object] = {}
+
+        # The schema only needs checking and migrating if the file's schema
+        # (or the schema this code expects) changed since the last startup
+        if self._schema_key() != self._get_stored_schema_key():
+            q = "SELECT tbl_name FROM sqlite_master WHERE type='table' AND tbl_name=?"
+            for table in self.DB_TABLES:
+                if self._cur.execute(q, (table,)).fetchone() is None:
+                    raise IOError(f"Table {table} not found in {db_filepath}")
 
-        q = "SELECT tbl_name FROM sqlite_master WHERE type='table' AND tbl_name=?"
-        for table in self.DB_TABLES:
-            if self._cur.execute(q, (table,)).fetchone() is None:
-                raise IOError(f"Table {table} not found in {db_filepath}")
+            self._create_tables()
+            self._set_meta("schemaKey", self._schema_key())
+            self._conn.commit()
 
         self._db_filepath = db_filepath
         self._roster_filepath = roster_filepath
+        self._roster_snapshot = RosterSnapshot(roster_filepath)
+        self._pid_matcher: PIDMatcher = None
         self._bookeo_secret_key = bookeo_secret_key
         self._bookeo_api_key = bookeo_api_key
+        self._on_campus_category_ids = (
+            on_campus_category_ids or self.ON_CAMPUS_CATEGORY_IDS
+        )
+        # How long archived bookings are kept; None keeps them forever
+        self._archive_retention = archive_retention
+        self._bookeo = Bookeo(
+            logger,
+            bookeo_secret_key,
+            bookeo_api_key,
+            # One cache per database, as tenants and shadow copies may keep
+            # their databases in one directory
+            cache_dir=f"{db_filepath}.bookeo_cache",
+            session=bookeo_session,
+        )
+
+    def _schema_key(self) -> str:
+        version = self._cur.execute("PRAGMA schema_version").fetchone()[0]
+        return f"{SCHEMA_REVISION}:{version}"
+
+    def _get_stored_schema_key(self) -> str:
+        try:
+            return self._get_meta("schemaKey")
+        except sqlite3.OperationalError:
+            return None  # no meta table yet
+
+    def _create_tables(self):
+        """Creates any tables added since the original schema"""
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS shifts (
+                id INTEGER PRIMARY KEY,
+                employeeID INTEGER NOT NULL,
+                start REAL NOT NULL,
+                end REAL NOT NULL
+            )"""
+        )
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS roster (
+                pid INTEGER PRIMARY KEY,
+                firstName TEXT NOT NULL,
+                lastName TEXT NOT NULL
+            )"""
+        )
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value
+            )"""
+        )
+        # Past bookings, with their PIDs compressed as JSON since they are
+        # only read back for reports
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS bookings_archive (
+                id INTEGER PRIMARY KEY,
+                timestamp REAL NOT NULL,
+                lastChange REAL NOT NULL,
+                email TEXT,
+                pids BLOB NOT NULL
+            )"""
+        )
+        self._cur.execute(
+            """CREATE INDEX IF NOT EXISTS bookingsArchiveTimestamp
+            ON bookings_archive (timestamp)"""
+        )
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                slackIDs TEXT NOT NULL,
+                message TEXT NOT NULL,
+                created REAL NOT NULL
+            )"""
+        )
+        Leases(self._cur).create()
+        columns = [r[1] for r in self._cur.execute("PRAGMA table_info(bookings)")]
+        if "bookeoPIDs" not in columns:
+            # The PIDs as last sent by Bookeo, to diff changed bookings against
+            self._cur.execute("ALTER TABLE bookings ADD COLUMN bookeoPIDs TEXT")
+        self._cur.execute(
+            "CREATE INDEX IF NOT EXISTS bookingsTimestamp ON bookings (timestamp)"
+        )
+        self._cur.execute("CREATE INDEX IF NOT EXISTS pidsPID ON pids (pid)")
+        self._cur.execute("CREATE INDEX IF NOT EXISTS pidsBookingID ON pids (bookingID)")
+        self._cur.execute("DROP TABLE IF EXISTS shifts_index")
+        self._shift_index.create()
+        self._booking_index.create()
+
+        # Backfill rows stored before the interval indexes existed. Bookings
+        # don't store an end time, so they are indexed as a single point.
+        q = """SELECT id, start, end FROM shifts
+            WHERE id NOT IN (SELECT id FROM shift_intervals)"""
+        self._shift_index.insert(self._cur.execute(q).fetchall())
+        q = """SELECT id, timestamp, timestamp FROM bookings
+            WHERE id NOT IN (SELECT id FROM booking_intervals)"""
+        self._booking_index.insert(self._cur.execute(q).fetchall())
+
+        self._events.create()
+
+        # Backfill booking counts for the reports from everything stored so far
+        self._analytics.create()
+        if self._analytics.is_empty():
+            q = """SELECT timestamp FROM bookings
+                UNION ALL SELECT timestamp FROM bookings_archive"""
+            for (ts,) in self._cur.execute(q).fetchall():
+                self._analytics.record(datetime.fromtimestamp(ts, timezone.utc), "booked")
+        self._conn.commit()
+
+        # Let purge_archive hand freed pages back without a full VACUUM.
+        # Switching an existing file over needs one VACUUM, done only once.
+        if self._cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            self._cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._cur.execute("VACUUM")
 
     def clear(self):
-        """Removes expired bookings from the local database"""
+        """Moves expired bookings to the archive and removes expired shifts"""
         now = datetime.now(timezone.utc).timestamp()
-        q = "SELECT id FROM bookings WHERE timestamp<?"
-        res = self._cur.execute(q, (now,)).fetchall()
-        stale_ids = [(r[0],) for r in res]
-        if stale_ids:
-            self._cur.executemany("DELETE FROM bookings WHERE id=?", stale_ids)
-            self._cur.executemany("DELETE FROM pids WHERE bookingID=?", stale_ids)
+        self.archive_bookings(now)
+
+        q = "DELETE FROM shifts WHERE end<? RETURNING id"
+        stale_ids = [r[0] for r in self._cur.execute(q, (now,)).fetchall()]
+        self._shift_index.delete(stale_ids)
+        self._conn.commit()
+
+    def archive_bookings(self, before: float) -> int:
+        """Moves bookings starting before the given timestamp, with their
+        PIDs, into bookings_archive in a single transaction. Returns the
+        number of bookings archived."""
+        q = """SELECT p.bookingID, p.pid, p.firstName, p.lastName
+            FROM pids p JOIN bookings b ON b.id=p.bookingID
+            WHERE b.timestamp<?"""
+        pids: dict[int, list] = {}
+        for booking_id, *pid in self._cur.execute(q, (before,)).fetchall():
+            pids.setdefault(booking_id, []).append(pid)
+
+        q = """DELETE FROM pids
+            WHERE bookingID IN (SELECT id FROM bookings WHERE timestamp<?)"""
+        self._cur.execute(q, (before,))
+        q = """DELETE FROM bookings WHERE timestamp<?
+            RETURNING id, timestamp, lastChange, email"""
+        rows = self._cur.execute(q, (before,)).fetchall()
+        if not rows:
             self._conn.commit()
+            return 0
+
+        q = """INSERT OR REPLACE INTO bookings_archive
+            (id, timestamp, lastChange, email, pids)
+            VALUES (?, ?, ?, ?, ?)"""
+        self._cur.executemany(
+            q,
+            [
+                (*r, zlib.compress(json.dumps(pids.get(r[0], [])).encode()))
+                for r in rows
+            ],
+        )
+        self._booking_index.delete([r[0] for r in rows])
+        for r in rows:
+            self._forget(r[0])
+        self._events.append(BookingEvent.EXPIRED, [(r[0], {"start": r[1]}) for r in rows])
+        self._conn.commit()
+        self._logger.info(f"Archived {len(rows)} booking(s)")
+        return len(rows)
 
-    def fetch_bookings(self, delta: timedelta, start: datetime = None) -> list[Booking]:
+    def get_archived_bookings(self, start: datetime, end: datetime) -> list[Booking]:
+        """Returns archived Bookings that started between start and end"""
+        q = """SELECT id, timestamp, lastChange, email, pids
+            FROM bookings_archive
+            WHERE timestamp>=? AND timestamp<?
+            ORDER BY timestamp"""
+        res = self._cur.execute(q, (start.timestamp(), end.timestamp())).fetchall()
+        return [
+            Booking(
+                r[0],
+                datetime.fromtimestamp(r[1], timezone.utc),
+                [PID(*p) for p in json.loads(zlib.decompress(r[4]))],
+                datetime.fromtimestamp(r[2], timezone.utc),
+                r[3] or "",
+            )
+            for r in res
+        ]
+
+    def purge_archive(self) -> int:
+        """Deletes archived bookings older than the retention period and
+        returns freed pages to the filesystem. Returns the number purged."""
+        purged = 0
+        if self._archive_retention is not None:
+            cutoff = datetime.now(timezone.utc) - self._archive_retention
+            q = "DELETE FROM bookings_archive WHERE timestamp<?"
+            purged = self._cur.execute(q, (cutoff.timestamp(),)).rowcount
+            self._events.purge(cutoff.timestamp())
+            self._conn.commit()
+        self._cur.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+        return purged
+
+    def fetch_bookings(
+        self,
+        delta: timedelta,
+        start: datetime = None,
+        changed_only: bool = False,
+        two_phase: bool = False,
+        pending: list = None,
+    ) -> list[Booking] | None:
         """Use the Bookeo API to fetch all Bookings scheduled
-        between start and (start + delta)"""
+        between start and (start + delta). If changed_only is set, Bookings
+        from windows that haven't changed since the last fetch are skipped.
+
+        If two_phase is set, the booking list is fetched without participants
+        and participant details are only fetched for Bookings that are new or
+        have changed since they were stored locally.
+
+        If pending is given, the fetched windows only count as unchanged
+        once it is passed to save_fetched_windows, which callers do after
+        storing the Bookings so that a failed sync is retried in full.
+
+        Returns None if Bookeo could not be reached."""
         if start is None:
             start = datetime.now(timezone.utc)
-        res = requests.get(
-            "https://api.bookeo.com/v2/bookings",
-            params={
-                "startTime": start.strftime(ZULU_FORMAT),
-                "endTime": (start + delta).strftime(ZULU_FORMAT),
-                "secretKey": self._bookeo_secret_key,
-                "apiKey": self._bookeo_api_key,
-                "expandParticipants": True,
-                "itemsPerPage": 100,
-            },
-            headers={"User-Agent": USERAGENT},
+        data = self.fetch_booking_list(delta, start, changed_only, two_phase, pending)
+        if data is None:
+            return None
+        if not two_phase:
+            return self.parse_fetched_bookings(data)
+        stale = self.get_stale_booking_numbers(data)
+        details = self.fetch_participants(delta, start, data, stale)
+        if details is None:
+            return None
+        return self.parse_fetched_bookings(data, details)
+
+    # fetch_bookings in steps, for callers that make the requests to Bookeo
+    # on another thread than the one using the database (see DatabaseWorker).
+    # fetch_booking_list and fetch_participants don't touch the database.
+
+    def fetch_booking_list(
+        self,
+        delta: timedelta,
+        start: datetime,
+        changed_only: bool = False,
+        two_phase: bool = False,
+        pending: list = None,
+    ) -> list[dict]:
+        """Fetches the raw bookings for fetch_bookings, without their
+        participants if two_phase is set. Returns None if Bookeo could not
+        be reached."""
+        return self._bookeo.fetch_bookings(
+            start,
+            start + delta,
+            changed_only=changed_only,
+            pending=pending,
+            expandParticipants=not two_phase,
         )
-        if res.status_code != 200:
-            self._logger.error("Could not fetch bookings from Bookeo")
-            return []
 
-        data = res.json()["data"]
-        self._logger.info(f"Fetched {len(data)} booking(s) from Bookeo")
+    def get_stale_booking_numbers(self, data: list[dict]) -> list[str]:
+        """Returns the numbers of the raw bookings that are new or have
+        changed since they were stored locally"""
+        ids = [int(b["bookingNumber"]) for b in data]
+        q = f"""SELECT id, lastChange FROM bookings
+            WHERE id IN ({", ".join("?" * len(ids))})"""
+        local_changes = dict(self._cur.execute(q, ids).fetchall())
+        return [
+            b["bookingNumber"]
+            for b in data
+            if int(b["bookingNumber"]) not in local_changes
+            or "lastChangeTime" not in b
+            or datetime.fromisoformat(b["lastChangeTime"]).timestamp()
+            > local_changes[int(b["bookingNumber"])]
+        ]
 
+    def fetch_participants(
+        self,
+        delta: timedelta,
+        start: datetime,
+        data: list[dict],
+        booking_numbers: list[str],
+    ) -> dict[str, dict]:
+        """Fetches the given raw bookings with their participants, keyed by
+        booking number. Returns None if Bookeo could not be reached."""
+        details = self._bookeo.fetch_participants(
+            start, start + delta, data, booking_numbers
+        )
+        if details is not None:
+            self._logger.info(
+                f"Fetched participants for {len(booking_numbers)} "
+                f"of {len(data)} booking(s)"
+            )
+        return details
+
+    def parse_fetched_bookings(
+        self, data: list[dict], details: dict[str, dict] = None
+    ) -> list[Booking]:
+        """Builds Bookings from raw bookings fetched with their participants,
+        or, given the details fetched for the stale ones, from the stored
+        Bookings for the rest"""
+        if details is None:
+            return [self._parse_booking(b) for b in data]
         bookings = []
         for b in data:
-            on_campus_pids: list[PID] = []
-            email = ""
-            for p in b["participants"]["details"]:
-                if p["personId"] == "PSELF":
-                    email = p["personDetails"]["emailAddress"]
-                if p["peopleCategoryId"] not in self.ON_CAMPUS_CATEGORY_IDS:
-                    continue
-                pid = self._extract_pid(p["personDetails"]["customFields"])
-                first_name = p["personDetails"]["firstName"]
-                last_name = p["personDetails"]["lastName"]
-                on_campus_pids.append(PID(pid, first_name, last_name))
-
-            id = int(b["bookingNumber"])
-
-            if "lastChangeTime" in b.keys():
-                last_change = datetime.fromisoformat(b["lastChangeTime"])
-                self._delete_if_lastchange_stale(id, last_change)
-            else:
-                last_change = datetime.now(timezone.utc)
+            if b["bookingNumber"] in details:
+                bookings.append(self._parse_booking(details[b["bookingNumber"]]))
+                continue
+            # Unchanged, or gone from Bookeo since the list was fetched
+            stored = self.get_booking(int(b["bookingNumber"]))
+            if stored is not None:
+                bookings.append(stored)
+        return bookings
 
-            bookings.append(
-                Booking(
-                    id,
-                    datetime.fromisoformat(b["startTime"]),
-                    on_campus_pids,
-                    last_change,
-                    email,
-                )
-            )
+    def save_fetched_windows(self, pending: list):
+        """Marks the windows collected by fetch_bookings as unchanged"""
+        self._bookeo.save_windows(pending)
 
-        return bookings
+    def bookeo_retry_after(self) -> float:
+        """Returns the seconds until Bookeo will accept requests again after
+        rate limiting this client, or 0"""
+        return self._bookeo.retry_after()
+
+    def fetch_booking_ids(self, delta: timedelta, start: datetime = None) -> set[int]:
+        """Use the Bookeo API to fetch the IDs of all Bookings scheduled
+        between start and (start + delta), without their participants.
+        Returns None if Bookeo could not be reached."""
+        if start is None:
+            start = datetime.now(timezone.utc)
+        # Kept apart in the response cache from the booking list that
+        # two-phase syncs fetch, so that this fetch can't make a changed
+        # window look unchanged to the next sync
+        data = self._bookeo.fetch_bookings(
+            start, start + delta, cache_scope="ids", expandParticipants=False
+        )
+        if data is None:
+            return None
+        return {int(b["bookingNumber"]) for b in data}
+
+    def _parse_booking(self, b: dict) -> Booking:
+        """Builds a Booking from a participant-expanded Bookeo booking"""
+        on_campus_pids: list[PID] = []
+        email = ""
+        for p in b["participants"]["details"]:
+            if p["personId"] == "PSELF":
+                email = p["personDetails"]["emailAddress"]
+            if p["peopleCategoryId"] not in self._on_campus_category_ids:
+                continue
+            pid = self._extract_pid(p["personDetails"]["customFields"])
+            first_name = p["personDetails"]["firstName"]
+            last_name = p["personDetails"]["lastName"]
+            on_campus_pids.append(PID(pid, first_name, last_name))
+
+        id = int(b["bookingNumber"])
 
-    def insert_new_bookings(self, bookings: list[Booking]):
+        if "lastChangeTime" in b.keys():
+            last_change = datetime.fromisoformat(b["lastChangeTime"])
+        else:
+            last_change = datetime.now(timezone.utc)
+
+        return Booking(
+            id,
+            datetime.fromisoformat(b["startTime"]),
+            on_campus_pids,
+            last_change,
+            email,
+            datetime.fromisoformat(b["endTime"]) if "endTime" in b else None,
+        )
+
+    def insert_new_bookings(self, bookings: list[Booking]) -> list[Booking]:
         """Inserts only new bookings into the local database
-        (determined by comparing booking IDs)"""
+        (determined by comparing booking IDs) and returns them"""
         q = "SELECT id FROM bookings"
         res = self._cur.execute(q).fetchall()
-        local_ids = [r[0] for r in res]
+        local_ids = {r[0] for r in res}
 
+        new_bookings = []
         for b in bookings:
             if b.id in local_ids:
                 continue
             timestamp = b.start.timestamp()
             last_change = b.last_change.timestamp()
-            q = """INSERT INTO bookings (id, timestamp, lastChange, email)
-                VALUES (?, ?, ?, ?)"""
+            # Another process may have inserted the booking since we looked
+            q = """INSERT OR IGNORE INTO bookings
+                (id, timestamp, lastChange, email, bookeoPIDs)
+                VALUES (?, ?, ?, ?, ?)"""
             self._cur.execute(
                 q,
-                (b.id, timestamp, last_change, b.email),
+                (b.id, timestamp, last_change, b.email, self._pid_set(b.on_campus_pids)),
+            )
+            if self._cur.rowcount == 0:
+                continue
+            new_bookings.append(b)
+            self._forget(b.id)
+            self._analytics.record(b.start, "booked")
+            self._events.append(
+                BookingEvent.CREATED,
+                [
+                    (
+                        b.id,
+                        {
+                            "start": timestamp,
+                            "lastChange": last_change,
+                            "pids": [p.id for p in b.on_campus_pids],
+                        },
+                    )
+                ],
             )
             q = """INSERT INTO pids (pid, firstName, lastName, bookingID)
                 VALUES (?, ?, ?, ?)"""
@@ -157,37 +503,79 @@ class Database:
                 q,
                 [(p.id, p.first_name, p.last_name, b.id) for p in b.on_campus_pids],
             )
+        self._booking_index.insert(
+            [(b.id, b.start.timestamp(), b.end.timestamp()) for b in new_bookings]
+        )
 
         self._conn.commit()
+        return new_bookings
 
     # TODO: Rewrite this using Bookeo's "canceled" field
-    def get_remove_canceled_bookings(self, delta: timedelta) -> list[Booking]:
-        """Checks for any Bookings that are stored locally but no longer
-        visible from the Bookeo API, indicating that the event was canceled.
-        Also removes these Bookings from the local database."""
-        api_bookings = self.fetch_bookings(delta)
-        api_bookings_ids = [b.id for b in api_bookings]
-
-        q = """SELECT id, timestamp, lastChange
-        FROM bookings"""
-        local_bookings = self._cur.execute(q).fetchall()
-        local_bookings = [
-            Booking(
-                r[0],
-                datetime.fromtimestamp(int(r[1]), timezone.utc),
-                self.get_on_campus_pids(r[0]),
-                datetime.fromtimestamp(int(r[2]), timezone.utc),
-                "",
-            )
-            for r in local_bookings
-        ]
-        canceled_bookings = [b for b in local_bookings if b.id not in api_bookings_ids]
-        canceled_ids = [(b.id,) for b in canceled_bookings]
+    def get_remove_canceled_bookings(self, delta: timedelta) -> list[Booking] | None:
+        """Checks for any Bookings between now and (now + delta) that are
+        stored locally but no longer visible from the Bookeo API, indicating
+        that the event was canceled. Also removes these Bookings from the
+        local database. Returns None if Bookeo could not be reached."""
+        start = datetime.now(timezone.utc)
+        api_bookings_ids = self.fetch_booking_ids(delta, start)
+        if api_bookings_ids is None:
+            return None  # can't tell what was canceled without the API
+        return self.remove_canceled_bookings(api_bookings_ids, delta, start)
 
-        q = "DELETE FROM bookings WHERE id=?"
-        self._cur.executemany(q, canceled_ids)
-        q = "DELETE FROM pids WHERE bookingID=?"
-        self._cur.executemany(q, canceled_ids)
+    def remove_canceled_bookings(
+        self, api_bookings_ids: set[int], delta: timedelta, start: datetime
+    ) -> list[Booking]:
+        """Removes and returns the Bookings between start and (start + delta)
+        that are stored locally but not among the IDs fetched from Bookeo
+        with fetch_booking_ids over the same range, which must have been
+        fetched no earlier than start"""
+        # Bookings that have already started are no longer returned by the
+        # API but haven't been archived yet, so only the fetched range counts.
+        # Bookings changed since start may have been created after the IDs
+        # were fetched and stored by a sync since, so they are left for the
+        # next check. Deleting a booking claims its cancellation: if another
+        # process is removing the same ones, each row is returned to only one
+        # of them, so each cancellation is alerted on once.
+        ids = list(api_bookings_ids)
+        q = f"""DELETE FROM bookings
+            WHERE timestamp>=? AND timestamp<? AND lastChange<?
+                AND id NOT IN ({", ".join("?" * len(ids))})
+            RETURNING id, timestamp, lastChange, email"""
+        rows = self._cur.execute(
+            q,
+            (start.timestamp(), (start + delta).timestamp(), start.timestamp(), *ids),
+        ).fetchall()
+        canceled_ids = [r[0] for r in rows]
+        placeholders = ", ".join("?" * len(canceled_ids))
+        q = f"SELECT id, end FROM booking_intervals WHERE id IN ({placeholders})"
+        ends = dict(self._cur.execute(q, canceled_ids).fetchall())
+        q = f"""DELETE FROM pids WHERE bookingID IN ({placeholders})
+            RETURNING bookingID, pid, firstName, lastName"""
+        pids: dict[int, list[PID]] = {}
+        for r in self._cur.execute(q, canceled_ids).fetchall():
+            pids.setdefault(r[0], []).append(PID(r[1], r[2], r[3]))
+
+        canceled_bookings = []
+        for id, timestamp, last_change, email in rows:
+            self._forget(id)
+            end = ends.get(id)
+            canceled_bookings.append(
+                Booking(
+                    id,
+                    datetime.fromtimestamp(timestamp, timezone.utc),
+                    pids.get(id, []),
+                    datetime.fromtimestamp(last_change, timezone.utc),
+                    email or "",
+                    datetime.fromtimestamp(end, timezone.utc) if end is not None else None,
+                )
+            )
+        self._booking_index.delete(canceled_ids)
+        for b in canceled_bookings:
+            self._analytics.record(b.start, "canceled")
+        self._events.append(
+            BookingEvent.CANCELED,
+            [(b.id, {"start": b.start.timestamp()}) for b in canceled_bookings],
+        )
         self._conn.commit()
 
         return canceled_bookings
@@ -198,93 +586,485 @@ class Database:
                 return int(f["value"]) or 0
         return 0
 
+    def close(self):
+        """Closes the connection and stops the Bookeo client's threads"""
+        self._bookeo.close()
+        self._roster_snapshot.close()
+        self._conn.close()
+
+    def new_cycle(self):
+        """Starts a new sync cycle, dropping the Bookings and reads memoized
+        during the last one. Writes aren't held back for the cycle: each
+        method commits its own, since an open write transaction would lock
+        out other processes sharing the database (and lease renewals)."""
+        self._identity_map.clear()
+        self._cycle_cache.clear()
+
+    def _cached(self, key: tuple, read: Callable[[], object]):
+        """Memoizes read() under key until the cycle ends or the key is
+        invalidated by a write"""
+        if key not in self._cycle_cache:
+            self._cycle_cache[key] = read()
+        return self._cycle_cache[key]
+
+    def _forget(self, booking_id: int):
+        """Invalidates everything memoized about a Booking after a write"""
+        self._identity_map.pop(booking_id, None)
+        self._cycle_cache.pop(("pids", booking_id), None)
+        self._cycle_cache.pop(("notified", booking_id), None)
+
+    def _booking_from_row(self, row: tuple) -> LazyBooking:
+        """Returns the Booking for an (id, timestamp, lastChange, email, end)
+        row, reusing the object already handed out this cycle if there is one"""
+        b = self._identity_map.get(row[0])
+        if b is None:
+            b = LazyBooking(
+                row[0],
+                datetime.fromtimestamp(row[1], timezone.utc),
+                datetime.fromtimestamp(row[2], timezone.utc),
+                row[3] or "",
+                datetime.fromtimestamp(row[4], timezone.utc) if row[4] is not None else None,
+                self.get_on_campus_pids,
+            )
+            self._identity_map[row[0]] = b
+        return b
+
     def get_on_campus_pids(self, booking_id: int) -> list[PID]:
         """Returns the on-campus PIDs associated with a Booking"""
-        q = """SELECT pid, firstName, lastName
-            FROM pids
-            WHERE bookingID=?"""
-        pids = self._cur.execute(q, (booking_id,)).fetchall()
-        return [PID(p[0], p[1], p[2]) for p in pids]
+
+        def read():
+            q = """SELECT pid, firstName, lastName
+                FROM pids
+                WHERE bookingID=?"""
+            pids = self._cur.execute(q, (booking_id,)).fetchall()
+            return [PID(p[0], p[1], p[2]) for p in pids]
+
+        return list(self._cached(("pids", booking_id), read))
+
+    def _get_meta(self, key: str):
+        res = self._cur.execute("SELECT value FROM meta WHERE key=?", (key,))
+        res = res.fetchone()
+        return res[0] if res is not None else None
+
+    def _set_meta(self, key: str, value):
+        q = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+        self._cur.execute(q, (key, value))
+
+    def refresh_roster(self) -> RosterDiff:
+        """Reloads the roster if the CSV has changed since the last load.
+        Returns the resulting RosterDiff, or None if nothing was reloaded."""
+        if self._roster_snapshot.refresh():
+            self._pid_matcher = None
+        mtime = os.path.getmtime(self._roster_filepath)
+        if self._get_meta("rosterMtime") == mtime:
+            return None
+        diff = self.load_roster(self._roster_filepath)
+        self._set_meta("rosterMtime", mtime)
+        self._conn.commit()
+        return diff
+
+    def rebuild_roster_index(self) -> RosterDiff:
+        """Recompiles the roster snapshot and reloads the roster table from
+        the CSV, whether or not they look out of date"""
+        self._roster_snapshot.rebuild()
+        self._pid_matcher = None
+        diff = self.load_roster(self._roster_filepath)
+        self._set_meta("rosterMtime", os.path.getmtime(self._roster_filepath))
+        self._conn.commit()
+        return diff
+
+    def load_roster(self, filepath: str) -> RosterDiff:
+        """Streams a roster CSV into the roster table and returns
+        what changed since the previous load"""
+        self._cur.execute("DROP TABLE IF EXISTS temp.roster_staging")
+        self._cur.execute(
+            """CREATE TEMP TABLE roster_staging (
+                pid INTEGER PRIMARY KEY,
+                firstName TEXT NOT NULL,
+                lastName TEXT NOT NULL
+            )"""
+        )
+
+        skipped = 0
+        q = """INSERT OR REPLACE INTO roster_staging (pid, firstName, lastName)
+            VALUES (?, ?, ?)"""
+        with open(filepath, "r", newline="") as f:
+            reader = DictReader(f)
+            while chunk := list(islice(reader, ROSTER_CHUNK_SIZE)):
+                rows = []
+                for r in chunk:
+                    pid = (r.get("PID") or "").strip()
+                    if not (pid.isdigit() and r.get("firstName") and r.get("lastName")):
+                        skipped += 1
+                        continue
+                    rows.append((int(pid), r["firstName"], r["lastName"]))
+                self._cur.executemany(q, rows)
+        if skipped:
+            self._logger.warning(f"Skipped {skipped} malformed roster row(s)")
+
+        q = """SELECT s.pid, s.firstName, s.lastName
+            FROM roster_staging s
+            LEFT JOIN roster r ON r.pid=s.pid
+            WHERE r.pid IS NULL"""
+        added = [PID(*r) for r in self._cur.execute(q).fetchall()]
+        q = """SELECT r.pid, r.firstName, r.lastName
+            FROM roster r
+            LEFT JOIN roster_staging s ON s.pid=r.pid
+            WHERE s.pid IS NULL"""
+        removed = [PID(*r) for r in self._cur.execute(q).fetchall()]
+        q = """SELECT r.pid, r.firstName, r.lastName, s.firstName, s.lastName
+            FROM roster r
+            JOIN roster_staging s ON s.pid=r.pid
+            WHERE r.firstName!=s.firstName OR r.lastName!=s.lastName"""
+        renamed = [
+            (PID(r[0], r[1], r[2]), PID(r[0], r[3], r[4]))
+            for r in self._cur.execute(q).fetchall()
+        ]
+
+        # Apply only the changes rather than rewriting the whole table
+        self._cur.executemany(
+            "DELETE FROM roster WHERE pid=?", [(p.id,) for p in removed]
+        )
+        self._cur.executemany(
+            "INSERT OR REPLACE INTO roster (pid, firstName, lastName) VALUES (?, ?, ?)",
+            [(p.id, p.first_name, p.last_name) for p in added]
+            + [(p.id, p.first_name, p.last_name) for _, p in renamed],
+        )
+        self._cur.execute("DROP TABLE temp.roster_staging")
+        self._conn.commit()
+
+        diff = RosterDiff(added, removed, renamed)
+        self._logger.info(f"Loaded roster: {diff}")
+        return diff
 
     def get_matching_pid(self, pid: PID) -> PID:
-        with open(self._roster_filepath, "r") as f:
-            for r in DictReader(f):
-                if int(r["PID"]) == pid.id:
-                    return PID(int(r["PID"], r["firstName"], r["lastName"]))
-        return None
+        """Returns the roster entry with the same PID, if there is one"""
+        return self._roster_snapshot.get(pid.id)
+
+    def match_pids(self, pids: list[PID]) -> list[PIDMatch]:
+        """Fuzzy-matches PIDs against the roster, suggesting
+        corrections for near-misses"""
+        if self._pid_matcher is None:
+            self._pid_matcher = PIDMatcher(self._roster_snapshot)
+        return [self._pid_matcher.match(p) for p in pids]
+
+    def get_invalid_pids(self, booking_ids: list[int]) -> dict[int, list[PID]]:
+        """Returns the on-campus PIDs of the given Bookings that don't match
+        the roster, keyed by booking ID"""
+        q = f"""SELECT p.bookingID, p.pid, p.firstName, p.lastName
+            FROM pids p
+            LEFT JOIN roster r ON r.pid=p.pid
+            WHERE p.bookingID IN ({", ".join("?" * len(booking_ids))})
+                AND (r.pid IS NULL OR r.lastName!=p.lastName)"""
+        invalid: dict[int, list[PID]] = {}
+        for r in self._cur.execute(q, booking_ids).fetchall():
+            invalid.setdefault(r[0], []).append(PID(r[1], r[2], r[3]))
+        return invalid
+
+    def revalidate_bookings(self, diff: RosterDiff) -> dict[int, list[PID]]:
+        """Returns the invalid PIDs of only those Bookings
+        that contain a PID affected by the diff"""
+        ids = list(diff.affected_ids)
+        if not ids:
+            return {}
+        q = f"""SELECT DISTINCT bookingID FROM pids
+            WHERE pid IN ({", ".join("?" * len(ids))})"""
+        booking_ids = [r[0] for r in self._cur.execute(q, ids).fetchall()]
+        return self.get_invalid_pids(booking_ids)
 
     def get_admins(self) -> list[Employee]:
         q = """SELECT firstName, lastName, id
             FROM employees
             WHERE isAdmin=1"""
-        res = self._cur.execute(q).fetchall()
+        res = self._cached(("admins",), lambda: self._cur.execute(q).fetchall())
         return [Employee(r[0], r[1], r[2]) for r in res]
 
+    def get_employee_ids(self) -> list[int]:
+        return [r[0] for r in self._cur.execute("SELECT id FROM employees")]
+
     def get_slack_id(self, employee_id: int) -> str:
         """Returns an Employee's Slack ID"""
         q = """SELECT slackID
             FROM employees
             WHERE id=?"""
-        res = self._cur.execute(q, (employee_id,)).fetchone()
+        res = self._cached(
+            ("slack", employee_id),
+            lambda: self._cur.execute(q, (employee_id,)).fetchone(),
+        )
         if res is not None:
             return res[0]
         return ""
 
+    def replace_shifts(self, shifts: list[Shift], start: datetime, end: datetime):
+        """Replaces all locally stored Shifts overlapping start and end
+        with the given Shifts"""
+        ids = self._shift_index.overlapping(start.timestamp(), end.timestamp())
+        q = f"""SELECT id FROM shifts
+            WHERE start<? AND end>? AND id IN ({", ".join("?" * len(ids))})"""
+        res = self._cur.execute(q, (end.timestamp(), start.timestamp(), *ids))
+        old_ids = [r[0] for r in res.fetchall()]
+        self._cur.executemany("DELETE FROM shifts WHERE id=?", [(i,) for i in old_ids])
+        self._shift_index.delete(old_ids)
+
+        q = "INSERT INTO shifts (employeeID, start, end) VALUES (?, ?, ?)"
+        intervals = []
+        for s in shifts:
+            ts = (s.start.timestamp(), s.end.timestamp())
+            self._cur.execute(q, (s.employee_id, *ts))
+            intervals.append((self._cur.lastrowid, *ts))
+        self._shift_index.insert(intervals)
+        self._conn.commit()
+
+    def get_on_shift_employees(self, dt: datetime) -> list[Employee]:
+        """Returns all Employees working a Shift at the given datetime"""
+        ids = self._shift_index.covering(dt.timestamp())
+        q = f"""SELECT DISTINCT e.firstName, e.lastName, e.id
+            FROM shifts s
+            JOIN employees e ON e.id=s.employeeID
+            WHERE s.id IN ({", ".join("?" * len(ids))})"""
+        res = self._cur.execute(q, ids).fetchall()
+        return [Employee(r[0], r[1], r[2]) for r in res]
+
+    def get_on_shift_slack_ids(self, times: list[datetime]) -> list[list[str]]:
+        """Returns the Slack IDs of the Employees on shift at each of the
+        given datetimes, looking up all of their Slack IDs in one query"""
+        shift_ids = [self._shift_index.covering(t.timestamp()) for t in times]
+        ids = list({i for s in shift_ids for i in s})
+        q = f"""SELECT s.id, e.slackID
+            FROM shifts s
+            JOIN employees e ON e.id=s.employeeID
+            WHERE s.id IN ({", ".join("?" * len(ids))}) AND e.slackID IS NOT NULL"""
+        slack_ids = dict(self._cur.execute(q, ids).fetchall())
+        return [
+            list(dict.fromkeys(slack_ids[i] for i in s if slack_ids.get(i)))
+            for s in shift_ids
+        ]
+
+    def get_booking(self, booking_id: int) -> Booking:
+        """Returns the locally stored Booking with the given ID, if any"""
+        q = """SELECT b.id, b.timestamp, b.lastChange, b.email, i.end
+            FROM bookings b
+            LEFT JOIN booking_intervals i ON i.id=b.id
+            WHERE b.id=?"""
+        b = self._cur.execute(q, (booking_id,)).fetchone()
+        if b is None:
+            return None
+        return self._booking_from_row(b)
+
+    def get_overlapping_bookings(self, start: datetime, end: datetime) -> list[Booking]:
+        """Returns all Bookings that are in progress at any point
+        between start and end"""
+        ids = self._booking_index.overlapping(start.timestamp(), end.timestamp())
+        q = f"""SELECT b.id, b.timestamp, b.lastChange, b.email, i.end
+            FROM bookings b
+            JOIN booking_intervals i ON i.id=b.id
+            WHERE b.id IN ({", ".join("?" * len(ids))})"""
+        bookings = self._cur.execute(q, ids).fetchall()
+        return [self._booking_from_row(b) for b in bookings]
+
     def remove_pid(self, pid: PID):
-        q = "DELETE FROM pids WHERE pid=?"
-        self._cur.execute(q, (pid.id,))
+        q = "DELETE FROM pids WHERE pid=? RETURNING bookingID"
+        booking_ids = {r[0] for r in self._cur.execute(q, (pid.id,)).fetchall()}
+        for id in booking_ids:
+            self._forget(id)
+        self._events.append(
+            BookingEvent.PID_INVALIDATED,
+            [(id, {"pid": pid.id}) for id in sorted(booking_ids)],
+        )
         self._conn.commit()
 
+    def get_all_bookings(self) -> list[Booking]:
+        """Returns every locally stored Booking, including ones in progress"""
+        q = """SELECT b.id, b.timestamp, b.lastChange, b.email, i.end
+            FROM bookings b
+            LEFT JOIN booking_intervals i ON i.id=b.id
+            ORDER BY b.timestamp"""
+        return [self._booking_from_row(b) for b in self._cur.execute(q).fetchall()]
+
     def get_upcoming_bookings(self, delta: timedelta) -> list[Booking]:
         """Returns all Bookings scheduled between now and (now + delta)"""
         t = datetime.now(timezone.utc)
-        q = """SELECT id, timestamp, lastChange
-            FROM bookings
-            WHERE timestamp BETWEEN ? AND ?"""
+        q = """SELECT b.id, b.timestamp, b.lastChange, b.email, i.end
+            FROM bookings b
+            LEFT JOIN booking_intervals i ON i.id=b.id
+            WHERE b.timestamp BETWEEN ? AND ?"""
         bookings = self._cur.execute(
             q, (t.timestamp(), (t + delta).timestamp())
         ).fetchall()
+        return [self._booking_from_row(b) for b in bookings]
 
-        return [
-            Booking(
-                b[0],
-                datetime.fromtimestamp(b[1], timezone.utc),
-                self.get_on_campus_pids(b[0]),
-                b[2],
+    def get_changed_bookings(self, delta: timedelta) -> list[Booking]:
+        """Fetches the Bookings between now and (now + delta) from Bookeo,
+        updates any stored ones that have changed and returns those"""
+        bookings = self.fetch_bookings(delta)
+        if bookings is None:
+            return []
+        return [d.booking for d in self.update_changed_bookings(bookings)]
+
+    @staticmethod
+    def _pid_set(pids: list[PID]) -> str:
+        return json.dumps(sorted([p.id, p.first_name, p.last_name] for p in pids))
+
+    def update_changed_bookings(self, bookings: list[Booking]) -> list[BookingDiff]:
+        """Compares Bookings that are already stored with their stored copy
+        and updates only the fields that changed. Bookings with newly added
+        PIDs have their admin notification reset, so that only those PIDs
+        (invalid PIDs already alerted on having been removed) are
+        revalidated and alerted on again. Returns the changes made."""
+        ids = [b.id for b in bookings]
+        q = f"""SELECT id, timestamp, lastChange, email, bookeoPIDs
+            FROM bookings
+            WHERE id IN ({", ".join("?" * len(ids))})"""
+        stored = {r[0]: r[1:] for r in self._cur.execute(q, ids).fetchall()}
+
+        diffs = []
+        for b in bookings:
+            if b.id not in stored:
+                continue
+            timestamp, last_change, email, bookeo_pids = stored[b.id]
+            if b.last_change.timestamp() <= last_change:
+                continue  # nothing can have changed
+
+            # The PIDs Bookeo last sent, rather than the ones still stored,
+            # since invalid PIDs are removed once admins have been alerted
+            if bookeo_pids is not None:
+                old_pids = [PID(*p) for p in json.loads(bookeo_pids)]
+            else:
+                old_pids = self.get_on_campus_pids(b.id)
+            old_keys = {(p.id, p.last_name) for p in old_pids}
+            new_keys = {(p.id, p.last_name) for p in b.on_campus_pids}
+            diff = BookingDiff(
+                b,
+                start=(
+                    (datetime.fromtimestamp(timestamp, timezone.utc), b.start)
+                    if b.start.timestamp() != timestamp
+                    else None
+                ),
+                email=(email, b.email) if (email or "") != (b.email or "") else None,
+                added=[p for p in b.on_campus_pids if (p.id, p.last_name) not in old_keys],
+                removed=[p for p in old_pids if (p.id, p.last_name) not in new_keys],
             )
-            for b in bookings
-        ]
 
-    # TODO: Implement this method
-    def get_changed_bookings(self, delta: timedelta) -> list[Booking]:
-        return []
-
-    def _delete_if_lastchange_stale(self, id: int, dt: datetime):
-        """Removes the booking from the database if lastChange is older than dt"""
-        ts = dt.timestamp()
-        q = """SELECT * FROM bookings
-            WHERE id=? AND lastChange<?"""
-        res = self._cur.execute(q, (id, ts)).fetchall()
-        if not res:
-            return
-
-        q = """DELETE FROM bookings
-            WHERE id=? AND lastChange<?"""
-        self._cur.execute(q, (id, ts))
-        q = "DELETE FROM pids WHERE bookingID=?"
-        self._cur.execute(q, (id,))
+            q = """UPDATE bookings
+                SET timestamp=?, lastChange=?, email=?, bookeoPIDs=?
+                WHERE id=?"""
+            self._cur.execute(
+                q,
+                (
+                    b.start.timestamp(),
+                    b.last_change.timestamp(),
+                    b.email,
+                    self._pid_set(b.on_campus_pids),
+                    b.id,
+                ),
+            )
+            self._forget(b.id)
+            if not diff:
+                continue
+            diffs.append(diff)
+            if diff.start is not None:
+                self._booking_index.insert(
+                    [(b.id, b.start.timestamp(), b.end.timestamp())]
+                )
+                # Counted in its new slot, so that a cancellation later on
+                # is set against the slot the booking was counted in
+                self._analytics.record(diff.start[0], "booked", -1)
+                self._analytics.record(b.start, "booked")
+            if diff.removed:
+                q = "DELETE FROM pids WHERE bookingID=? AND pid=? AND lastName=?"
+                self._cur.executemany(
+                    q, [(b.id, p.id, p.last_name) for p in diff.removed]
+                )
+            if diff.added:
+                q = """INSERT INTO pids (pid, firstName, lastName, bookingID)
+                    VALUES (?, ?, ?, ?)"""
+                self._cur.executemany(
+                    q, [(p.id, p.first_name, p.last_name, b.id) for p in diff.added]
+                )
+                q = "UPDATE bookings SET adminNotifiedPIDs=0 WHERE id=?"
+                self._cur.execute(q, (b.id,))
+            self._events.append(BookingEvent.MODIFIED, [(b.id, diff.to_dict())])
+
         self._conn.commit()
+        if diffs:
+            self._logger.info(f"Updated {len(diffs)} changed booking(s)")
+        return diffs
 
     def mark_admin_notified_pids(self, booking: Booking):
         q = """UPDATE bookings
             SET adminNotifiedPIDs=1
             WHERE id=?"""
         self._cur.execute(q, (booking.id,))
+        self._cycle_cache.pop(("notified", booking.id), None)
+        self._conn.commit()
+
+    def claim_admin_notification(self, booking: Booking) -> bool:
+        """Atomically marks a Booking's PIDs as notified. Returns True only
+        for the one caller that changed it, so concurrent processes never
+        send the same alert twice."""
+        q = """UPDATE bookings
+            SET adminNotifiedPIDs=1
+            WHERE id=? AND adminNotifiedPIDs=0
+            RETURNING id"""
+        res = self._cur.execute(q, (booking.id,)).fetchone()
+        self._cycle_cache.pop(("notified", booking.id), None)
+        self._conn.commit()
+        return res is not None
+
+    def get_events(self, consumer: str, limit: int = None) -> list[BookingEvent]:
+        """Returns the booking events the consumer hasn't acknowledged yet"""
+        return self._events.read(consumer, limit)
+
+    def ack_events(self, consumer: str, seq: int):
+        """Acknowledges every event up to and including seq"""
+        self._events.advance(consumer, seq)
+        self._conn.commit()
+
+    def record_invalid_pids(self, booking: Booking, count: int):
+        """Counts invalid PIDs that admins were alerted about, for reports"""
+        self._analytics.record(booking.start, "invalidPIDs", count)
+        self._conn.commit()
+
+    def release_admin_notification(self, booking: Booking):
+        """Undoes claim_admin_notification, e.g. when the alert failed to send"""
+        q = """UPDATE bookings
+            SET adminNotifiedPIDs=0
+            WHERE id=?"""
+        self._cur.execute(q, (booking.id,))
+        self._cycle_cache.pop(("notified", booking.id), None)
+        self._conn.commit()
+
+    def journal_message(self, slack_ids: list[str], message: str) -> int:
+        """Stores a Slack message that couldn't be sent yet, to be
+        replayed in order once Slack is reachable again"""
+        q = """INSERT INTO outbox (slackIDs, message, created)
+            VALUES (?, ?, ?)"""
+        self._cur.execute(
+            q,
+            (json.dumps(slack_ids), message, datetime.now(timezone.utc).timestamp()),
+        )
+        self._conn.commit()
+        return self._cur.lastrowid
+
+    def get_journaled_messages(self, limit: int = None) -> list[tuple[int, list[str], str]]:
+        """Returns (id, slack_ids, message) for journaled messages, oldest first"""
+        q = "SELECT id, slackIDs, message FROM outbox ORDER BY id LIMIT ?"
+        res = self._cur.execute(q, (-1 if limit is None else limit,)).fetchall()
+        return [(r[0], json.loads(r[1]), r[2]) for r in res]
+
+    def count_journaled_messages(self) -> int:
+        return self._cur.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def remove_journaled_message(self, id: int):
+        self._cur.execute("DELETE FROM outbox WHERE id=?", (id,))
         self._conn.commit()
 
     def admin_notified_pids(self, booking: Booking) -> bool:
         q = """SELECT adminNotifiedPIDs
             FROM bookings
             WHERE id=?"""
-        res = self._cur.execute(q, (booking.id,)).fetchone()
+        res = self._cached(
+            ("notified", booking.id),
+            lambda: self._cur.execute(q, (booking.id,)).fetchone(),
+        )
         return res[0] or False
@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable
+
+from Database import BUSY_TIMEOUT, Database
+from Leases import Leases
+
+
+class DatabaseWorker:
+    """Owns a Database on a dedicated thread so that coroutines can use it
+    without blocking the event loop. SQLite connections can only be used
+    from the thread that created them, so every call is serialized onto
+    that one thread."""
+
+    def __init__(self, factory: Callable[[], Database]):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="database")
+        # Created on the worker thread so the connection belongs to it
+        self._db: Database = self._executor.submit(factory).result()
+        # Leases are renewed on a connection and thread of their own, so a
+        # long call on the worker thread can't hold a renewal up until the
+        # lease expires
+        self._lease_executor = ThreadPoolExecutor(1, thread_name_prefix="lease")
+        self._lease_conn: sqlite3.Connection = None
+        self._leases: Leases = self._lease_executor.submit(self._open_leases).result()
+
+    def _open_leases(self) -> Leases:
+        self._lease_conn = sqlite3.connect(self._db._db_filepath, timeout=BUSY_TIMEOUT)
+        return Leases(self._lease_conn.cursor())
+
+    async def call(self, method: str, *args, **kwargs):
+        """Runs a Database method on the worker thread"""
+        loop = asyncio.get_running_loop()
+        fn = getattr(self._db, method)
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def fetch(self, method: str, *args, **kwargs):
+        """Runs a Database method that only makes requests upstream, such
+        as fetch_booking_list, on a thread of its own, so that database
+        calls don't queue up behind slow or rate-limited requests"""
+        return await asyncio.to_thread(getattr(self._db, method), *args, **kwargs)
+
+    async def run(self, fn: Callable[[Database], object]):
+        """Runs fn(db) on the worker thread, for several calls that
+        should not interleave with other tasks"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, self._db)
+
+    async def acquire_lease(self, name: str, holder: str, ttl: timedelta) -> bool:
+        """Leases.acquire, on the lease connection"""
+
+        def acquire():
+            acquired = self._leases.acquire(name, holder, ttl)
+            self._lease_conn.commit()
+            return acquired
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._lease_executor, acquire)
+
+    async def release_lease(self, name: str, holder: str):
+        """Leases.release, on the lease connection"""
+
+        def release():
+            self._leases.release(name, holder)
+            self._lease_conn.commit()
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._lease_executor, release)
+
+    def close(self):
+        self._lease_executor.submit(self._lease_conn.close).result()
+        self._lease_executor.shutdown()
+        self._executor.submit(self._db.close).result()
+        self._executor.shutdown()
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+
+class BookingEvent:
+    CREATED = "created"
+    MODIFIED = "modified"
+    PID_INVALIDATED = "pid_invalidated"
+    CANCELED = "canceled"
+    EXPIRED = "expired"
+
+    def __init__(
+        self, seq: int, type: str, booking_id: int, data: dict, created: datetime
+    ):
+        self.seq = seq
+        self.type = type
+        self.booking_id = booking_id
+        self.data = data
+        self.created = created
+
+    def __repr__(self):
+        return f"BookingEvent({self.seq}, {self.type}, {self.booking_id})"
+
+
+class EventLog:
+    """An append-only log of changes to bookings.
+
+    Events are written with the same cursor as the change they describe,
+    so they are committed (or rolled back) together with it. Consumers
+    keep a named cursor and read only the events after it."""
+
+    def __init__(self, cur: sqlite3.Cursor):
+        self._cur = cur
+
+    def create(self):
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                bookingID INTEGER NOT NULL,
+                data TEXT,
+                created REAL NOT NULL
+            )"""
+        )
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS event_cursors (
+                consumer TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )"""
+        )
+
+    def append(self, type: str, events: list[tuple[int, dict]]):
+        """Appends an event of the given type for each (booking ID, data)"""
+        now = datetime.now(timezone.utc).timestamp()
+        q = "INSERT INTO events (type, bookingID, data, created) VALUES (?, ?, ?, ?)"
+        self._cur.executemany(
+            q, [(type, id, json.dumps(data) if data else None, now) for id, data in events]
+        )
+
+    def cursor(self, consumer: str) -> int:
+        q = "SELECT seq FROM event_cursors WHERE consumer=?"
+        res = self._cur.execute(q, (consumer,)).fetchone()
+        return res[0] if res is not None else 0
+
+    def read(self, consumer: str, limit: int = None) -> list[BookingEvent]:
+        """Returns the events after the consumer's cursor, oldest first"""
+        q = """SELECT seq, type, bookingID, data, created FROM events
+            WHERE seq>? ORDER BY seq LIMIT ?"""
+        res = self._cur.execute(
+            q, (self.cursor(consumer), -1 if limit is None else limit)
+        ).fetchall()
+        return [
+            BookingEvent(
+                r[0],
+                r[1],
+                r[2],
+                json.loads(r[3]) if r[3] else {},
+                datetime.fromtimestamp(r[4], timezone.utc),
+            )
+            for r in res
+        ]
+
+    def advance(self, consumer: str, seq: int):
+        """Moves the consumer's cursor past every event up to seq"""
+        q = """INSERT INTO event_cursors (consumer, seq) VALUES (?, ?)
+            ON CONFLICT (consumer) DO UPDATE SET seq=MAX(seq, excluded.seq)"""
+        self._cur.execute(q, (consumer, seq))
+
+    def purge(self, before: float) -> int:
+        """Deletes events created before the given timestamp"""
+        q = "DELETE FROM events WHERE created<?"
+        return self._cur.execute(q, (before,)).rowcount
@@ -0,0 +1,315 @@
+import json
+import math
+import random
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+
+# In-process stand-ins for Bookeo, Sling and Slack. Each one behaves like
+# the requests.Session its client would otherwise use, so the clients run
+# unmodified against them, e.g.
+#   Bookeo(logger, "X", "X", session=FakeBookeo(bookings_per_day=400))
+#
+# Every fake can inject latency, server errors and rate limiting (HTTP 429
+# with Retry-After) to see how the pipeline behaves when an upstream is
+# slow or unhealthy.
+
+ON_CAMPUS_CATEGORY_ID = "MPJWRE"
+OFF_CAMPUS_CATEGORY_ID = "OFFCMP"
+MAX_PAGE_TOKENS = 256  # paged results kept for follow-up page requests
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body=None, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(body).encode() if body is not None else b""
+        self.text = self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeUpstream(ABC):
+    """Base class for the fakes: applies the injected faults, then hands
+    the request to handle(). Thread-safe, as Bookeo fetches concurrently."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float = None,
+        seed: int = 0,
+    ):
+        if not 0 <= error_rate <= 1:
+            raise ValueError("Error rate must be between 0 and 1")
+        elif rate_limit is not None and rate_limit <= 0:
+            raise ValueError("Rate limit must be positive")
+
+        # Session-compatible, as the clients set their default headers here
+        self.headers: dict[str, str] = {}
+        self.latency = latency  # seconds added to every request
+        self.error_rate = error_rate  # fraction of requests answered with 500
+        # Requests per second, with bursts of up to one second's worth
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.status_counts: dict[int, int] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0.0
+        self._refilled = monotonic()
+
+    def _limited(self) -> int:
+        """Takes a token from the bucket. Returns 0 if the request may go
+        ahead, or else the number of seconds the caller should wait."""
+        if self.rate_limit is None:
+            return 0
+        now = monotonic()
+        self._tokens = min(
+            self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit
+        )
+        self._refilled = now
+        if self._tokens < 1:
+            return math.ceil((1 - self._tokens) / self.rate_limit)
+        self._tokens -= 1
+        return 0
+
+    def _request(self, method: str, url: str, params: dict, body) -> FakeResponse:
+        if self.latency:
+            sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            retry_after = self._limited()
+            if retry_after:
+                res = FakeResponse(429, {}, {"Retry-After": str(retry_after)})
+            elif self._rng.random() < self.error_rate:
+                res = FakeResponse(500, {})
+            else:
+                res = self.handle(method, urlsplit(url).path, params or {}, body)
+            self.status_counts[res.status_code] = (
+                self.status_counts.get(res.status_code, 0) + 1
+            )
+        return res
+
+    @abstractmethod
+    def handle(self, method: str, path: str, params: dict, body) -> FakeResponse:
+        """Answers a request that got past the injected faults. Called
+        with the lock held."""
+
+    def get(self, url: str, params: dict = None, headers: dict = None, **kwargs):
+        return self._request("GET", url, params, None)
+
+    def post(self, url: str, json: dict = None, headers: dict = None, **kwargs):
+        return self._request("POST", url, None, json)
+
+
+class FakeBookeo(FakeUpstream):
+    """Serves a calendar of generated bookings through /bookings and
+    /bookings/{number}. Bookings can be added to, changed in or removed
+    from self.bookings between fetches."""
+
+    def __init__(
+        self,
+        bookings_per_day: int = 40,
+        days: int = 35,
+        start: datetime = None,
+        invalid_pid_rate: float = 0.05,
+        roster: list[tuple[int, str, str]] = None,
+        **faults,
+    ):
+        super().__init__(**faults)
+        if start is None:
+            start = datetime.now(timezone.utc).replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+        # (PID, first name, last name) of students that participants are
+        # drawn from. The rest get random PIDs, which are almost never valid.
+        self.roster = roster or []
+        self._invalid_pid_rate = invalid_pid_rate
+        self._pages: dict[str, list[list[dict]]] = {}
+        self._next_number = 1_000_000
+        self.bookings: dict[str, dict] = {}
+        for day in range(days):
+            for _ in range(bookings_per_day):
+                t = start + timedelta(days=day, hours=self._rng.randrange(10, 22))
+                self.add_booking(t)
+
+    def add_booking(self, start: datetime, on_campus: int = None) -> dict:
+        """Adds a booking starting at start with on_campus on-campus
+        participants (random if not given) and returns it"""
+        number = str(self._next_number)
+        self._next_number += 1
+        if on_campus is None:
+            on_campus = self._rng.randrange(0, 5)
+        participants = [self._participant("PSELF", OFF_CAMPUS_CATEGORY_ID)]
+        participants += [
+            self._participant(f"P{i}", ON_CAMPUS_CATEGORY_ID) for i in range(on_campus)
+        ]
+        booking = {
+            "bookingNumber": number,
+            "startTime": start.isoformat(),
+            "endTime": (start + timedelta(hours=1)).isoformat(),
+            "lastChangeTime": datetime.now(timezone.utc).isoformat(),
+            "participants": {"details": participants},
+        }
+        self.bookings[number] = booking
+        return booking
+
+    def _participant(self, person_id: str, category_id: str) -> dict:
+        if self.roster and self._rng.random() >= self._invalid_pid_rate:
+            pid, first_name, last_name = self._rng.choice(self.roster)
+        else:
+            pid = self._rng.randrange(100_000_000, 1_000_000_000)
+            first_name, last_name = "First", "Last"
+        return {
+            "personId": person_id,
+            "peopleCategoryId": category_id,
+            "personDetails": {
+                "firstName": first_name,
+                "lastName": last_name,
+                "emailAddress": f"{person_id.lower()}@example.com",
+                "customFields": [{"name": "PID", "value": str(pid)}],
+            },
+        }
+
+    def add_participant(self, number: str, on_campus: bool = True) -> dict:
+        """Adds a participant to a booking, marks it changed and returns
+        the participant"""
+        details = self.bookings[number]["participants"]["details"]
+        category = ON_CAMPUS_CATEGORY_ID if on_campus else OFF_CAMPUS_CATEGORY_ID
+        participant = self._participant(f"P{len(details)}", category)
+        details.append(participant)
+        self.touch(number)
+        return participant
+
+    def touch(self, number: str):
+        """Marks a booking as changed now"""
+        self.bookings[number]["lastChangeTime"] = datetime.now(timezone.utc).isoformat()
+
+    def _view(self, booking: dict, expand: bool) -> dict:
+        if expand:
+            return booking
+        return {k: v for k, v in booking.items() if k != "participants"}
+
+    def handle(self, method: str, path: str, params: dict, body) -> FakeResponse:
+        expand = str(params.get("expandParticipants", True)).lower() == "true"
+        if path.startswith("/v2/bookings/"):
+            booking = self.bookings.get(path.rsplit("/", 1)[1])
+            if booking is None:
+                return FakeResponse(404, {})
+            return FakeResponse(200, self._view(booking, expand))
+        elif path != "/v2/bookings":
+            return FakeResponse(404, {})
+
+        if "pageNavigationToken" in params:
+            pages = self._pages.get(params["pageNavigationToken"])
+            page = int(params.get("pageNumber", 1))
+            if pages is None or not 1 <= page <= len(pages):
+                return FakeResponse(400, {})
+            return FakeResponse(200, {"data": pages[page - 1]})
+
+        start = datetime.strptime(params["startTime"], r"%Y-%m-%dT%H:%M:00Z")
+        end = datetime.strptime(params["endTime"], r"%Y-%m-%dT%H:%M:00Z")
+        start, end = start.replace(tzinfo=timezone.utc), end.replace(tzinfo=timezone.utc)
+        data = [
+            self._view(b, expand)
+            for b in self.bookings.values()
+            if start <= datetime.fromisoformat(b["startTime"]) < end
+        ]
+        size = int(params.get("itemsPerPage", 100))
+        pages = [data[i : i + size] for i in range(0, len(data), size)] or [[]]
+        info = {"totalPages": len(pages)}
+        if len(pages) > 1:
+            token = uuid.uuid4().hex
+            self._pages[token] = pages
+            if len(self._pages) > MAX_PAGE_TOKENS:
+                del self._pages[next(iter(self._pages))]
+            info["pageNavigationToken"] = token
+        return FakeResponse(200, {"info": info, "data": pages[0]})
+
+
+class FakeSling(FakeUpstream):
+    """Serves one shift a day per employee, from shift_start to shift_end UTC"""
+
+    def __init__(
+        self,
+        employee_ids: list[int] = None,
+        shift_start: int = 12,
+        shift_end: int = 20,
+        **faults,
+    ):
+        super().__init__(**faults)
+        self.employee_ids = employee_ids or []
+        self._shift_hours = (shift_start, shift_end)
+
+    def handle(self, method: str, path: str, params: dict, body) -> FakeResponse:
+        if path == "/v1/account/login":
+            return FakeResponse(200, {}, {"Authorization": "fake-token"})
+        elif path == "/v1/users":
+            users = [
+                {"id": i + 1, "employeeId": str(id)}
+                for i, id in enumerate(self.employee_ids)
+            ]
+            return FakeResponse(200, users)
+        elif path != "/v1/reports/roster":
+            return FakeResponse(404, {})
+
+        start, end = (datetime.fromisoformat(t) for t in params["dates"].split("/"))
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        events = []
+        while day < end:
+            for i in range(len(self.employee_ids)):
+                events.append(
+                    {
+                        "type": "shift",
+                        "user": {"id": i + 1},
+                        "dtstart": day.replace(hour=self._shift_hours[0]).isoformat(),
+                        "dtend": day.replace(hour=self._shift_hours[1]).isoformat(),
+                    }
+                )
+            day += timedelta(days=1)
+        return FakeResponse(200, events)
+
+
+class FakeSlack(FakeUpstream):
+    """Accepts every message and keeps it in self.sent as (channel, text)
+    instead of posting it. If a logger is given, each message is logged."""
+
+    def __init__(self, logger: Logger = None, **faults):
+        super().__init__(**faults)
+        self.sent: list[tuple[str, str]] = []
+        self._logger = logger
+
+    def handle(self, method: str, path: str, params: dict, body) -> FakeResponse:
+        now = datetime.now(timezone.utc).timestamp()
+        if path in ("/api/chat.postMessage", "/api/chat.scheduleMessage"):
+            self.sent.append((body["channel"], body["text"]))
+            if self._logger is not None:
+                self._logger.info(f"Not posting to {body['channel']}: {body['text']}")
+            data = {"ok": True, "channel": body["channel"], "message": {"ts": str(now)}}
+            return FakeResponse(200, data)
+        elif path == "/api/conversations.history":
+            messages = [
+                {"text": text, "ts": str(now)}
+                for channel, text in self.sent
+                if channel == params["channel"]
+            ]
+            return FakeResponse(200, {"ok": True, "messages": messages})
+        return FakeResponse(404, {"ok": False})
+
+
+def fault_options(config: dict[str, str]) -> dict:
+    """Reads the faults to inject into fake upstreams from the config:
+    FAKE_LATENCY_MS, FAKE_ERROR_RATE and FAKE_RATE_LIMIT (requests/second)"""
+    options = {}
+    if config.get("FAKE_LATENCY_MS"):
+        options["latency"] = float(config["FAKE_LATENCY_MS"]) / 1000
+    if config.get("FAKE_ERROR_RATE"):
+        options["error_rate"] = float(config["FAKE_ERROR_RATE"])
+    if config.get("FAKE_RATE_LIMIT"):
+        options["rate_limit"] = float(config["FAKE_RATE_LIMIT"])
+    return options
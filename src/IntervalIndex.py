@@ -0,0 +1,46 @@
+import sqlite3
+
+
+class IntervalIndex:
+    """An SQLite R*Tree over [start, end] intervals keyed by row ID.
+
+    R*Tree coordinates are stored as 32-bit floats, which is too coarse for
+    POSIX timestamps, so the exact bounds are kept alongside them as auxiliary
+    columns and every query re-checks against those."""
+
+    def __init__(self, cur: sqlite3.Cursor, table: str):
+        if not table.isidentifier():
+            raise ValueError("Table name must be a valid identifier")
+        self._cur = cur
+        self._table = table
+
+    def create(self):
+        self._cur.execute(
+            f"""CREATE VIRTUAL TABLE IF NOT EXISTS {self._table}
+            USING rtree(id, lo, hi, +start REAL, +end REAL)"""
+        )
+
+    def insert(self, intervals: list[tuple[int, float, float]]):
+        """Adds (id, start, end) intervals to the index"""
+        q = f"""INSERT OR REPLACE INTO {self._table} (id, lo, hi, start, end)
+            VALUES (?, ?, ?, ?, ?)"""
+        self._cur.executemany(q, [(i, s, e, s, e) for i, s, e in intervals])
+
+    def delete(self, ids: list[int]):
+        q = f"DELETE FROM {self._table} WHERE id=?"
+        self._cur.executemany(q, [(i,) for i in ids])
+
+    def overlapping(self, start: float, end: float) -> list[int]:
+        """Returns the IDs of all intervals that share at least
+        one point with [start, end]"""
+        q = f"""SELECT id FROM {self._table}
+            WHERE lo<=? AND hi>=? AND start<=? AND end>=?"""
+        res = self._cur.execute(q, (end, start, end, start)).fetchall()
+        return [r[0] for r in res]
+
+    def covering(self, t: float) -> list[int]:
+        """Returns the IDs of all intervals with start <= t < end"""
+        q = f"""SELECT id FROM {self._table}
+            WHERE lo<=? AND hi>=? AND start<=? AND end>?"""
+        res = self._cur.execute(q, (t, t, t, t)).fetchall()
+        return [r[0] for r in res]
@@ -0,0 +1,40 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+
+class Leases:
+    """Named leases, each held by one holder at a time until it expires,
+    e.g. to elect a leader among processes sharing a database.
+
+    The caller commits."""
+
+    def __init__(self, cur: sqlite3.Cursor):
+        self._cur = cur
+
+    def create(self):
+        self._cur.execute(
+            """CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires REAL NOT NULL
+            )"""
+        )
+
+    def acquire(self, name: str, holder: str, ttl: timedelta) -> bool:
+        """Takes or renews the named lease for holder if it is free, expired
+        or already held by holder. Returns whether holder now has it."""
+        now = datetime.now(timezone.utc).timestamp()
+        q = "INSERT OR IGNORE INTO leases (name, holder, expires) VALUES (?, ?, ?)"
+        self._cur.execute(q, (name, holder, now + ttl.total_seconds()))
+        q = """UPDATE leases
+            SET holder=?, expires=?
+            WHERE name=? AND (holder=? OR expires<?)
+            RETURNING holder"""
+        res = self._cur.execute(
+            q, (holder, now + ttl.total_seconds(), name, holder, now)
+        ).fetchone()
+        return res is not None
+
+    def release(self, name: str, holder: str):
+        q = "DELETE FROM leases WHERE name=? AND holder=?"
+        self._cur.execute(q, (name, holder))
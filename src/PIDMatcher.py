@@ -0,0 +1,142 @@
+import unicodedata
+from typing import Iterable
+
+from PID import PID
+
+MAX_NAME_DISTANCE = 2
+MAX_PID_DISTANCE = 2
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def normalize_name(name: str) -> str:
+    """Casefolds a name and strips accents, whitespace and punctuation,
+    so that "O'Brien-Smith " and "obriensmith" compare equal"""
+    name = unicodedata.normalize("NFKD", name)
+    return "".join(c for c in name.casefold() if c.isalpha() and c.isascii())
+
+
+def soundex(name: str) -> str:
+    """Returns the American Soundex code of a normalized name"""
+    if not name:
+        return ""
+    code = name[0].upper()
+    last = SOUNDEX_CODES.get(name[0], "")
+    for c in name[1:]:
+        digit = SOUNDEX_CODES.get(c, "")
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        if c not in "hw":
+            last = digit
+    return code.ljust(4, "0")
+
+
+def bounded_distance(a: str, b: str, bound: int) -> int:
+    """Levenshtein distance between a and b, or bound + 1 as soon as
+    it is known to exceed bound"""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    elif a == b:
+        return 0
+    elif bound <= 1:
+        # Linear check for a single edit, which is the common case when
+        # filtering candidates
+        if len(a) < len(b):
+            a, b = b, a
+        i = 0
+        while i < len(b) and a[i] == b[i]:
+            i += 1
+        if len(a) == len(b):
+            return 1 if a[i + 1 :] == b[i + 1 :] else bound + 1
+        return 1 if a[i + 1 :] == b[i:] else bound + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        curr = [i]
+        for j, cb in enumerate(b, 1):
+            curr.append(min(prev[j] + 1, curr[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(curr) > bound:
+            return bound + 1
+        prev = curr
+    return min(prev[-1], bound + 1)
+
+
+class PIDMatch:
+    VALID = "valid"
+    NEAR = "near"
+    INVALID = "invalid"
+
+    def __init__(self, pid: PID, status: str, suggestion: PID = None):
+        self.pid = pid
+        self.status = status
+        # The roster entry the booked PID most likely meant, for near-misses
+        self.suggestion = suggestion
+
+    def __repr__(self):
+        return f"PIDMatch({self.pid}, {self.status}, {self.suggestion})"
+
+
+class PIDMatcher:
+    """Matches booked PIDs against the roster, tolerating differences in
+    case, whitespace and punctuation and reporting likely typos.
+
+    Candidates are found through blocking keys (the Soundex code and the
+    first letters of the last name) so only a handful of roster entries
+    are ever scored."""
+
+    def __init__(self, roster: Iterable[PID]):
+        self._by_id: dict[int, tuple[PID, str]] = {}
+        self._by_key: dict[str, list[tuple[PID, str]]] = {}
+        for p in roster:
+            entry = (p, normalize_name(p.last_name))
+            self._by_id[p.id] = entry
+            for key in self._blocking_keys(entry[1]):
+                self._by_key.setdefault(key, []).append(entry)
+
+    @staticmethod
+    def _blocking_keys(last_name: str) -> set[str]:
+        return {f"s:{soundex(last_name)}", f"p:{last_name[:3]}"}
+
+    def match(self, pid: PID) -> PIDMatch:
+        last_name = normalize_name(pid.last_name)
+
+        entry = self._by_id.get(pid.id)
+        if entry is not None:
+            roster_pid, roster_last_name = entry
+            # Hyphenated names are often booked with only one of their parts
+            if last_name == roster_last_name or (
+                last_name
+                and "-" in roster_pid.last_name
+                and last_name
+                in [normalize_name(n) for n in roster_pid.last_name.split("-")]
+            ):
+                return PIDMatch(pid, PIDMatch.VALID)
+            distance = bounded_distance(last_name, roster_last_name, MAX_NAME_DISTANCE)
+            if distance <= MAX_NAME_DISTANCE:
+                return PIDMatch(pid, PIDMatch.NEAR, roster_pid)
+
+        # The name may be right but the PID mistyped
+        best, best_distance = None, MAX_PID_DISTANCE + 1
+        candidates = {
+            id(e): e
+            for key in self._blocking_keys(last_name)
+            for e in self._by_key.get(key, [])
+        }
+        for roster_pid, roster_last_name in candidates.values():
+            if bounded_distance(last_name, roster_last_name, 1) > 1:
+                continue
+            distance = bounded_distance(
+                str(pid.id), str(roster_pid.id), best_distance - 1
+            )
+            if distance < best_distance:
+                best, best_distance = roster_pid, distance
+        if best is not None:
+            return PIDMatch(pid, PIDMatch.NEAR, best)
+        return PIDMatch(pid, PIDMatch.INVALID)
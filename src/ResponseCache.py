@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+MAX_ENTRIES = 64
+
+
+class CacheEntry:
+    def __init__(self, etag: str, last_modified: str, digest: str, pages: int):
+        self.etag = etag
+        self.last_modified = last_modified
+        # SHA-256 of the decoded data, for servers that send no validators
+        self.digest = digest
+        self.pages = pages
+
+
+class ResponseCache:
+    """A bounded on-disk LRU of HTTP responses, keyed by request parameters.
+
+    Each entry is a small metadata file with the validators of the last
+    response plus a data file with its decoded payload, which is only read
+    when a caller actually needs the payload."""
+
+    def __init__(self, directory: str, max_entries: int = MAX_ENTRIES):
+        if max_entries < 1:
+            raise ValueError("Cache must hold at least one entry")
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path: str, params: dict) -> str:
+        """Returns the cache key for a request. Credentials are excluded
+        so that they are never written to disk."""
+        params = {
+            k: str(v) for k, v in params.items() if k not in ("secretKey", "apiKey")
+        }
+        raw = json.dumps([path, params], sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self._directory, f"{key}.{ext}")
+
+    def get(self, key: str) -> CacheEntry:
+        if not os.path.exists(self._path(key, "data")):
+            return None
+        try:
+            with open(self._path(key, "meta")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(self._path(key, "meta"))  # mark as recently used
+        return CacheEntry(
+            meta["etag"], meta["lastModified"], meta["digest"], meta["pages"]
+        )
+
+    def get_data(self, key: str):
+        try:
+            with open(self._path(key, "data")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, entry: CacheEntry, data):
+        with self._lock:
+            self._put(key, entry, data)
+            self._evict()
+
+    def _put(self, key: str, entry: CacheEntry, data):
+        self._write(self._path(key, "data"), data)
+        # The metadata is written last so an entry is never valid without its data
+        self._write(
+            self._path(key, "meta"),
+            {
+                "etag": entry.etag,
+                "lastModified": entry.last_modified,
+                "digest": entry.digest,
+                "pages": entry.pages,
+            },
+        )
+
+    def _write(self, path: str, obj):
+        """Writes obj to path as JSON through a temporary file, so that a
+        crash mid-write never leaves a truncated file behind"""
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(obj, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _evict(self):
+        """Removes the least recently used entries beyond max_entries"""
+        metas = [
+            os.path.join(self._directory, n)
+            for n in os.listdir(self._directory)
+            if n.endswith(".meta")
+        ]
+        if len(metas) <= self._max_entries:
+            return
+        metas.sort(key=os.path.getmtime)
+        for path in metas[: len(metas) - self._max_entries]:
+            for p in (path, path[: -len(".meta")] + ".data"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
@@ -0,0 +1,32 @@
+from PID import PID
+
+
+class RosterDiff:
+    def __init__(
+        self,
+        added: list[PID],
+        removed: list[PID],
+        renamed: list[tuple[PID, PID]],
+    ):
+        self.added = added
+        self.removed = removed
+        # (old, new) pairs for students whose name changed between loads
+        self.renamed = renamed
+
+    @property
+    def affected_ids(self) -> set[int]:
+        """PIDs whose validity may have changed because of this diff"""
+        return (
+            {p.id for p in self.added}
+            | {p.id for p in self.removed}
+            | {new.id for _, new in self.renamed}
+        )
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.renamed)
+
+    def __repr__(self):
+        return (
+            f"RosterDiff({len(self.added)} added, {len(self.removed)} removed, "
+            f"{len(self.renamed)} renamed)"
+        )
@@ -0,0 +1,154 @@
+import mmap
+import os
+import struct
+import tempfile
+from csv import DictReader
+
+from PID import PID
+
+# Snapshot layout (all little-endian):
+#   header   magic, version, record count, CSV mtime and CSV size
+#   records  one fixed-width record per PID, sorted by PID:
+#            PID, offset into the names blob, first name length, last name length
+#   names    UTF-8 first and last names, back to back
+MAGIC = b"ERICRSTR"
+VERSION = 1
+HEADER = struct.Struct("<8sHIdQ")
+RECORD = struct.Struct("<QIHH")
+SNAPSHOT_SUFFIX = ".snap"
+
+
+class RosterSnapshot:
+    """A compiled, memory-mapped copy of the roster CSV.
+
+    Lookups binary-search the mapped records, so nothing is parsed and
+    the OS only pages in the parts of the file that are touched."""
+
+    def __init__(self, roster_filepath: str):
+        if not os.path.exists(roster_filepath):
+            raise IOError("Roster filepath not found")
+        self._roster_filepath = roster_filepath
+        self._snapshot_filepath = roster_filepath + SNAPSHOT_SUFFIX
+        self._file = None
+        self._mm = None
+        self._count = 0
+        self.refresh()
+
+    @staticmethod
+    def compile(roster_filepath: str, snapshot_filepath: str):
+        """Writes a snapshot of the roster CSV to snapshot_filepath"""
+        stat = os.stat(roster_filepath)
+        students: dict[int, tuple[bytes, bytes]] = {}
+        with open(roster_filepath, "r", newline="") as f:
+            for r in DictReader(f):
+                pid = (r.get("PID") or "").strip()
+                if not (pid.isdigit() and r.get("firstName") and r.get("lastName")):
+                    continue
+                students[int(pid)] = (
+                    r["firstName"].encode("utf-8"),
+                    r["lastName"].encode("utf-8"),
+                )
+
+        records = bytearray()
+        names = bytearray()
+        for pid in sorted(students):
+            first, last = students[pid]
+            records += RECORD.pack(pid, len(names), len(first), len(last))
+            names += first + last
+
+        # Write to a temporary file first so readers never see a partial
+        # snapshot. Each writer gets its own, as another process (or the CLI)
+        # may be compiling the same snapshot at the same time.
+        fd, tmp_filepath = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(snapshot_filepath)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    HEADER.pack(
+                        MAGIC, VERSION, len(students), stat.st_mtime, stat.st_size
+                    )
+                )
+                f.write(records)
+                f.write(names)
+            os.replace(tmp_filepath, snapshot_filepath)
+        except BaseException:
+            os.remove(tmp_filepath)
+            raise
+
+    def _matches_roster(self, header: bytes) -> bool:
+        """Whether a snapshot header was compiled from the current CSV"""
+        if len(header) < HEADER.size:
+            return False
+        magic, version, _, mtime, size = HEADER.unpack_from(header)
+        stat = os.stat(self._roster_filepath)
+        return (
+            magic == MAGIC
+            and version == VERSION
+            and mtime == stat.st_mtime
+            and size == stat.st_size
+        )
+
+    def refresh(self) -> bool:
+        """Recompiles and remaps the snapshot if the CSV has changed.
+        Returns whether the snapshot was reloaded."""
+        if self._mm is not None and self._matches_roster(self._mm[: HEADER.size]):
+            return False
+
+        header = b""
+        if os.path.exists(self._snapshot_filepath):
+            with open(self._snapshot_filepath, "rb") as f:
+                header = f.read(HEADER.size)
+        if not self._matches_roster(header):
+            RosterSnapshot.compile(self._roster_filepath, self._snapshot_filepath)
+
+        self.close()
+        self._file = open(self._snapshot_filepath, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = HEADER.unpack_from(self._mm, 0)[2]
+        return True
+
+    def rebuild(self):
+        """Recompiles the snapshot even if it looks up to date, e.g. if it
+        was damaged or the CSV was replaced without changing its mtime"""
+        self.close()
+        RosterSnapshot.compile(self._roster_filepath, self._snapshot_filepath)
+        self.refresh()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._mm = None
+        self._file = None
+
+    def _record(self, i: int) -> tuple[int, int, int, int]:
+        return RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+
+    def _pid(self, record: tuple[int, int, int, int]) -> PID:
+        pid, offset, first_len, last_len = record
+        start = HEADER.size + self._count * RECORD.size + offset
+        first = self._mm[start : start + first_len].decode("utf-8")
+        last = self._mm[start + first_len : start + first_len + last_len]
+        return PID(pid, first, last.decode("utf-8"))
+
+    def get(self, pid_id: int) -> PID:
+        """Returns the roster entry for the given PID, if there is one"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._record(mid)
+            if record[0] < pid_id:
+                lo = mid + 1
+            elif record[0] > pid_id:
+                hi = mid
+            else:
+                return self._pid(record)
+        return None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._pid(self._record(i))
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+
+class Shift:
+    def __init__(self, employee_id: int, start: datetime, end: datetime):
+        if employee_id < 0:
+            raise ValueError("Employee ID cannot be negative")
+        elif not isinstance(start, datetime):
+            raise TypeError("start must be a datetime")
+        elif not isinstance(end, datetime):
+            raise TypeError("end must be a datetime")
+        elif end <= start:
+            raise ValueError("Shift must end after it starts")
+        self.employee_id = employee_id
+        self.start = start
+        self.end = end
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Shift)
+            and other.employee_id == self.employee_id
+            and other.start == self.start
+            and other.end == self.end
+        )
+
+    def __repr__(self):
+        return f"Shift({self.employee_id}, {self.start}, {self.end})"
@@ -28,6 +28,7 @@ class SlackApp:
         token: str,
         quiet_hours_start: time,
         quiet_hours_end: time,
+        session: requests.Session = None,
     ):
         if None in (quiet_hours_start, quiet_hours_end):
             raise TypeError("Quiet hours cannot be None")
@@ -36,6 +37,7 @@ class SlackApp:
         self._token = token
         self._quiet_hours_start = quiet_hours_start
         self._quiet_hours_end = quiet_hours_end
+        self._session = session or requests.Session()
 
     def in_quiet_hrs(self, dt: datetime = datetime.now()) -> bool:
         """Determine whether quiet hours are in effect for a given datetime"""
@@ -55,7 +57,7 @@ class SlackApp:
                 schedule_dt.replace(minute=self._quiet_hours_end.minute)
                 schedule_dt.replace(second=0)
                 return self.schedule_message(channel_id, schedule_dt, msg)
-            result = requests.post(
+            result = self._session.post(
                 "https://slack.com/api/chat.postMessage",
                 json={"channel": channel_id, "text": str(msg)},
                 headers={
@@ -90,7 +92,7 @@ class SlackApp:
     def schedule_message(self, channel_id: str, dt: datetime, msg) -> MessageResponse:
         """Schedule a message to be sent at the given datetime"""
         try:
-            result = requests.post(
+            result = self._session.post(
                 "https://slack.com/api/chat.scheduleMessage",
                 json={
                     "channel": channel_id,
@@ -103,7 +105,7 @@ class SlackApp:
                     "User-Agent": USERAGENT,
                 },
             )
-            self._logger.error(result.json())
+            self._logger.debug(f"Slack scheduleMessage response: {result.text}")
             if result.status_code == 200 and result.json()["ok"]:
                 self._logger.info("Scheduled Slack message")
                 data = result.json()
@@ -123,7 +125,7 @@ class SlackApp:
         if msg is None:
             return None
         try:
-            result = requests.get(
+            result = self._session.get(
                 "https://slack.com/api/conversations.history",
                 params={
                     "channel": msg.resolved_channel_id,
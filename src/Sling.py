@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+from logging import Logger
+
+import requests
+from Shift import Shift
+
+SLING_API_URL = "https://api.getsling.com/v1"
+USERAGENT = "ERIC-CTE/1.0 (nolanwelch@outlook.com)"
+
+
+class Sling:
+    def __init__(
+        self,
+        logger: Logger,
+        username: str,
+        password: str,
+        session: requests.Session = None,
+    ):
+        if "" in (username, password):
+            raise ValueError("Sling credentials cannot be empty")
+
+        self._logger = logger
+        self._username = username
+        self._password = password
+        # One session for the lifetime of the app so that the TCP connection
+        # and the auth token are reused between syncs
+        self._session = session or requests.Session()
+        self._session.headers.update({"User-Agent": USERAGENT})
+        self._employee_ids: dict[int, int] = {}
+
+    def _login(self) -> bool:
+        """Authenticates with Sling and stores the token on the session"""
+        self._session.headers.pop("Authorization", None)
+        res = self._session.post(
+            f"{SLING_API_URL}/account/login",
+            json={"email": self._username, "password": self._password},
+        )
+        if res.status_code != 200 or "Authorization" not in res.headers:
+            self._logger.error(
+                f"Could not log in to Sling (status code {res.status_code})"
+            )
+            return False
+        self._session.headers["Authorization"] = res.headers["Authorization"]
+        self._logger.info("Logged in to Sling")
+        return True
+
+    def _get(self, path: str, params: dict = None) -> requests.Response:
+        """GET a Sling endpoint, logging in again if the token has expired.
+        Returns None if Sling could not be reached."""
+        try:
+            if "Authorization" not in self._session.headers and not self._login():
+                return None
+            res = self._session.get(f"{SLING_API_URL}{path}", params=params)
+            if res.status_code == 401 and self._login():
+                res = self._session.get(f"{SLING_API_URL}{path}", params=params)
+        except requests.RequestException as e:
+            self._logger.error(f"Error connecting to Sling: {e}")
+            return None
+        return res
+
+    def _refresh_employee_ids(self) -> None:
+        """Maps Sling user IDs to the employee IDs used in the local database"""
+        res = self._get("/users")
+        if res is None or res.status_code != 200:
+            self._logger.error("Could not fetch users from Sling")
+            return
+        self._employee_ids = {
+            int(u["id"]): int(u["employeeId"])
+            for u in res.json()
+            if str(u.get("employeeId") or "").isdigit()
+        }
+
+    def fetch_shifts(self, delta: timedelta, start: datetime = None) -> list[Shift]:
+        """Use the Sling API to fetch all published Shifts that overlap
+        start and (start + delta)"""
+        if start is None:
+            start = datetime.now(timezone.utc)
+        res = self._get(
+            "/reports/roster",
+            params={"dates": f"{start.isoformat()}/{(start + delta).isoformat()}"},
+        )
+        if res is None or res.status_code != 200:
+            self._logger.error("Could not fetch shifts from Sling")
+            return None
+
+        events = [e for e in res.json() if e.get("type") == "shift"]
+        user_ids = {int(e["user"]["id"]) for e in events if e.get("user")}
+        if not user_ids.issubset(self._employee_ids.keys()):
+            self._refresh_employee_ids()
+
+        shifts = []
+        for e in events:
+            if not e.get("user"):
+                continue  # unassigned shift
+            employee_id = self._employee_ids.get(int(e["user"]["id"]))
+            if employee_id is None:
+                continue
+            shifts.append(
+                Shift(
+                    employee_id,
+                    datetime.fromisoformat(e["dtstart"]).astimezone(timezone.utc),
+                    datetime.fromisoformat(e["dtend"]).astimezone(timezone.utc),
+                )
+            )
+        self._logger.info(f"Fetched {len(shifts)} shift(s) from Sling")
+        return shifts
@@ -0,0 +1,151 @@
+import json
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from time import monotonic
+
+TEXT_FORMAT = "%(asctime)s;%(levelname)s;%(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+SAMPLE_WINDOW = 60  # seconds
+SAMPLE_BURST = 20  # records per call site per window below WARNING
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "sampled", 0):
+            entry["sampled"] = record.sampled
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class ExceptionQueueHandler(QueueHandler):
+    """A QueueHandler that keeps a record's traceback apart from its message.
+    QueueHandler folds it into the message and drops exc_info, which can't
+    be pickled; this one queues the traceback as exc_text instead, so that
+    the listener's formatter places it, e.g. in JsonFormatter's own field."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = super().prepare(record)
+        record.exc_text = exc_text
+        return record
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.stack_info:
+            message += "\n" + logging.Formatter().formatStack(record.stack_info)
+        return message
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Applies a minimum level per source module, e.g. {"Bookeo": WARNING},
+    since every class logs through the logger it was given"""
+
+    def __init__(self, levels: dict[str, int], default: int = logging.INFO):
+        super().__init__()
+        self._levels = levels
+        self._default = default
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self._levels.get(record.module, self._default)
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through at most burst records per call site per window, so a
+    hot loop can't flood the log. Warnings and errors are never dropped.
+    The next record let through from a call site carries the number
+    dropped before it as record.sampled."""
+
+    def __init__(self, burst: int = SAMPLE_BURST, window: float = SAMPLE_WINDOW):
+        super().__init__()
+        self._burst = burst
+        self._window = window
+        self._sites: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = monotonic()
+        site = self._sites.setdefault((record.pathname, record.lineno), [now, 0, 0])
+        if now - site[0] >= self._window:
+            site[:] = [now, 0, site[2]]
+        site[1] += 1
+        if site[1] > self._burst:
+            site[2] += 1
+            return False
+        record.sampled, site[2] = site[2], 0
+        return True
+
+
+def parse_levels(spec: str) -> dict[str, int]:
+    """Parses "Bookeo=WARNING,Coordinator=DEBUG" into module levels"""
+    levels = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        module, _, level = item.partition("=")
+        if not isinstance(logging.getLevelName(level.strip().upper()), int):
+            raise ValueError(f"Unknown log level {level!r} for {module.strip()}")
+        levels[module.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def setup_logging(
+    logger: logging.Logger, config: dict[str, str], log_queue=None
+) -> QueueListener:
+    """Sends logger's records through a queue to a listener thread that
+    writes them to config["LOG_PATH"], so that logging never blocks on file
+    I/O. LOG_FORMAT=json writes one JSON object per line, and LOG_LEVELS
+    sets per-module levels. The caller stops the returned listener to
+    flush the queue on exit.
+
+    Worker processes must not open the log file themselves, as each would
+    rotate it at midnight and delete what the others rotated. Given a
+    multiprocessing queue as log_queue, the listener also writes what
+    workers set up with log_to_queue send over it."""
+    handler = TimedRotatingFileHandler(
+        filename=config["LOG_PATH"],
+        when="midnight",
+        backupCount=60,
+        encoding="utf-8",
+    )
+    if (config.get("LOG_FORMAT") or "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+    levels = parse_levels(config.get("LOG_LEVELS"))
+    handler.setLevel(min([logging.INFO, *levels.values()]))
+    if log_queue is None:
+        log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    log_to_queue(logger, config, log_queue)
+    listener.start()
+    return listener
+
+
+def log_to_queue(logger: logging.Logger, config: dict[str, str], log_queue):
+    """Sends logger's records to the listener reading log_queue, e.g. the
+    one setup_logging started in the parent of a worker process"""
+    levels = parse_levels(config.get("LOG_LEVELS"))
+    # Filters run on the logging thread, before anything is queued
+    queue_handler = ExceptionQueueHandler(log_queue)
+    queue_handler.addFilter(ModuleLevelFilter(levels))
+    queue_handler.addFilter(SamplingFilter())
+    for h in list(logger.handlers):
+        logger.removeHandler(h)  # e.g. inherited from a parent process
+    logger.addHandler(queue_handler)
+    logger.setLevel(min([logging.INFO, *levels.values()]))
@@ -0,0 +1,46 @@
+import os
+from datetime import timedelta
+
+from dotenv import dotenv_values
+
+
+class Tenant:
+    """One venue served by this deployment, with its own Bookeo account,
+    roster and database file"""
+
+    def __init__(self, name: str, config: dict[str, str]):
+        if not name:
+            raise ValueError("Tenant name cannot be empty")
+        self.name = name
+        self.config = config
+        ids = config.get("ON_CAMPUS_CATEGORY_IDS") or ""
+        self.on_campus_category_ids = [i.strip() for i in ids.split(",") if i.strip()]
+        # Archived bookings are kept forever unless a retention is configured
+        days = config.get("ARCHIVE_RETENTION_DAYS")
+        self.archive_retention = timedelta(days=int(days)) if days else None
+        # UPSTREAMS=fake swaps Bookeo, Sling and Slack for in-process fakes,
+        # and SHADOW_MODE runs against a copy of the database without
+        # posting to Slack (see FakeUpstreams)
+        self.fake_upstreams = (config.get("UPSTREAMS") or "").lower() == "fake"
+        self.shadow = (config.get("SHADOW_MODE") or "").lower() in ("1", "true", "yes")
+
+    def __repr__(self):
+        return f"Tenant({self.name})"
+
+
+def load_tenants(tenants_dir: str, defaults: dict[str, str]) -> list[Tenant]:
+    """Loads one Tenant per .env file in tenants_dir. Keys missing from a
+    tenant's file (e.g. shared Slack or Sling credentials) fall back to
+    the values in defaults."""
+    if not os.path.isdir(tenants_dir):
+        raise OSError(f"Tenants directory {tenants_dir} does not exist")
+    tenants = []
+    for filename in sorted(os.listdir(tenants_dir)):
+        name, ext = os.path.splitext(filename)
+        if ext != ".env":
+            continue
+        config = {**defaults, **dotenv_values(os.path.join(tenants_dir, filename))}
+        tenants.append(Tenant(name, config))
+    if len({t.config.get("CTE_DB_PATH") for t in tenants}) != len(tenants):
+        raise ValueError("Each tenant must have its own CTE_DB_PATH")
+    return tenants
@@ -1,22 +1,17 @@
-import datetime as dt
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
-from time import sleep
 
-import pytz
-import requests
-from Booking import Booking
-from Database import Database
 from dotenv import dotenv_values
 from Secrets import secret_keys
-from SlackApp import SlackApp
+from Tenant import Tenant, load_tenants
+
+# The HTTP clients, asyncio and the database layer are imported where
+# they are first needed, so that the process starts (and fails on a bad
+# config) quickly when restarted by a supervisor
 
-LOCAL_TIMEZONE = pytz.timezone("America/New_York")
 USERAGENT = "ERIC-CTE/1.0 (nolanwelch@outlook.com)"
 
 # TODO
-# - Add functionality to check for updates made to bookings (namely, new/modified PIDs)
 # - Write tests for all classes and methods
 # - Restructure try/catch and Exception raising (https://stackoverflow.com/a/18679131/8344620))
 
@@ -39,80 +34,206 @@ def validate_secrets(secret_dict: dict, keys: list[str]) -> None:
     logging.info("Secrets validated")
 
 
-def connected_to_internet() -> bool:
-    try:
-        _ = requests.head("http://www.google.com", timeout=5)
-        return True
-    except:
-        return False
-
+def main(config_filepath: str = "config.env"):
+    from StructuredLogging import setup_logging
 
-def main():
     logger = logging.getLogger("eric-cte")
-    secrets = get_secrets("config.env")
+    secrets = get_secrets(config_filepath)
     validate_secrets(secrets, secret_keys)
 
-    fh = TimedRotatingFileHandler(
-        filename=secrets["LOG_PATH"],
-        when="midnight",
-        backupCount=60,
-        encoding="utf-8",
-    )
-    fh.setFormatter(
-        logging.Formatter("%(asctime)s;%(levelname)s;%(message)s", "%Y-%m-%d %H:%M:%S")
+    log_queue = None
+    if secrets.get("TENANTS_DIR"):
+        import multiprocessing
+
+        # Tenant worker processes log through this process's listener
+        log_queue = multiprocessing.Queue()
+    listener = setup_logging(logger, secrets, log_queue)
+    try:
+        run(secrets, log_queue)
+    finally:
+        listener.stop()
+
+
+def run(secrets: dict[str, str], log_queue=None):
+    import asyncio
+
+    from Coordinator import STATUS_PORT
+
+    status_port = int(secrets.get("STATUS_PORT") or STATUS_PORT)
+    tenants_dir = secrets.get("TENANTS_DIR")
+    if not tenants_dir:
+        asyncio.run(run_tenants([Tenant("default", secrets)], status_port))
+        return
+
+    tenants = load_tenants(tenants_dir, secrets)
+    for t in tenants:
+        validate_secrets(t.config, secret_keys)
+    processes = int(secrets.get("TENANT_PROCESSES") or os.cpu_count())
+    run_tenant_pool(tenants, processes, status_port, log_queue)
+
+
+def open_database(logger: logging.Logger, tenant: Tenant):
+    """Opens the tenant's Database on the calling thread"""
+    from Database import Database
+
+    config = tenant.config
+    db_path = config["CTE_DB_PATH"]
+    if tenant.shadow:
+        db_path = shadow_copy(db_path)
+    bookeo_session = None
+    if tenant.fake_upstreams:
+        from FakeUpstreams import FakeBookeo, fault_options
+
+        bookeo_session = FakeBookeo(
+            int(config.get("FAKE_BOOKINGS_PER_DAY") or 40),
+            roster=_roster_sample(config["CAMPUS_ROSTER_PATH"]),
+            **fault_options(config),
+        )
+    return Database(
+        logger,
+        db_path,
+        config["CAMPUS_ROSTER_PATH"],
+        config["BOOKEO_SECRET_KEY"],
+        config["BOOKEO_API_KEY"],
+        tenant.on_campus_category_ids,
+        tenant.archive_retention,
+        bookeo_session,
     )
-    fh.setLevel(logging.INFO)
-    logger.addHandler(fh)
 
+
+def shadow_copy(db_path: str) -> str:
+    """Copies the database into a shadow directory next to it and returns
+    the copy's path. The copy gets its own Bookeo cache as well, so nothing
+    a shadow run does is visible to the production instance."""
+    import sqlite3
+
+    shadow_dir = os.path.join(os.path.dirname(db_path), "shadow")
+    os.makedirs(shadow_dir, exist_ok=True)
+    path = os.path.join(shadow_dir, os.path.basename(db_path))
+    src, dst = sqlite3.connect(db_path), sqlite3.connect(path)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    return path
+
+
+def _roster_sample(roster_path: str, limit: int = 1000) -> list[tuple[int, str, str]]:
+    """Returns up to limit students from the roster, for fake bookings"""
+    from csv import DictReader
+    from itertools import islice
+
+    with open(roster_path) as f:
+        return [
+            (int(r["PID"]), r["firstName"], r["lastName"])
+            for r in islice(DictReader(f), limit)
+        ]
+
+
+def build_coordinator(logger: logging.Logger, tenant: Tenant, status_port: int):
+    """Returns a Coordinator for the tenant and the DatabaseWorker it uses"""
+    import datetime as dt
+
+    from Coordinator import Coordinator
+    from DatabaseWorker import DatabaseWorker
+    from SlackApp import SlackApp
+    from Sling import Sling
+
+    config = tenant.config
+    slack_session = sling_session = None
+    if tenant.fake_upstreams or tenant.shadow:
+        from FakeUpstreams import FakeSlack, FakeSling, fault_options
+
+        faults = fault_options(config) if tenant.fake_upstreams else {}
+        slack_session = FakeSlack(logger, **faults)
+        if tenant.fake_upstreams:
+            sling_session = FakeSling(**faults)
     slack = SlackApp(
         logger,
-        secrets["SLACK_BOT_TOKEN"],
+        config["SLACK_BOT_TOKEN"],
         quiet_hours_start=dt.time(hour=21),
         quiet_hours_end=dt.time(hour=8),
+        session=slack_session,
     )
-    db = Database(
-        logger,
-        secrets["CTE_DB_PATH"],
-        secrets["CAMPUS_ROSTER_PATH"],
-        secrets["BOOKEO_SECRET_KEY"],
-        secrets["BOOKEO_API_KEY"],
+
+    def open_tenant_database():
+        database = open_database(logger, tenant)
+        if sling_session is not None:
+            # Shifts for every employee, so that on-shift alerts go out too
+            sling_session.employee_ids = database.get_employee_ids()
+        return database
+
+    db = DatabaseWorker(open_tenant_database)
+    sling = Sling(
+        logger, config["SLING_USERNAME"], config["SLING_PASSWORD"], sling_session
     )
+    return Coordinator(logger, db, slack, sling, status_port), db
+
 
-    admins = db.get_admins()
-    admin_slack_ids = [db.get_slack_id(a.employee_id) for a in admins]
-
-    last_fetch = dt.datetime.fromtimestamp(0)
-
-    while True:
-        while not connected_to_internet():
-            logger.error("No Internet connection")
-            sleep(60)
-
-        # Update local database
-        db.clear()
-        fetch_delta = dt.timedelta(days=31)
-        bookings: list[Booking] = []
-        if dt.datetime.now() - last_fetch > dt.timedelta(minutes=5):
-            last_fetch = dt.datetime.now()
-            bookings = db.fetch_bookings(fetch_delta)
-            db.insert_new_bookings(bookings)
-
-        for b in bookings:
-            booking_datetime = b.start.astimezone(LOCAL_TIMEZONE)
-            booking_date = booking_datetime.strftime("%A, %B %-d")
-            # Check for invalid on-campus PIDs
-            pids = db.get_on_campus_pids(b.id)
-            pids = [p for p in pids if p != db.get_matching_pid(p)]
-            if not db.admin_notified_pids(b) and pids:
-                m = f":x: There are some invalid on-campus PIDs in booking *{b.id}* on {booking_date}. "
-                m += f"They are: {', '.join(f'*{p.id}* ({p.last_name}, {p.first_name})' for p in pids)}. "
-                m += f"Contact email: {b.email}"
-                slack.send_multiple(admin_slack_ids, m)
-                db.mark_admin_notified_pids(b)
-                for p in pids:
-                    db.remove_pid(p)
-
-        sleep(30)
+async def run_tenants(tenants: list[Tenant], first_port: int):
+    """Runs a Coordinator for each tenant concurrently in this process.
+    Each tenant serves its status endpoint on the next port up."""
+    import asyncio
+
+    workers = []
+    try:
+        coordinators = []
+        for i, t in enumerate(tenants):
+            logger = logging.getLogger("eric-cte")
+            if t.name != "default":
+                logger = logger.getChild(t.name)
+            coordinator, db = build_coordinator(logger, t, first_port + i)
+            coordinators.append(coordinator)
+            workers.append(db)
+        # One tenant failing shouldn't take down the others
+        results = await asyncio.gather(
+            *[c.run() for c in coordinators], return_exceptions=True
+        )
+        for t, r in zip(tenants, results):
+            if isinstance(r, BaseException):
+                logging.getLogger("eric-cte").error(f"Tenant {t.name} stopped: {r}")
+    finally:
+        for db in workers:
+            db.close()
+
+
+def _run_tenant_group(tenants: list[Tenant], first_port: int):
+    import asyncio
+
+    asyncio.run(run_tenants(tenants, first_port))
+
+
+def _init_tenant_worker(log_queue, config: dict[str, str]):
+    from StructuredLogging import log_to_queue
+
+    # The parent's log listener thread doesn't exist in this process, so
+    # records are sent to it over log_queue
+    if log_queue is not None:
+        log_to_queue(logging.getLogger("eric-cte"), config, log_queue)
+
+
+def run_tenant_pool(
+    tenants: list[Tenant], processes: int, first_port: int, log_queue=None
+):
+    """Spreads tenants round-robin across a pool of worker processes, so a
+    slow or CPU-heavy tenant only shares a process with a few others. The
+    workers log to log_queue, from setup_logging in this process."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = max(1, min(processes, len(tenants)))
+    groups = [tenants[i::processes] for i in range(processes)]
+    with ProcessPoolExecutor(
+        processes,
+        initializer=_init_tenant_worker,
+        initargs=(log_queue, tenants[0].config),
+    ) as pool:
+        futures = []
+        for group in groups:
+            futures.append(pool.submit(_run_tenant_group, group, first_port))
+            first_port += len(group)
+        for f in futures:
+            f.result()
 
 
 if __name__ == "__main__":
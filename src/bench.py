@@ -0,0 +1,151 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+from logging import WARNING, Logger
+from time import perf_counter
+
+from IntervalIndex import IntervalIndex
+
+# Benchmarks for the hot paths of the local database. Run with
+#   python3 src/bench.py
+
+HOUR = 60 * 60
+EPOCH = 1_700_000_000  # arbitrary start of the simulated booking calendar
+PEAK_BOOKINGS_PER_DAY = 40
+
+
+def _timed(fn, repeat: int) -> float:
+    """Returns the mean wall-clock time of fn() in milliseconds"""
+    start = perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (perf_counter() - start) / repeat * 1000
+
+
+def bench_interval_index(n: int = 100_000, queries: int = 1_000) -> dict[str, float]:
+    """Compares window/point queries over n bookings using the R*Tree
+    interval index against a B-tree index on the start time alone"""
+    conn = sqlite3.connect(":memory:")
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE bookings (id INTEGER PRIMARY KEY, start REAL, end REAL)")
+    cur.execute("CREATE INDEX bookingsStart ON bookings (start)")
+    index = IntervalIndex(cur, "booking_intervals")
+    index.create()
+
+    rng = random.Random(0)
+    rows = []
+    for i in range(n):
+        start = EPOCH + rng.randrange(0, 365 * 24) * HOUR
+        rows.append((i, start, start + rng.choice((1, 1.5, 2)) * HOUR))
+    cur.executemany("INSERT INTO bookings VALUES (?, ?, ?)", rows)
+    index.insert(rows)
+    conn.commit()
+
+    points = [EPOCH + rng.random() * 365 * 24 * HOUR for _ in range(queries)]
+    it = iter(points * 4)
+
+    def scan_window():
+        t = next(it)
+        q = "SELECT id FROM bookings WHERE start<=? AND end>=?"
+        cur.execute(q, (t + HOUR, t)).fetchall()
+
+    def scan_point():
+        t = next(it)
+        q = "SELECT id FROM bookings WHERE start<=? AND end>?"
+        cur.execute(q, (t, t)).fetchall()
+
+    def index_window():
+        t = next(it)
+        index.overlapping(t, t + HOUR)
+
+    results = {
+        "scan_window_ms": _timed(scan_window, queries),
+        "scan_point_ms": _timed(scan_point, queries),
+        "index_window_ms": _timed(index_window, queries),
+        "index_point_ms": _timed(lambda: index.covering(next(it)), queries),
+    }
+    conn.close()
+    return results
+
+
+def _empty_database(dirpath: str) -> tuple[str, str]:
+    """Creates the original tables that Database expects to find, and an
+    empty roster, and returns their paths"""
+    db_path = os.path.join(dirpath, "cte.sqlite3")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        """CREATE TABLE bookings (id INTEGER PRIMARY KEY, timestamp REAL NOT NULL,
+            msgChannelID TEXT, msgTimestamp REAL, msgText TEXT,
+            lastChange REAL NOT NULL, adminNotifiedPIDs INTEGER DEFAULT 0, email TEXT);
+        CREATE TABLE employees (firstName TEXT NOT NULL, lastName TEXT NOT NULL,
+            id INTEGER PRIMARY KEY, slackID TEXT UNIQUE, isAdmin INTEGER NOT NULL);
+        CREATE TABLE pids (pid INTEGER NOT NULL, firstName TEXT NOT NULL,
+            lastName TEXT NOT NULL, bookingID INTEGER NOT NULL);"""
+    )
+    conn.close()
+    roster_path = os.path.join(dirpath, "roster.csv")
+    with open(roster_path, "w") as f:
+        f.write("lastName,firstName,PID\nLast,First,17\n")
+    return db_path, roster_path
+
+
+def bench_sync(scale: int = 10, changed: float = 0.01) -> dict[str, float]:
+    """Runs the booking sync against a fake Bookeo serving scale times the
+    peak daily booking volume: a first sync of every booking, then a
+    two-phase sync after a fraction of them changed"""
+    import Bookeo
+    from Coordinator import FETCH_DELTA
+    from Database import Database
+    from FakeUpstreams import FakeBookeo
+
+    dirpath = tempfile.mkdtemp()
+    # Measure our side of the pipeline rather than Bookeo's rate limit
+    interval, Bookeo.MIN_REQUEST_INTERVAL = Bookeo.MIN_REQUEST_INTERVAL, 0
+    try:
+        fake = FakeBookeo(
+            PEAK_BOOKINGS_PER_DAY * scale, FETCH_DELTA.days, roster=[(17, "First", "Last")]
+        )
+        logger = Logger("bench", level=WARNING)
+        db_path, roster_path = _empty_database(dirpath)
+        db = Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        db.refresh_roster()
+
+        def sync(**kwargs):
+            db.new_cycle()
+            bookings = db.fetch_bookings(FETCH_DELTA, **kwargs)
+            db.insert_new_bookings(bookings)
+            db.update_changed_bookings(bookings)
+            db.get_invalid_pids([b.id for b in bookings])
+
+        results = {"bookings": len(fake.bookings)}
+        results["first_sync_ms"] = _timed(sync, 1)
+        results["first_sync_requests"] = fake.requests
+        for number in random.Random(0).sample(
+            list(fake.bookings), int(len(fake.bookings) * changed)
+        ):
+            fake.touch(number)
+        results["changed_sync_ms"] = _timed(
+            lambda: sync(changed_only=True, two_phase=True), 1
+        )
+        requests = fake.requests - results["first_sync_requests"]
+        results["changed_sync_requests"] = requests
+        db._conn.close()
+        return results
+    finally:
+        Bookeo.MIN_REQUEST_INTERVAL = interval
+        shutil.rmtree(dirpath)
+
+
+def main():
+    print("Interval index, 100k bookings (mean per query):")
+    for name, ms in bench_interval_index().items():
+        print(f"  {name:<16} {ms:8.3f} ms")
+    print("Booking sync, 10x peak volume against a fake Bookeo:")
+    for name, value in bench_sync().items():
+        print(f"  {name:<22} {value:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
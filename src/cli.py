@@ -0,0 +1,228 @@
+import argparse
+import logging
+import os
+import sys
+from datetime import timedelta
+
+from app import get_secrets, open_database, validate_secrets
+from Secrets import secret_keys
+from Tenant import Tenant, load_tenants
+
+# Entry point for the coordinator loop and for one-shot maintenance jobs,
+# which reuse the same components and can run alongside the loop, e.g.
+#   python3 src/cli.py sync --window 60
+#   python3 src/cli.py notify --dry-run
+
+logger = logging.getLogger("eric-cte")
+
+
+def _tenant(args: argparse.Namespace) -> Tenant:
+    secrets = get_secrets(args.config)
+    validate_secrets(secrets, secret_keys)
+    if not args.tenant:
+        return Tenant("default", secrets)
+    if not secrets.get("TENANTS_DIR"):
+        raise ValueError("--tenant needs TENANTS_DIR to be set in the config")
+    for t in load_tenants(secrets["TENANTS_DIR"], secrets):
+        if t.name == args.tenant:
+            validate_secrets(t.config, secret_keys)
+            return t
+    raise ValueError(f"Tenant {args.tenant} not found")
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    from app import main
+
+    main(args.config)
+    return 0
+
+
+def cmd_sync(args: argparse.Namespace) -> int:
+    db = open_database(logger, _tenant(args))
+    try:
+        bookings = db.fetch_bookings(timedelta(days=args.window))
+        if bookings is None:
+            print("Could not fetch bookings from Bookeo", file=sys.stderr)
+            return 1
+        new_bookings = db.insert_new_bookings(bookings)
+        changed = db.update_changed_bookings(bookings)
+    finally:
+        db.close()
+    print(
+        f"Fetched {len(bookings)} booking(s): "
+        f"{len(new_bookings)} new, {len(changed)} changed"
+    )
+    return 0
+
+
+def cmd_validate(args: argparse.Namespace) -> int:
+    from Coordinator import FETCH_DELTA
+
+    db = open_database(logger, _tenant(args))
+    try:
+        db.refresh_roster()
+        if args.all:
+            bookings = db.get_all_bookings()
+        else:
+            bookings = db.get_upcoming_bookings(FETCH_DELTA)
+        invalid_pids = db.get_invalid_pids([b.id for b in bookings])
+        invalid = 0
+        for b in bookings:
+            for m in db.match_pids(invalid_pids.get(b.id, [])):
+                if m.status == m.VALID:
+                    continue
+                invalid += 1
+                line = f"{b.id}\t{b.start.isoformat()}\t{m.status}\t{m.pid}"
+                if m.suggestion is not None:
+                    line += f"\tdid they mean {m.suggestion}?"
+                print(line)
+    finally:
+        db.close()
+    print(f"{invalid} invalid PID(s) in {len(bookings)} booking(s)", file=sys.stderr)
+    return 0
+
+
+def cmd_notify(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from app import build_coordinator
+    from Coordinator import FETCH_DELTA
+
+    coordinator, db = build_coordinator(logger, _tenant(args), 0)
+
+    async def notify():
+        await coordinator.load_admins()
+
+        def validate(d):
+            # A dry run writes nothing, so it checks against the roster as
+            # last loaded
+            if not args.dry_run:
+                d.refresh_roster()
+            bookings = d.get_upcoming_bookings(FETCH_DELTA)
+            return coordinator.validate(d, bookings, [], claim=not args.dry_run)
+
+        notifications = await db.run(validate)
+        for n in notifications:
+            if args.dry_run:
+                print(f"To {', '.join(n.slack_ids) or '(nobody)'}: {n.message}")
+            else:
+                await coordinator.deliver(n)
+        return len(notifications)
+
+    try:
+        sent = asyncio.run(notify())
+    finally:
+        db.close()
+    verb = "Would send" if args.dry_run else "Sent"
+    print(f"{verb} {sent} notification(s)", file=sys.stderr)
+    return 0
+
+
+def cmd_replay_outbox(args: argparse.Namespace) -> int:
+    import asyncio
+
+    from app import build_coordinator
+    from Coordinator import NotLeader
+
+    coordinator, db = build_coordinator(logger, _tenant(args), 0)
+
+    async def replay():
+        # The leader replays the outbox as well, so this has to become it
+        await coordinator.renew_leadership()
+        try:
+            await coordinator.replay_outbox()
+        finally:
+            await coordinator.step_down()
+        return await db.call("count_journaled_messages")
+
+    try:
+        remaining = asyncio.run(replay())
+    except NotLeader:
+        print("Another process is the leader and replays the outbox", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    print(f"{remaining} message(s) still journaled", file=sys.stderr)
+    return 0 if remaining == 0 else 1
+
+
+def cmd_rebuild_roster_index(args: argparse.Namespace) -> int:
+    db = open_database(logger, _tenant(args))
+    try:
+        print(db.rebuild_roster_index())
+    finally:
+        db.close()
+    return 0
+
+
+def cmd_report(args: argparse.Namespace) -> int:
+    import Analytics
+
+    tenant = _tenant(args)
+    argv = [tenant.config["CTE_DB_PATH"], args.report, "--weeks", str(args.weeks)]
+    Analytics.main(argv)
+    return 0
+
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    import bench
+
+    bench.main()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="eric-cte")
+    parser.add_argument("--config", default="config.env", help="path to config.env")
+    parser.add_argument("--tenant", help="tenant to use, from TENANTS_DIR")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("run", help="run the coordinator until stopped")
+    p = commands.add_parser("sync", help="fetch and store bookings once")
+    p.add_argument("--window", type=int, default=31, help="days ahead to fetch")
+    p = commands.add_parser("validate", help="list invalid on-campus PIDs")
+    p.add_argument(
+        "--all", action="store_true", help="include every stored booking"
+    )
+    p = commands.add_parser("notify", help="send due invalid-PID alerts once")
+    p.add_argument(
+        "--dry-run", action="store_true", help="print the alerts instead"
+    )
+    commands.add_parser("replay-outbox", help="send journaled Slack messages")
+    commands.add_parser(
+        "rebuild-roster-index", help="recompile the roster snapshot and table"
+    )
+    p = commands.add_parser("report", help="print booking statistics")
+    p.add_argument("report", choices=["weekly", "slots"])
+    p.add_argument("--weeks", type=int, default=12)
+    commands.add_parser("bench", help="run the database benchmarks")
+    return parser
+
+
+COMMANDS = {
+    "run": cmd_run,
+    "sync": cmd_sync,
+    "validate": cmd_validate,
+    "notify": cmd_notify,
+    "replay-outbox": cmd_replay_outbox,
+    "rebuild-roster-index": cmd_rebuild_roster_index,
+    "report": cmd_report,
+    "bench": cmd_bench,
+}
+
+
+def main(argv: list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command != "run":
+        logging.basicConfig(
+            level=logging.DEBUG if args.verbose else logging.WARNING,
+            format="%(levelname)s: %(message)s",
+        )
+    return COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+    os.chdir("..")
+    sys.exit(main())
@@ -39,17 +39,24 @@ class TestBooking(unittest.TestCase):
         now = datetime.now()
         pids = [1, 2, 3]
 
-        booking = Booking(123456789, now, pids)
+        booking = Booking(123456789, now, pids, now, "foo@example.com")
         self.assertEqual(booking.id, 123456789)
         self.assertEqual(booking.start, now)
         self.assertEqual(booking.on_campus_pids, pids)
+        self.assertEqual(booking.last_change, now)
+        self.assertEqual(booking.email, "foo@example.com")
+        self.assertEqual(booking.end, now)
 
         with self.assertRaises(ValueError):
-            Booking(-1, now, [])
+            Booking(-1, now, [], now, "")
         with self.assertRaises(TypeError):
-            Booking(123456789, None, [])
+            Booking(123456789, None, [], now, "")
         with self.assertRaises(TypeError):
-            Booking(123456789, 200, [])
+            Booking(123456789, 200, [], now, "")
+        with self.assertRaises(TypeError):
+            Booking(123456789, now, [], None, "")
+        with self.assertRaises(TypeError):
+            Booking(123456789, now, [], now, "", 200)
 
 
 class TestPID(unittest.TestCase):
@@ -448,17 +455,2040 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(b_1[0].start, dt)
         self.assertEqual(len(b_2), 0)
 
-    def test_delete_if_lastchange_stale(self):
-        pass
+    def test_get_remove_canceled_bookings(self):
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Database import Database
+        from FakeUpstreams import FakeBookeo
+
+        start = datetime.now(timezone.utc) - timedelta(days=1)
+        fake = FakeBookeo(bookings_per_day=2, days=4, start=start)
+        db_path, roster_path = temp_database_files(self)
+        logger = Logger("test", level=INFO)
+        db = Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        self.addCleanup(db._conn.close)
+
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            db.insert_new_bookings(db.fetch_bookings(timedelta(days=4), start))
+            numbers = sorted(fake.bookings)
+            # Bookings that have started aren't returned by Bookeo any more
+            # either, but they weren't canceled
+            for n in numbers:
+                if datetime.fromisoformat(fake.bookings[n]["startTime"]) < start:
+                    del fake.bookings[n]
+            self.assertEqual(db.get_remove_canceled_bookings(timedelta(days=3)), [])
+
+            future = [
+                n
+                for n, b in fake.bookings.items()
+                if datetime.fromisoformat(b["startTime"]) > start + timedelta(days=1)
+            ]
+            canceled = fake.bookings.pop(future[0])
+            (b,) = db.get_remove_canceled_bookings(timedelta(days=3))
+
+            # Checking for cancellations doesn't hide changes from the next sync
+            sync = lambda: db.fetch_bookings(
+                timedelta(days=3), changed_only=True, two_phase=True
+            )
+            sync()
+            fake.touch(future[1])
+            db.get_remove_canceled_bookings(timedelta(days=3))
+            self.assertIn(int(future[1]), [c.id for c in sync()])
+        self.assertEqual(b.id, int(canceled["bookingNumber"]))
+        self.assertEqual(len(b.on_campus_pids), len(canceled["participants"]["details"]) - 1)
+        self.assertIsNone(db.get_booking(b.id))
+        self.assertEqual(db.get_on_campus_pids(b.id), [])
+
+        # A booking created after the IDs were fetched, and stored by a sync
+        # in the meantime, wasn't canceled
+        start = datetime.now(timezone.utc)
+        ids = db.fetch_booking_ids(timedelta(days=3), start)
+        new = fake.add_booking(start + timedelta(days=2))
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            db.insert_new_bookings(db.fetch_bookings(timedelta(days=3), start))
+        self.assertEqual(db.remove_canceled_bookings(ids, timedelta(days=3), start), [])
+        self.assertIsNotNone(db.get_booking(int(new["bookingNumber"])))
+
+
+class TestDatabaseWorkload(unittest.TestCase):
+    """Runs a randomized sequence of syncs, changes, cancellations, clears,
+    PID removals and notification claims against a database of 10k+
+    bookings, checking invariants after every step. Set WORKLOAD_SEED to
+    replay a failing sequence."""
+
+    BOOKINGS_PER_DAY = 350
+    DAYS = 33
+    STEPS = 25
+    # Seconds a single operation may take at this scale
+    BUDGETS = {
+        "load": 15.0,
+        "fetch": 5.0,
+        "cancel": 2.0,
+        "clear": 2.0,
+        "remove_pid": 0.5,
+        "notify": 2.0,
+    }
+
+    def setUp(self):
+        import random
+        from datetime import datetime, timedelta, timezone
+        from logging import WARNING, Logger
+        from unittest import mock
+
+        from Database import Database
+        from FakeUpstreams import FakeBookeo
+
+        self.seed = int(os.environ.get("WORKLOAD_SEED", 0))
+        self.rng = random.Random(self.seed)
+        patcher = mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # The calendar starts two days ago, so there is something to clear
+        self.start = (datetime.now(timezone.utc) - timedelta(days=2)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        self.fake = FakeBookeo(
+            self.BOOKINGS_PER_DAY,
+            self.DAYS,
+            self.start,
+            invalid_pid_rate=0.2,
+            roster=[(17, "Nolan", "Welch")],
+            seed=self.seed,
+        )
+        db_path, roster_path = temp_database_files(self)
+        logger = Logger("test", level=WARNING)
+        self.db = Database(logger, db_path, roster_path, "X", "X", bookeo_session=self.fake)
+        # Another process using the same file, racing for notifications
+        self.other = Database(logger, db_path, roster_path, "X", "X")
+        for db in (self.db, self.other):
+            self.addCleanup(db._conn.close)
+            db.refresh_roster()
+
+        self.claimed: set[int] = set()  # bookings whose alert has been claimed
+        self.removed: set[int] = set()  # PIDs removed with remove_pid
+        self.added: dict[int, int] = {}  # booking ID -> PID added upstream
+
+    def _timed(self, op: str, fn):
+        from time import perf_counter
+
+        t = perf_counter()
+        result = fn()
+        elapsed = perf_counter() - t
+        self.assertLess(elapsed, self.BUDGETS[op], f"{op} took {elapsed:.2f}s")
+        return result
+
+    def _upcoming(self, margin) -> list[str]:
+        """Booking numbers upstream starting between now + margin and the
+        end of the sync window - margin"""
+        from datetime import datetime, timezone
+
+        from Coordinator import FETCH_DELTA
+
+        now = datetime.now(timezone.utc)
+        return sorted(
+            n
+            for n, b in self.fake.bookings.items()
+            if now + margin
+            <= datetime.fromisoformat(b["startTime"])
+            <= now + FETCH_DELTA - margin
+        )
+
+    def load(self):
+        from datetime import timedelta
+
+        def load():
+            bookings = self.db.fetch_bookings(timedelta(days=self.DAYS), self.start)
+            return self.db.insert_new_bookings(bookings)
+
+        inserted = self._timed("load", load)
+        self.assertGreaterEqual(len(inserted), 10_000)
+        self.assertEqual(len(inserted), len(self.fake.bookings))
+
+    def fetch(self):
+        from datetime import datetime, timedelta, timezone
+
+        from Coordinator import FETCH_DELTA
+
+        now = datetime.now(timezone.utc)
+
+        def sync():
+            self.db.new_cycle()
+            pending = []
+            bookings = self.db.fetch_bookings(
+                FETCH_DELTA,
+                changed_only=self.rng.random() < 0.5,
+                two_phase=True,
+                pending=pending,
+            )
+            self.db.insert_new_bookings(bookings)
+            diffs = self.db.update_changed_bookings(bookings)
+            self.db.save_fetched_windows(pending)
+            return diffs
+
+        for diff in self._timed("fetch", sync):
+            if diff.added:
+                self.claimed.discard(diff.booking.id)
+
+        # Every booking upstream in the window is stored, at its current time
+        lo, hi = now + timedelta(minutes=1), now + FETCH_DELTA
+        q = "SELECT id, timestamp FROM bookings WHERE timestamp>=? AND timestamp<?"
+        stored = dict(self.db._cur.execute(q, (lo.timestamp(), hi.timestamp())).fetchall())
+        upstream = {}
+        for n, b in self.fake.bookings.items():
+            t = datetime.fromisoformat(b["startTime"])
+            if lo <= t < hi:
+                upstream[int(n)] = t.timestamp()
+        self.assertEqual(stored, upstream)
+
+        # with the PIDs added upstream since the last sync
+        for id, pid in self.added.items():
+            if pid not in self.removed:
+                self.assertIn(pid, [p.id for p in self.db.get_on_campus_pids(id)])
+        self.added.clear()
+
+    def change(self):
+        from datetime import datetime, timedelta
+
+        for n in self.rng.sample(self._upcoming(timedelta(days=1)), 5):
+            if self.rng.random() < 0.5:
+                b = self.fake.bookings[n]
+                for key in ("startTime", "endTime"):
+                    t = datetime.fromisoformat(b[key]) + timedelta(hours=1)
+                    b[key] = t.isoformat()
+                self.fake.touch(n)
+            else:
+                p = self.fake.add_participant(n)
+                pid = int(p["personDetails"]["customFields"][0]["value"])
+                self.added[int(n)] = pid
+
+    def cancel(self):
+        from datetime import timedelta
+
+        from Coordinator import FETCH_DELTA
+
+        numbers = self.rng.sample(self._upcoming(timedelta(hours=1)), 3)
+        for n in numbers:
+            del self.fake.bookings[n]
+        canceled = self._timed(
+            "cancel", lambda: self.db.get_remove_canceled_bookings(FETCH_DELTA)
+        )
+        self.assertEqual(sorted(b.id for b in canceled), sorted(int(n) for n in numbers))
+        for b in canceled:
+            self.claimed.discard(b.id)
+            self.added.pop(b.id, None)
+
+    def clear(self):
+        from datetime import datetime, timezone
+
+        now = datetime.now(timezone.utc).timestamp()
+        q = "SELECT COUNT(*) FROM bookings_archive"
+        archived = self.db._cur.execute(q).fetchone()[0]
+        q = "SELECT COUNT(*) FROM bookings WHERE timestamp<?"
+        expired = self.db._cur.execute(q, (now,)).fetchone()[0]
+
+        self._timed("clear", self.db.clear)
+        self.assertEqual(self.db._cur.execute(q, (now,)).fetchone()[0], 0)
+        q = "SELECT COUNT(*) FROM bookings_archive"
+        self.assertGreaterEqual(self.db._cur.execute(q).fetchone()[0], archived + expired)
+
+    def remove_pid(self):
+        from PID import PID
+
+        q = "SELECT DISTINCT pid FROM pids ORDER BY pid"
+        pid = self.rng.choice([r[0] for r in self.db._cur.execute(q).fetchall()])
+        self._timed("remove_pid", lambda: self.db.remove_pid(PID(pid, "X", "X")))
+        q = "SELECT COUNT(*) FROM pids WHERE pid=?"
+        self.assertEqual(self.db._cur.execute(q, (pid,)).fetchone()[0], 0)
+        self.removed.add(pid)
+
+    def notify(self):
+        from datetime import timedelta
+
+        def claim() -> list[int]:
+            bookings = self.db.get_upcoming_bookings(timedelta(days=2))
+            invalid = self.db.get_invalid_pids([b.id for b in bookings])
+            claimed = []
+            for b in bookings:
+                if b.id not in invalid:
+                    continue
+                # Both processes try to alert on every booking
+                for db in self.rng.sample([self.db, self.other], 2):
+                    if db.claim_admin_notification(b):
+                        claimed.append(b.id)
+            return claimed
+
+        for id in self._timed("notify", claim):
+            self.assertNotIn(id, self.claimed, f"Booking {id} alerted on twice")
+            self.claimed.add(id)
+
+    def check_invariants(self):
+        cur = self.db._cur
+        q = "SELECT COUNT(*) FROM pids WHERE bookingID NOT IN (SELECT id FROM bookings)"
+        self.assertEqual(cur.execute(q).fetchone()[0], 0, "orphan PIDs")
+        q = """SELECT COUNT(*) FROM bookings b
+            LEFT JOIN booking_intervals i ON i.id=b.id
+            WHERE i.id IS NULL OR i.start!=b.timestamp"""
+        self.assertEqual(cur.execute(q).fetchone()[0], 0, "bookings missing from index")
+        q = """SELECT COUNT(*) FROM booking_intervals
+            WHERE id NOT IN (SELECT id FROM bookings)"""
+        self.assertEqual(cur.execute(q).fetchone()[0], 0, "stale index entries")
+        q = "SELECT COUNT(*) FROM bookings WHERE id IN (SELECT id FROM bookings_archive)"
+        self.assertEqual(cur.execute(q).fetchone()[0], 0, "archived bookings kept")
+
+        # Only bookings whose alert was claimed are marked notified
+        q = "SELECT id FROM bookings WHERE adminNotifiedPIDs=1"
+        notified = {r[0] for r in cur.execute(q).fetchall()}
+        stored = {r[0] for r in cur.execute("SELECT id FROM bookings").fetchall()}
+        self.assertEqual(notified, self.claimed & stored)
+
+    def test_random_workload(self):
+        self.load()
+        self.check_invariants()
+        ops = [self.fetch, self.change, self.cancel, self.clear, self.remove_pid, self.notify]
+        history = []
+        for _ in range(self.STEPS):
+            op = self.rng.choices(ops, [3, 3, 1, 1, 2, 2])[0]
+            history.append(op.__name__)
+            try:
+                op()
+                self.check_invariants()
+            except AssertionError as e:
+                raise AssertionError(f"{e} (seed {self.seed}, after {history})") from e
+
+
+class TestShift(unittest.TestCase):
+    def test_shift_init(self):
+        from datetime import datetime, timedelta
+
+        from Shift import Shift
+
+        now = datetime.now()
+        shift = Shift(13051138, now, now + timedelta(hours=4))
+        self.assertEqual(shift.employee_id, 13051138)
+        self.assertEqual(shift.start, now)
+        self.assertEqual(shift.end, now + timedelta(hours=4))
+
+        with self.assertRaises(ValueError):
+            Shift(-1, now, now + timedelta(hours=4))
+        with self.assertRaises(ValueError):
+            Shift(13051138, now, now)
+        with self.assertRaises(TypeError):
+            Shift(13051138, None, now)
+
+    def test_get_on_shift_employees(self):
+        from datetime import datetime, timedelta, timezone
+
+        from Shift import Shift
+
+        db = temp_database(self)
+        db._cur.execute(
+            """INSERT INTO employees (firstName, lastName, id, slackID, isAdmin)
+            VALUES ('Nolan', 'Welch', 1, 'U1', 1), ('Foo', 'Bar', 2, 'U2', 0)"""
+        )
+        db._conn.commit()
+
+        t = datetime(2023, 9, 9, 12, tzinfo=timezone.utc)
+        h = timedelta(hours=1)
+        db.replace_shifts(
+            [Shift(1, t - 2 * h, t + h), Shift(2, t + h, t + 5 * h)], t - 5 * h, t + 5 * h
+        )
+        self.assertEqual([e.employee_id for e in db.get_on_shift_employees(t)], [1])
+        self.assertEqual(
+            [e.employee_id for e in db.get_on_shift_employees(t + 2 * h)], [2]
+        )
+        self.assertEqual(db.get_on_shift_employees(t + 6 * h), [])
+
+        # Re-syncing a window replaces what was stored for it
+        db.replace_shifts([Shift(2, t - h, t + h)], t - 5 * h, t + 5 * h)
+        self.assertEqual([e.employee_id for e in db.get_on_shift_employees(t)], [2])
+        self.assertEqual(db.get_on_shift_employees(t + 2 * h), [])
+
+
+class TestIntervalIndex(unittest.TestCase):
+    def test_matches_full_scan(self):
+        import random
+        import sqlite3
+
+        from IntervalIndex import IntervalIndex
+
+        cur = sqlite3.connect(":memory:").cursor()
+        index = IntervalIndex(cur, "intervals")
+        index.create()
+
+        # Timestamps large enough that 32-bit R*Tree coordinates are lossy
+        rng = random.Random(0)
+        base = 1_700_000_000
+        rows = []
+        for i in range(500):
+            start = base + rng.randrange(0, 50_000)
+            rows.append((i, start, start + rng.randrange(1, 5_000)))
+        index.insert(rows)
+
+        for _ in range(100):
+            lo = base + rng.randrange(0, 55_000)
+            hi = lo + rng.randrange(0, 2_000)
+            expected = {i for i, s, e in rows if s <= hi and e >= lo}
+            self.assertEqual(set(index.overlapping(lo, hi)), expected)
+            expected = {i for i, s, e in rows if s <= lo < e}
+            self.assertEqual(set(index.covering(lo)), expected)
+
+        index.delete([r[0] for r in rows])
+        self.assertEqual(index.overlapping(base, base + 60_000), [])
+
+    def test_get_overlapping_bookings(self):
+        from datetime import datetime, timedelta, timezone
+
+        from Booking import Booking
+
+        db = temp_database(self)
+        t = datetime(2023, 9, 9, 12, tzinfo=timezone.utc)
+        h = timedelta(hours=1)
+        db.insert_new_bookings(
+            [
+                Booking(1, t, [], t, "a@example.com", t + h),
+                Booking(2, t + 2 * h, [], t, "b@example.com", t + 3 * h),
+            ]
+        )
+        ids = [b.id for b in db.get_overlapping_bookings(t + h / 2, t + 2 * h)]
+        self.assertEqual(sorted(ids), [1, 2])
+        ids = [b.id for b in db.get_overlapping_bookings(t + 3 * h / 2, t + 7 * h / 4)]
+        self.assertEqual(ids, [])
+        booking = db.get_overlapping_bookings(t - h, t)[0]
+        self.assertEqual(booking.end, t + h)
+        self.assertEqual(booking.email, "a@example.com")
+
+
+class TestRetention(unittest.TestCase):
+    def test_archive_and_purge(self):
+        from datetime import datetime, timedelta, timezone
+
+        from Booking import Booking
+        from PID import PID
+
+        db = temp_database(self)
+        now = datetime.now(timezone.utc)
+        past, old = now - timedelta(days=1), now - timedelta(days=400)
+        db.insert_new_bookings(
+            [
+                Booking(1, past, [PID(17, "Nolan", "Welch")], past, "a@example.com"),
+                Booking(2, old, [], old, ""),
+                Booking(3, now + timedelta(days=1), [PID(99, "Foo", "Bar")], now, ""),
+            ]
+        )
+        self.assertEqual(db._cur.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+
+        db.clear()
+        ids = [r[0] for r in db._cur.execute("SELECT id FROM bookings").fetchall()]
+        self.assertEqual(ids, [3])
+        pids = db._cur.execute("SELECT bookingID FROM pids").fetchall()
+        self.assertEqual(pids, [(3,)])
+        self.assertEqual(db.get_overlapping_bookings(old, past), [])
+
+        archived = db.get_archived_bookings(old, now)
+        self.assertEqual([b.id for b in archived], [2, 1])
+        self.assertEqual(archived[1].email, "a@example.com")
+        self.assertEqual(archived[1].on_campus_pids, [PID(17, "Nolan", "Welch")])
+        self.assertEqual(db.archive_bookings(now.timestamp()), 0)
+
+        self.assertEqual(db.purge_archive(), 0)  # kept forever by default
+        db._archive_retention = timedelta(days=365)
+        self.assertEqual(db.purge_archive(), 1)
+        self.assertEqual([b.id for b in db.get_archived_bookings(old, now)], [1])
+
+
+class TestBookingDiff(unittest.TestCase):
+    def test_update_changed_bookings(self):
+        from datetime import datetime, timedelta, timezone
+
+        from Booking import Booking
+        from PID import PID
+
+        db = temp_database(self)
+        now = datetime.now(timezone.utc)
+        t = now + timedelta(days=1)
+        later = now + timedelta(minutes=5)
+        valid, invalid = PID(17, "Nolan", "Welch"), PID(99, "Foo", "Bar")
+        db.insert_new_bookings([Booking(1, t, [valid, invalid], now, "a@example.com")])
+        self.assertTrue(db.claim_admin_notification(Booking(1, t, [], now, "")))
+        db.remove_pid(invalid)  # as after the admins were alerted
+
+        # Not newer than the stored copy, so not compared at all
+        self.assertEqual(db.update_changed_bookings([Booking(1, t, [], now, "")]), [])
+
+        # Still including the alerted PID is not a change
+        same = Booking(1, t, [valid, invalid], later, "a@example.com")
+        self.assertEqual(db.update_changed_bookings([same]), [])
+        self.assertTrue(db.admin_notified_pids(same))
+
+        added = PID(42, "New", "Person")
+        changed = Booking(
+            1,
+            t + timedelta(hours=1),
+            [invalid, added],
+            later + timedelta(minutes=5),
+            "b@example.com",
+        )
+        (diff,) = db.update_changed_bookings([changed])
+        self.assertEqual(diff.start, (t, t + timedelta(hours=1)))
+        self.assertEqual(diff.email, ("a@example.com", "b@example.com"))
+        self.assertEqual(diff.added, [added])
+        self.assertEqual(diff.removed, [valid])
+
+        stored = db.get_booking(1)
+        self.assertEqual(stored.start, t + timedelta(hours=1))
+        self.assertEqual(stored.email, "b@example.com")
+        self.assertEqual(stored.on_campus_pids, [added])
+        self.assertEqual(db.get_overlapping_bookings(t, t + timedelta(minutes=30)), [])
+        # Only the new PID needs validating, so the booking can be alerted on again
+        self.assertFalse(db.admin_notified_pids(stored))
+        self.assertEqual(db.get_events("test")[-1].data["addedPIDs"], [42])
+
+
+class TestLazyBooking(unittest.TestCase):
+    def test_lazy_pids_and_identity(self):
+        from datetime import datetime, timedelta, timezone
+        from unittest import mock
+
+        from Booking import Booking
+        from PID import PID
 
-    def test_mark_employee_notified(self):
-        pass
+        db = temp_database(self)
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        pid = PID(17, "Nolan", "Welch")
+        db.insert_new_bookings([Booking(1, t, [pid], t, "a@example.com")])
 
-    def test_get_employee_message(self):
-        pass
+        with mock.patch.object(db, "get_on_campus_pids", wraps=db.get_on_campus_pids):
+            (b,) = db.get_upcoming_bookings(timedelta(days=2))
+            self.assertIs(db.get_booking(1), b)
+            self.assertIs(db.get_overlapping_bookings(t, t)[0], b)
+            self.assertEqual((b.id, b.start, b.email), (1, t, "a@example.com"))
+            db.get_on_campus_pids.assert_not_called()
+        self.assertEqual(b.on_campus_pids, [pid])
+
+        db.remove_pid(pid)
+        self.assertIsNot(db.get_booking(1), b)
+        self.assertEqual(db.get_booking(1).on_campus_pids, [])
+        b = db.get_booking(1)
+        db.new_cycle()
+        self.assertIsNot(db.get_booking(1), b)
+
+
+    def test_cycle_cache(self):
+        from datetime import datetime, timedelta, timezone
+
+        from Booking import Booking
+        from PID import PID
+
+        db = temp_database(self)
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        pid = PID(17, "Nolan", "Welch")
+        booking = Booking(1, t, [pid], t, "")
+        db.insert_new_bookings([booking])
+        db.new_cycle()
+
+        statements = []
+        db._conn.set_trace_callback(statements.append)
+        for _ in range(3):
+            self.assertEqual(db.get_on_campus_pids(1), [pid])
+            self.assertFalse(db.admin_notified_pids(booking))
+            self.assertEqual(db.get_slack_id(5), "")
+        self.assertEqual(len(statements), 3)
+
+        # Writes invalidate what they touch
+        db.mark_admin_notified_pids(booking)
+        self.assertTrue(db.admin_notified_pids(booking))
+        db.remove_pid(pid)
+        self.assertEqual(db.get_on_campus_pids(1), [])
+
+
+class TestAnalytics(unittest.TestCase):
+    def test_aggregates(self):
+        import io
+        from contextlib import redirect_stdout
+        from datetime import datetime, timedelta, timezone
+        from unittest import mock
+
+        from Analytics import LOCAL_TIMEZONE, main
+        from Booking import Booking
+
+        db = temp_database(self)
+        # Next Saturday at 2pm and 3pm local time, and the Monday after it
+        d = (datetime.now() + timedelta(days=7)).date()
+        d -= timedelta(days=d.weekday() - 5)
+        local = lambda d: datetime(d.year, d.month, d.day, 14, tzinfo=LOCAL_TIMEZONE)
+        t = local(d).astimezone(timezone.utc)
+        monday = local(d + timedelta(days=2)).astimezone(timezone.utc)
+        h = timedelta(hours=1)
+        booked = datetime.now(timezone.utc) - h
+        bookings = [
+            Booking(1, t, [], booked, ""),
+            Booking(2, t + h, [], booked, ""),
+            Booking(3, monday, [], booked, ""),
+        ]
+        db.insert_new_bookings(bookings)
+        db.record_invalid_pids(bookings[0], 2)
+        db.fetch_booking_ids = mock.Mock(return_value={b.id for b in bookings[1:]})
+        canceled = db.get_remove_canceled_bookings(timedelta(days=31))
+        self.assertEqual([b.id for b in canceled], [1])
+
+        week = (d - timedelta(days=5)).isoformat()
+        next_week = (d + timedelta(days=2)).isoformat()
+        self.assertEqual(
+            db._analytics.weekly(), [(next_week, 1, 0, 0), (week, 2, 1, 2)]
+        )
+        self.assertEqual(db._analytics.weekly(1), [(next_week, 1, 0, 0)])
+        self.assertEqual(
+            db._analytics.slots(),
+            [(0, 14, 1, 0, 0), (5, 14, 1, 1, 2), (5, 15, 1, 0, 0)],
+        )
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            main([db._db_filepath, "slots"])
+        self.assertIn("Sat 14:00         1         1         100%", out.getvalue())
+
+        # A booking moved to another slot is counted there instead
+        moved = Booking(3, monday + 2 * h, [], datetime.now(timezone.utc) - h / 2, "")
+        db.update_changed_bookings([moved])
+        db.fetch_booking_ids = mock.Mock(return_value={2})
+        canceled = db.get_remove_canceled_bookings(timedelta(days=31))
+        self.assertEqual([b.id for b in canceled], [3])
+        self.assertEqual(
+            db._analytics.slots(),
+            [(0, 14, 0, 0, 0), (0, 16, 1, 1, 0), (5, 14, 1, 1, 2), (5, 15, 1, 0, 0)],
+        )
+
+
+class TestEventLog(unittest.TestCase):
+    def test_events(self):
+        from datetime import datetime, timedelta, timezone
+        from unittest import mock
+
+        from Booking import Booking
+        from EventLog import BookingEvent
+        from PID import PID
+
+        db = temp_database(self)
+        now = datetime.now(timezone.utc)
+        t = now + timedelta(days=1)
+        pid = PID(99, "Foo", "Bar")
+        bookings = [
+            Booking(1, t, [pid], now, ""),
+            Booking(2, t, [], now, ""),
+            Booking(3, now - timedelta(hours=1), [], now, ""),
+        ]
+        db.insert_new_bookings(bookings)
+        db.remove_pid(pid)
+        changed = Booking(2, t, [], now + timedelta(minutes=1), "new@example.com")
+        self.assertEqual(db.insert_new_bookings([changed]), [])
+        db.update_changed_bookings([changed])
+        db.fetch_booking_ids = mock.Mock(return_value={b.id for b in bookings[1:]})
+        db.get_remove_canceled_bookings(timedelta(days=2))
+        db.clear()
+
+        events = db.get_events("test")
+        self.assertEqual(
+            [(e.type, e.booking_id) for e in events],
+            [
+                (BookingEvent.CREATED, 1),
+                (BookingEvent.CREATED, 2),
+                (BookingEvent.CREATED, 3),
+                (BookingEvent.PID_INVALIDATED, 1),
+                (BookingEvent.MODIFIED, 2),
+                (BookingEvent.CANCELED, 1),
+                (BookingEvent.EXPIRED, 3),
+            ],
+        )
+        self.assertEqual(events[0].data["pids"], [99])
+
+        # Consumers read incrementally from their own cursor
+        db.ack_events("test", events[3].seq)
+        self.assertEqual(db.get_events("test", limit=1)[0].seq, events[4].seq)
+        self.assertEqual(len(db.get_events("other")), len(events))
+        db.ack_events("test", events[0].seq)  # cursors never move backwards
+        self.assertEqual(len(db.get_events("test")), 3)
+
+
+class TestRoster(unittest.TestCase):
+    def test_load_roster_diff(self):
+        from csv import DictWriter
+        from datetime import datetime, timezone
+
+        from Booking import Booking
+        from PID import PID
+
+        db = temp_database(self)
+        diff = db.load_roster(db._roster_filepath)
+        self.assertEqual(diff.added, [PID(17, "Nolan", "Welch")])
+        self.assertFalse(db.load_roster(db._roster_filepath))
+
+        t = datetime(2023, 9, 9, 12, tzinfo=timezone.utc)
+        db.insert_new_bookings(
+            [
+                Booking(1, t, [PID(17, "Nolan", "Welch")], t, ""),
+                Booking(2, t, [PID(18, "Foo", "Bar"), PID(19, "Baz", "Qux")], t, ""),
+                Booking(3, t, [PID(20, "Lorem", "Ipsum")], t, ""),
+            ]
+        )
+        self.assertEqual(
+            {k: [p.id for p in v] for k, v in db.get_invalid_pids([1, 2, 3]).items()},
+            {2: [18, 19], 3: [20]},
+        )
+
+        with open(db._roster_filepath, "w", newline="") as f:
+            writer = DictWriter(f, fieldnames=["lastName", "firstName", "PID"])
+            writer.writeheader()
+            writer.writerow({"lastName": "Welch-Smith", "firstName": "Nolan", "PID": 17})
+            writer.writerow({"lastName": "Bar", "firstName": "Foo", "PID": 18})
+            writer.writerow({"lastName": "", "firstName": "Bad", "PID": "x"})
+
+        diff = db.load_roster(db._roster_filepath)
+        self.assertEqual([p.id for p in diff.added], [18])
+        self.assertEqual(diff.removed, [])
+        self.assertEqual([new.last_name for _, new in diff.renamed], ["Welch-Smith"])
+        self.assertEqual(diff.affected_ids, {17, 18})
+
+        # Booking 3 is untouched by the diff, so it isn't revalidated
+        invalid = db.revalidate_bookings(diff)
+        self.assertEqual({k: [p.id for p in v] for k, v in invalid.items()}, {1: [17], 2: [19]})
+
+    def test_snapshot(self):
+        import os
+        from csv import DictWriter
+
+        from PID import PID
+        from RosterSnapshot import RosterSnapshot
+
+        db = temp_database(self)
+        path = db._roster_filepath
+        snapshot = RosterSnapshot(path)
+        self.addCleanup(snapshot.close)
+        self.assertTrue(os.path.exists(path + ".snap"))
+        self.assertEqual(snapshot.get(17), PID(17, "Nolan", "Welch"))
+        self.assertIsNone(snapshot.get(18))
+        self.assertFalse(snapshot.refresh())
+
+        with open(path, "w", newline="") as f:
+            writer = DictWriter(f, fieldnames=["lastName", "firstName", "PID"])
+            writer.writeheader()
+            for i in range(1000, 0, -3):
+                writer.writerow({"lastName": f"Last{i}", "firstName": "Zoë", "PID": i})
+        os.utime(path, (0, 12345))
+
+        self.assertTrue(snapshot.refresh())
+        self.assertEqual(len(snapshot), 334)
+        self.assertIsNone(snapshot.get(17))
+        self.assertEqual(snapshot.get(997), PID(997, "Zoë", "Last997"))
+        self.assertEqual(snapshot.get(1), PID(1, "Zoë", "Last1"))
+        self.assertEqual([p.id for p in snapshot], list(range(1, 1001, 3)))
+        self.assertEqual(db.get_matching_pid(PID(17, "Nolan", "Welch")), PID(17, "Nolan", "Welch"))
+        db.refresh_roster()
+        self.assertEqual(db.get_matching_pid(PID(10, "Zoë", "Last10")), PID(10, "Zoë", "Last10"))
+
+        # Writers compiling at the same time each write their own temporary
+        # file, so the snapshot that wins is always complete
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(8) as pool:
+            futures = [
+                pool.submit(RosterSnapshot.compile, path, path + ".snap")
+                for _ in range(32)
+            ]
+            for f in futures:
+                f.result()
+        snapshot.close()
+        self.assertTrue(snapshot.refresh())
+        self.assertEqual([p.id for p in snapshot], list(range(1, 1001, 3)))
+        self.assertEqual(snapshot.get(997), PID(997, "Zoë", "Last997"))
+        directory = os.path.dirname(path)
+        self.assertEqual([n for n in os.listdir(directory) if n.endswith(".tmp")], [])
+
+
+class TestPIDMatcher(unittest.TestCase):
+    def test_helpers(self):
+        from PIDMatcher import bounded_distance, normalize_name, soundex
+
+        self.assertEqual(normalize_name(" O'Brien-Smith "), "obriensmith")
+        self.assertEqual(normalize_name("Zoë"), "zoe")
+        self.assertEqual(soundex("robert"), "R163")
+        self.assertEqual(soundex("rupert"), "R163")
+        self.assertEqual(soundex("ashcraft"), "A261")
+        self.assertEqual(soundex("lee"), "L000")
+        self.assertEqual(bounded_distance("kitten", "sitting", 3), 3)
+        self.assertEqual(bounded_distance("kitten", "sitting", 2), 3)
+        self.assertEqual(bounded_distance("abc", "abcdefg", 2), 3)
+
+    def test_match(self):
+        import random
+        from time import perf_counter
+
+        from PID import PID
+        from PIDMatcher import PIDMatch, PIDMatcher
+
+        rng = random.Random(0)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+
+        def random_name():
+            return "".join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+
+        roster = [PID(100000000 + i * 7, "First", random_name()) for i in range(30000)]
+        roster += [
+            PID(730012345, "Nolan", "Welch"),
+            PID(730054321, "Mary", "Smith-Jones"),
+        ]
+        matcher = PIDMatcher(roster)
+
+        match = matcher.match(PID(730012345, "nolan", " welch "))
+        self.assertEqual(match.status, PIDMatch.VALID)
+        match = matcher.match(PID(730054321, "Mary", "Jones"))
+        self.assertEqual(match.status, PIDMatch.VALID)
+
+        match = matcher.match(PID(730012345, "Nolan", "Welsh"))
+        self.assertEqual(match.status, PIDMatch.NEAR)
+        self.assertEqual(match.suggestion, PID(730012345, "Nolan", "Welch"))
+
+        match = matcher.match(PID(730012354, "Nolan", "Welch"))
+        self.assertEqual(match.status, PIDMatch.NEAR)
+        self.assertEqual(match.suggestion.id, 730012345)
+
+        match = matcher.match(PID(999999999, "Foo", "Bar"))
+        self.assertEqual(match.status, PIDMatch.INVALID)
+        self.assertIsNone(match.suggestion)
+
+        # A month of bookings' worth of PIDs, most of them bad
+        pids = [PID(200000000 + i, "First", random_name()) for i in range(2000)]
+        start = perf_counter()
+        for p in pids:
+            matcher.match(p)
+        self.assertLess(perf_counter() - start, 0.5)
+
+
+class TestBookeo(unittest.TestCase):
+    def test_fetch_bookings_windows(self):
+        import json
+        import shutil
+        import tempfile
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Bookeo import Bookeo
+
+        def response(body):
+            return mock.Mock(
+                status_code=200,
+                content=json.dumps(body).encode(),
+                headers={},
+                json=mock.Mock(return_value=body),
+            )
+
+        second_window = []
+
+        def get(url, params, headers=None):
+            b = lambda n, day: {"bookingNumber": n, "startTime": f"2023-09-{day}T12:00:00Z"}
+            if "pageNumber" in params:
+                return response({"data": [b("3", "03")]})
+            elif params["startTime"].startswith("2023-09-01"):
+                # The first window has a second page and a booking that
+                # spans into the next window
+                return response(
+                    {
+                        "info": {"totalPages": 2, "pageNavigationToken": "abc"},
+                        "data": [b("1", "01"), b("2", "07")],
+                    }
+                )
+            return response({"data": [b("2", "07"), b("4", "12")] + second_window})
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        bookeo = Bookeo(Logger("test", level=INFO), "X", "X", cache_dir=cache_dir)
+        bookeo._session = mock.Mock(get=mock.Mock(side_effect=get))
+        start = datetime(2023, 9, 1, 6, tzinfo=timezone.utc)
+        data = bookeo.fetch_bookings(start, start + timedelta(days=10))
+
+        # Bookings outside the requested range are dropped
+        self.assertEqual([b["bookingNumber"] for b in data], ["1", "2", "3"])
+        windows = {
+            (c.kwargs["params"].get("startTime"), c.kwargs["params"].get("endTime"))
+            for c in bookeo._session.get.call_args_list
+        }
+        self.assertEqual(
+            windows,
+            {
+                ("2023-09-01T00:00:00Z", "2023-09-08T00:00:00Z"),
+                ("2023-09-08T00:00:00Z", "2023-09-15T00:00:00Z"),
+                (None, None),
+            },
+        )
+        self.assertNotIn("X", "".join(os.listdir(cache_dir)))
+
+        # Unchanged windows are skipped, but still served from the cache
+        # when the full result is needed
+        data = bookeo.fetch_bookings(start, start + timedelta(days=10), changed_only=True)
+        self.assertEqual(data, [])
+        data = bookeo.fetch_bookings(start, start + timedelta(days=10))
+        self.assertEqual([b["bookingNumber"] for b in data], ["1", "2", "3"])
+        second_window.append({"bookingNumber": "5", "startTime": "2023-09-09T12:00:00Z"})
+        data = bookeo.fetch_bookings(start, start + timedelta(days=10), changed_only=True)
+        self.assertEqual([b["bookingNumber"] for b in data], ["2", "5"])
+
+        bookeo._session.get.side_effect = lambda *a, **k: mock.Mock(status_code=500)
+        self.assertIsNone(bookeo.fetch_bookings(start, start + timedelta(days=10)))
+
+    def test_unreadable_cache(self):
+        import json
+        import shutil
+        import tempfile
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Bookeo import Bookeo
+
+        body = {"data": [{"bookingNumber": "1", "startTime": "2023-09-01T12:00:00Z"}]}
+
+        def get(url, params, headers=None):
+            if headers and headers.get("If-None-Match") == "v1":
+                return mock.Mock(status_code=304, headers={})
+            return mock.Mock(
+                status_code=200,
+                content=json.dumps(body).encode(),
+                headers={"ETag": "v1"},
+                json=mock.Mock(return_value=body),
+            )
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        bookeo = Bookeo(Logger("test", level=INFO), "X", "X", cache_dir=cache_dir)
+        bookeo._session = mock.Mock(get=mock.Mock(side_effect=get))
+        start = datetime(2023, 9, 1, 6, tzinfo=timezone.utc)
+        fetch = lambda: bookeo.fetch_bookings(start, start + timedelta(days=1))
+        self.assertEqual(len(fetch()), 1)
+        self.assertEqual(len(fetch()), 1)
+        self.assertFalse([n for n in os.listdir(cache_dir) if n.endswith(".tmp")])
+
+        # Data left truncated by a crash is fetched again without validators
+        (name,) = [n for n in os.listdir(cache_dir) if n.endswith(".data")]
+        with open(os.path.join(cache_dir, name), "w") as f:
+            f.write('[{"bookingNum')
+        bookeo._session.get.reset_mock()
+        self.assertEqual(len(fetch()), 1)
+        self.assertEqual(bookeo._session.get.call_count, 2)
+        self.assertNotIn("headers", bookeo._session.get.call_args.kwargs)
+        self.assertEqual(len(fetch()), 1)
+
+    def test_unchanged_pages(self):
+        import shutil
+        import tempfile
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Bookeo import Bookeo
+        from bench import PEAK_BOOKINGS_PER_DAY
+        from FakeUpstreams import FakeBookeo
+
+        # At peak volume every window spans several pages, each first page
+        # with a new page navigation token
+        start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0)
+        fake = FakeBookeo(PEAK_BOOKINGS_PER_DAY, 14, start)
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        logger = Logger("test", level=INFO)
+        bookeo = Bookeo(logger, "X", "X", cache_dir=cache_dir, session=fake)
+        fetch = lambda: bookeo.fetch_bookings(
+            start, start + timedelta(days=14), changed_only=True
+        )
+
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            self.assertEqual(len(fetch()), len(fake.bookings))
+            self.assertEqual(fetch(), [])
+            number = next(iter(fake.bookings))
+            fake.touch(number)
+            self.assertEqual(len(fetch()), 7 * PEAK_BOOKINGS_PER_DAY)
+
+    def test_failed_sync_is_retried(self):
+        from datetime import timedelta
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Database import Database
+        from FakeUpstreams import FakeBookeo, FakeResponse
+
+        fake = FakeBookeo(bookings_per_day=3, days=10)
+        db_path, roster_path = temp_database_files(self)
+        logger = Logger("test", level=INFO)
+        db = Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        self.addCleanup(db._conn.close)
+
+        def sync():
+            db.new_cycle()
+            pending = []
+            bookings = db.fetch_bookings(
+                timedelta(days=10), changed_only=True, two_phase=True, pending=pending
+            )
+            if bookings is None:
+                return None
+            db.insert_new_bookings(bookings)
+            db.update_changed_bookings(bookings)
+            db.save_fetched_windows(pending)
+            return bookings
+
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            self.assertEqual(len(sync()), 30)
+            self.assertEqual(sync(), [])
+
+            number = next(iter(fake.bookings))
+            fake.add_participant(number)
+            expected = len(fake.bookings[number]["participants"]["details"]) - 1
+            handle = fake.handle
+            failures = [FakeResponse(500, {})]
+
+            def fail_once(method, path, params, body):
+                if path.endswith(number) and failures:
+                    return failures.pop()
+                return handle(method, path, params, body)
+
+            # The sync fails after the booking list was fetched, so the
+            # window it changed in must not count as unchanged afterwards
+            with mock.patch.object(fake, "handle", side_effect=fail_once):
+                self.assertIsNone(sync())
+                self.assertIn(int(number), [b.id for b in sync()])
+            self.assertEqual(len(db.get_on_campus_pids(int(number))), expected)
+            self.assertEqual(sync(), [])
+
+
+    def test_cache_per_database(self):
+        from datetime import timedelta
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Database import Database
+        from FakeUpstreams import FakeBookeo
+
+        # Two tenants whose databases share a directory
+        db_path, roster_path = temp_database_files(self)
+        other_path = os.path.join(os.path.dirname(db_path), "other.sqlite3")
+        setup_db(other_path)
+        logger = Logger("test", level=INFO)
+        dbs = []
+        for path, seed in ((db_path, 1), (other_path, 2)):
+            fake = FakeBookeo(bookings_per_day=3, days=10, seed=seed)
+            db = Database(logger, path, roster_path, "X", "X", bookeo_session=fake)
+            self.addCleanup(db._conn.close)
+            dbs.append(db)
+
+        sync = lambda db: db.fetch_bookings(timedelta(days=10), changed_only=True)
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            for db in dbs:
+                self.assertEqual(len(sync(db)), 30)
+            for db in dbs:
+                self.assertEqual(sync(db), [])
+
+    def test_rate_limit(self):
+        import json
+        from datetime import datetime, timedelta, timezone
+        from email.utils import format_datetime
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Bookeo import MAX_RETRY_WAIT, Bookeo, parse_retry_after
+
+        self.assertIsNone(parse_retry_after(None))
+        self.assertEqual(parse_retry_after("2"), 2)
+        later = datetime.now(timezone.utc) + timedelta(minutes=2)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(later, True)), 120, -1)
+
+        def response(status, retry_after=None):
+            body = {"data": [{"bookingNumber": "1", "startTime": "2023-09-01T12:00:00Z"}]}
+            return mock.Mock(
+                status_code=status,
+                content=json.dumps(body).encode(),
+                headers={"Retry-After": retry_after} if retry_after else {},
+                json=mock.Mock(return_value=body),
+            )
+
+        bookeo = Bookeo(Logger("test", level=INFO), "X", "X")
+        bookeo._session = mock.Mock()
+        start = datetime(2023, 9, 1, 6, tzinfo=timezone.utc)
+        fetch = lambda: bookeo.fetch_bookings(start, start + timedelta(days=1))
+
+        # A short pause is waited out and the request retried, more slowly
+        bookeo._session.get.side_effect = [response(429, "0"), response(200)]
+        self.assertEqual(len(fetch()), 1)
+        self.assertGreater(bookeo._interval, 0)
+
+        # A long one fails the fetch without any further requests
+        bookeo._session.get.side_effect = [response(429, "600")]
+        self.assertIsNone(fetch())
+        self.assertGreater(bookeo.retry_after(), MAX_RETRY_WAIT)
+        self.assertIsNone(fetch())
+        self.assertEqual(bookeo._session.get.call_count, 3)
+
+    def test_two_phase_fetch(self):
+        import json
+        from datetime import datetime, timedelta, timezone
+        from unittest import mock
+
+        db = temp_database(self)
+        db._bookeo._cache = None
+        changes = {"1": "2023-09-01T12:00:00Z", "2": "2023-09-01T12:00:00Z"}
+
+        def booking(n, expanded):
+            b = {
+                "bookingNumber": n,
+                "startTime": "2023-09-09T12:00:00Z",
+                "endTime": "2023-09-09T13:00:00Z",
+                "lastChangeTime": changes[n],
+            }
+            if expanded:
+                person = {
+                    "firstName": "Nolan",
+                    "lastName": "Welch",
+                    "emailAddress": f"{n}@example.com",
+                    "customFields": [{"name": "PID", "value": int(n)}],
+                }
+                b["participants"] = {
+                    "details": [
+                        {
+                            "personId": "PSELF",
+                            "peopleCategoryId": "MPJWRE",
+                            "personDetails": person,
+                        }
+                    ]
+                }
+            return b
+
+        def get(url, params, headers=None):
+            if url.endswith("/bookings"):
+                self.assertFalse(params["expandParticipants"])
+                body = {"data": [booking(n, False) for n in changes]}
+            else:
+                self.assertTrue(params["expandParticipants"])
+                body = booking(url.rsplit("/", 1)[1], True)
+            return mock.Mock(
+                status_code=200,
+                content=json.dumps(body).encode(),
+                json=mock.Mock(return_value=body),
+            )
+
+        db._bookeo._session = mock.Mock(get=mock.Mock(side_effect=get))
+        start = datetime(2023, 9, 9, tzinfo=timezone.utc)
+        fetch = lambda: db.fetch_bookings(timedelta(days=1), start, two_phase=True)
+        detail_urls = lambda: sorted(
+            c.args[0].rsplit("/", 1)[1]
+            for c in db._bookeo._session.get.call_args_list
+            if not c.args[0].endswith("/bookings")
+        )
+
+        bookings = fetch()
+        self.assertEqual(detail_urls(), ["1", "2"])
+        self.assertEqual([b.email for b in bookings], ["1@example.com", "2@example.com"])
+        db.insert_new_bookings(bookings)
+
+        db._bookeo._session.get.reset_mock()
+        changes["2"] = "2023-09-02T12:00:00Z"
+        bookings = fetch()
+        self.assertEqual(detail_urls(), ["2"])
+        self.assertEqual([b.id for b in bookings], [1, 2])
+        self.assertEqual([p.id for p in bookings[0].on_campus_pids], [1])
+        self.assertEqual(bookings[0].email, "1@example.com")
+        self.assertEqual(bookings[0].end, bookings[0].start + timedelta(hours=1))
+
+
+class TestFakeUpstreams(unittest.TestCase):
+    def test_upstream_must_handle(self):
+        from FakeUpstreams import FakeUpstream
+
+        self.assertRaises(TypeError, FakeUpstream)
+
+        class Incomplete(FakeUpstream):
+            pass
+
+        self.assertRaises(TypeError, Incomplete)
+
+    def test_sync_against_fake_bookeo(self):
+        from datetime import timedelta
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Database import Database
+        from FakeUpstreams import FakeBookeo
+
+        roster = [(17, "Nolan", "Welch")]
+        fake = FakeBookeo(bookings_per_day=3, days=10, invalid_pid_rate=0.5, roster=roster)
+        db_path, roster_path = temp_database_files(self)
+        logger = Logger("test", level=INFO)
+        db = Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        self.addCleanup(db._conn.close)
+        db.refresh_roster()
+
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            bookings = db.fetch_bookings(timedelta(days=10), two_phase=True)
+            self.assertEqual(len(db.insert_new_bookings(bookings)), 30)
+            expected = {}
+            for n, b in fake.bookings.items():
+                on_campus = b["participants"]["details"][1:]
+                pids = [p["personDetails"]["customFields"][0]["value"] for p in on_campus]
+                expected[int(n)] = len([p for p in pids if p != "17"])
+            invalid = db.get_invalid_pids([b.id for b in bookings])
+            self.assertEqual({id: len(invalid.get(id, [])) for id in expected}, expected)
+
+            # Only changed bookings have their participants fetched again
+            requests = fake.requests
+            fake.touch(next(iter(fake.bookings)))
+            db.new_cycle()
+            db.fetch_bookings(timedelta(days=10), two_phase=True)
+            self.assertEqual(fake.requests - requests, 2 + 1)
+
+    def test_first_two_phase_sync(self):
+        from datetime import timedelta
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from bench import PEAK_BOOKINGS_PER_DAY
+        from Coordinator import FETCH_DELTA
+        from Database import Database
+        from FakeUpstreams import FakeBookeo
+
+        fake = FakeBookeo(PEAK_BOOKINGS_PER_DAY, FETCH_DELTA.days)
+        db_path, roster_path = temp_database_files(self)
+        logger = Logger("test", level=INFO)
+        db = Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        self.addCleanup(db._conn.close)
+
+        # Every booking is new, so whole windows are fetched again with
+        # participants rather than one request per booking
+        with mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0):
+            bookings = db.fetch_bookings(FETCH_DELTA, two_phase=True)
+            db.insert_new_bookings(bookings)
+        self.assertLess(fake.requests, 40)
+        self.assertEqual({str(b.id) for b in bookings}, set(fake.bookings))
+        for b in bookings:
+            details = fake.bookings[str(b.id)]["participants"]["details"]
+            self.assertEqual(len(b.on_campus_pids), len(details) - 1)
+
+    def test_faults(self):
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+
+        from Bookeo import Bookeo
+        from FakeUpstreams import FakeBookeo
+
+        fake = FakeBookeo(bookings_per_day=1, days=1, rate_limit=1)
+        url = "https://api.bookeo.com/v2/bookings/1000000"
+        self.assertEqual(fake.get(url).status_code, 200)
+        res = fake.get(url)
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.headers["Retry-After"], "1")
+
+        fake = FakeBookeo(bookings_per_day=1, days=1, error_rate=1)
+        bookeo = Bookeo(Logger("test", level=INFO), "X", "X", session=fake)
+        start = datetime.now(timezone.utc)
+        self.assertIsNone(bookeo.fetch_bookings(start, start + timedelta(days=1)))
+        self.assertEqual(fake.status_counts, {500: 1})
+
+    def test_fake_slack_and_sling(self):
+        from datetime import time, timedelta
+        from logging import INFO, Logger
+
+        from FakeUpstreams import FakeSlack, FakeSling
+        from SlackApp import SlackApp
+        from Sling import Sling
+
+        logger = Logger("test", level=INFO)
+        fake = FakeSlack()
+        slack = SlackApp(logger, "X", time(21, 0), time(8, 0), session=fake)
+        res = slack.send_message("C1", "Hello")
+        self.assertEqual(res.resolved_channel_id, "C1")
+        self.assertEqual(fake.sent, [("C1", "Hello")])
+
+        sling = Sling(logger, "X", "X", session=FakeSling([5, 6]))
+        shifts = sling.fetch_shifts(timedelta(days=2))
+        self.assertEqual({s.employee_id for s in shifts}, {5, 6})
+
+    def test_shadow_mode(self):
+        import sqlite3
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+
+        from app import build_coordinator, open_database
+        from Booking import Booking
+        from Tenant import Tenant
+
+        db_path, roster_path = temp_database_files(self)
+        config = {
+            "CTE_DB_PATH": db_path,
+            "CAMPUS_ROSTER_PATH": roster_path,
+            "BOOKEO_SECRET_KEY": "X",
+            "BOOKEO_API_KEY": "X",
+            "SLACK_BOT_TOKEN": "X",
+            "SLING_USERNAME": "X",
+            "SLING_PASSWORD": "X",
+            "SHADOW_MODE": "true",
+        }
+        tenant = Tenant("default", config)
+        logger = Logger("test", level=INFO)
+        db = open_database(logger, tenant)
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        db.insert_new_bookings([Booking(1, t, [], t, "")])
+        db._conn.close()
+
+        conn = sqlite3.connect(db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM bookings").fetchone(), (0,))
+        conn.close()
+
+        coordinator, worker = build_coordinator(logger, tenant, 0)
+        worker.close()
+        coordinator._slack.send_message("C1", "Hello")
+        self.assertEqual(coordinator._slack._session.sent, [("C1", "Hello")])
+
+    def test_fake_sling_has_shifts(self):
+        import asyncio
+        import sqlite3
+        from datetime import datetime, timezone
+        from logging import INFO, Logger
+
+        from app import build_coordinator
+        from Tenant import Tenant
+
+        db_path, roster_path = temp_database_files(self)
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            """INSERT INTO employees (firstName, lastName, id, slackID, isAdmin)
+            VALUES ('Nolan', 'Welch', 2, 'U2', 0)"""
+        )
+        conn.commit()
+        conn.close()
+        config = {
+            "CTE_DB_PATH": db_path,
+            "CAMPUS_ROSTER_PATH": roster_path,
+            "BOOKEO_SECRET_KEY": "X",
+            "BOOKEO_API_KEY": "X",
+            "SLACK_BOT_TOKEN": "X",
+            "SLING_USERNAME": "X",
+            "SLING_PASSWORD": "X",
+            "UPSTREAMS": "fake",
+        }
+        logger = Logger("test", level=INFO)
+        coordinator, db = build_coordinator(logger, Tenant("default", config), 0)
+        self.addCleanup(db.close)
+
+        # The fake Sling serves shifts for the employees in the database
+        async def sync():
+            await coordinator.renew_leadership()
+            await coordinator.sync_shifts()
+
+        asyncio.run(sync())
+        t = datetime.now(timezone.utc).replace(hour=16, minute=0)
+        on_shift = asyncio.run(db.call("get_on_shift_employees", t))
+        self.assertEqual([e.employee_id for e in on_shift], [2])
+
+
+class TestCoordinator(unittest.TestCase):
+    def test_validate_and_notify(self):
+        import asyncio
+        import json
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Booking import Booking
+        from Coordinator import Coordinator
+        from Database import Database
+        from DatabaseWorker import DatabaseWorker
+        from PID import PID
+
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        db = DatabaseWorker(lambda: Database(logger, db_path, roster_path, "X", "X"))
+        self.addCleanup(db.close)
+        slack = mock.Mock()
+        slack.send_multiple.side_effect = lambda ids, m: [mock.Mock() for _ in ids]
+        coordinator = Coordinator(logger, db, slack, mock.Mock(), status_port=0)
+
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        booking = Booking(1, t, [PID(17, "Nolan", "Welch"), PID(99, "Foo", "Bar")], t, "")
+
+        async def scenario():
+            await db.call("insert_new_bookings", [booking])
+            await db.run(
+                lambda d: d._cur.execute(
+                    """INSERT INTO employees (firstName, lastName, id, slackID, isAdmin)
+                    VALUES ('Nolan', 'Welch', 1, 'U1', 1)"""
+                )
+            )
+            coordinator._synced = asyncio.Queue()
+            coordinator._outbox = asyncio.Queue()
+            coordinator._sync_now = asyncio.Event()
+            coordinator._admin_slack_ids = ["U1"]
+            await db.call("refresh_roster")
+
+            tasks = [
+                asyncio.create_task(coordinator._validate_forever()),
+                asyncio.create_task(coordinator._notify_forever()),
+            ]
+            await coordinator._synced.put(([booking], []))
+            for _ in range(100):
+                if slack.send_multiple.called and await db.call(
+                    "admin_notified_pids", booking
+                ):
+                    if len(await db.call("get_on_campus_pids", 1)) == 1:
+                        break
+                await asyncio.sleep(0.01)
+
+            server = await asyncio.start_server(
+                coordinator._handle_status_request, "127.0.0.1", 0
+            )
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /webhook HTTP/1.1\r\nHost: x\r\n\r\n")
+            response = await reader.read()
+            server.close()
+            for task in tasks:
+                task.cancel()
+            return response
+
+        response = asyncio.run(scenario())
+        self.assertTrue(response.startswith(b"HTTP/1.1 202"))
+        self.assertEqual(json.loads(response.split(b"\r\n\r\n")[1]), {"ok": True})
+
+        slack_ids, message = slack.send_multiple.call_args.args
+        self.assertEqual(slack_ids, ["U1"])
+        self.assertIn("*99* (Bar, Foo)", message)
+        self.assertNotIn("*17*", message)
+        pids = asyncio.run(db.call("get_on_campus_pids", 1))
+        self.assertEqual([p.id for p in pids], [17])
+
+
+    def test_leader_lease_and_claims(self):
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+
+        from Booking import Booking
+        from Database import Database
+        from Leases import Leases
+
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        a = Database(logger, db_path, roster_path, "X", "X")
+        b = Database(logger, db_path, roster_path, "X", "X")
+        self.addCleanup(a._conn.close)
+        self.addCleanup(b._conn.close)
+
+        def acquire(db: Database, holder: str, ttl: timedelta) -> bool:
+            acquired = Leases(db._cur).acquire("leader", holder, ttl)
+            db._conn.commit()
+            return acquired
+
+        ttl = timedelta(seconds=30)
+        self.assertTrue(acquire(a, "a", ttl))
+        self.assertFalse(acquire(b, "b", ttl))
+        self.assertTrue(acquire(a, "a", ttl))  # renewal
+        Leases(a._cur).release("leader", "a")
+        a._conn.commit()
+        self.assertTrue(acquire(b, "b", ttl))
+        # An expired lease can be taken over
+        self.assertTrue(acquire(b, "b", timedelta(seconds=-1)))
+        self.assertTrue(acquire(a, "a", ttl))
+
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        booking = Booking(1, t, [], t - timedelta(days=2), "")
+        self.assertEqual(a.insert_new_bookings([booking]), [booking])
+        self.assertEqual(b.insert_new_bookings([booking]), [])
+
+        self.assertTrue(a.claim_admin_notification(booking))
+        self.assertFalse(b.claim_admin_notification(booking))
+        a.release_admin_notification(booking)
+        self.assertTrue(b.claim_admin_notification(booking))
+
+        # Removing a canceled booking claims it for one process only
+        start = datetime.now(timezone.utc)
+        canceled = a.remove_canceled_bookings(set(), timedelta(days=2), start)
+        self.assertEqual([c.id for c in canceled], [1])
+        canceled = b.remove_canceled_bookings(set(), timedelta(days=2), start)
+        self.assertEqual(canceled, [])
+
+    def test_lease_renewal(self):
+        import asyncio
+        import threading
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Booking import Booking
+        from Coordinator import LEASE_TTL, Coordinator, NotLeader
+        from Database import Database
+        from DatabaseWorker import DatabaseWorker
+
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        db = DatabaseWorker(lambda: Database(logger, db_path, roster_path, "X", "X"))
+        self.addCleanup(db.close)
+        leader = Coordinator(logger, db, mock.Mock(), mock.Mock(), status_port=0)
+        standby = Coordinator(logger, db, mock.Mock(), mock.Mock(), status_port=0)
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        asyncio.run(db.call("insert_new_bookings", [Booking(1, t, [], t, "")]))
+        db._db.fetch_booking_ids = mock.Mock(return_value=set())
+
+        async def scenario():
+            # The lease is renewed even while the database thread is busy
+            busy = threading.Event()
+            task = asyncio.create_task(db.run(lambda d: busy.wait(10)))
+            await asyncio.wait_for(leader.renew_leadership(), 1)
+            await asyncio.wait_for(standby.renew_leadership(), 1)
+            busy.set()
+            await task
+
+        asyncio.run(scenario())
+        self.assertTrue(leader._holds_lease())
+        self.assertFalse(standby._holds_lease())
+
+        # A leader whose lease may have run out does nothing more
+        leader._lease_expires -= LEASE_TTL.total_seconds()
+        with self.assertRaises(NotLeader):
+            asyncio.run(leader.notify_cancellations())
+        self.assertIsNotNone(asyncio.run(db.call("get_booking", 1)))
+
+        # A standby on the same host runs without the status endpoint that
+        # the other copy already serves
+        import socket
+
+        with socket.create_server(("127.0.0.1", 0)) as taken:
+            port = taken.getsockname()[1]
+            standby = Coordinator(
+                logger, db, mock.Mock(), mock.Mock(), status_port=port
+            )
+            with self.assertLogs(logger, "WARNING"):
+                self.assertIsNone(asyncio.run(standby._serve_status()))
+
+
+    def test_offline_journal(self):
+        import asyncio
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from CircuitBreaker import CircuitBreaker
+        from Coordinator import Coordinator
+        from Database import Database
+        from DatabaseWorker import DatabaseWorker
+
+        breaker = CircuitBreaker("x", failure_threshold=2)
+        self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow())
+        breaker._opened_at -= breaker._reset_timeout
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        db = DatabaseWorker(lambda: Database(logger, db_path, roster_path, "X", "X"))
+        self.addCleanup(db.close)
+        slack = mock.Mock()
+        coordinator = Coordinator(logger, db, slack, mock.Mock(), status_port=0)
+        asyncio.run(coordinator.renew_leadership())
+        sent = []
+
+        async def scenario():
+            # Slack is down: both messages are journaled in order
+            slack.send_multiple.side_effect = lambda ids, m: [None for _ in ids]
+            for m in ("first", "second"):
+                failed = await coordinator._send(["U1"], m)
+                await db.call("journal_message", failed, m)
+            self.assertEqual(await db.call("count_journaled_messages"), 2)
+
+            # Slack is back: they are replayed oldest first and removed
+            coordinator._breakers["slack"].record_success()
+            slack.send_multiple.side_effect = lambda ids, m: [
+                sent.append(m) or mock.Mock() for _ in ids
+            ]
+            await coordinator.replay_outbox()
+            self.assertEqual(await db.call("count_journaled_messages"), 0)
+
+        asyncio.run(scenario())
+        self.assertEqual(sent, ["first", "second"])
+
+        # Sling can't be reached at all: the failures still open its breaker
+        import requests
+        from Sling import Sling
+
+        session = mock.Mock(headers={})
+        session.get.side_effect = session.post.side_effect = requests.ConnectionError
+        coordinator._sling = Sling(logger, "X", "X", session=session)
+        breaker = coordinator._breakers["sling"]
+        while breaker.allow():
+            with self.assertRaises(ConnectionError):
+                asyncio.run(coordinator.sync_shifts())
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+
+    def test_notify_cancellations(self):
+        import asyncio
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Booking import Booking
+        from Coordinator import Coordinator
+        from Database import Database
+        from DatabaseWorker import DatabaseWorker
+        from Shift import Shift
+
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        db = DatabaseWorker(lambda: Database(logger, db_path, roster_path, "X", "X"))
+        self.addCleanup(db.close)
+        slack = mock.Mock()
+        slack.send_multiple.side_effect = lambda ids, m: [mock.Mock() for _ in ids]
+        coordinator = Coordinator(logger, db, slack, mock.Mock(), status_port=0)
+        asyncio.run(coordinator.renew_leadership())
+        coordinator._admin_slack_ids = ["U1"]
+
+        t = datetime.now(timezone.utc) + timedelta(days=1)
+        h = timedelta(hours=1)
+        booked = datetime.now(timezone.utc) - h
+        bookings = [Booking(i, t + i * h, [], booked, "") for i in (1, 2, 3)]
+
+        def setup(d: Database):
+            d.insert_new_bookings(bookings)
+            d._cur.execute(
+                """INSERT INTO employees (firstName, lastName, id, slackID, isAdmin)
+                VALUES ('Nolan', 'Welch', 2, 'U2', 0)"""
+            )
+            d.replace_shifts([Shift(2, t, t + 3 * h / 2)], t, t + 4 * h)
+            d.fetch_booking_ids = mock.Mock(return_value={b.id for b in bookings[2:]})
+
+        asyncio.run(db.run(setup))
+        asyncio.run(coordinator.notify_cancellations())
+
+        sent = {c.args[0][0]: c.args[1] for c in slack.send_multiple.call_args_list}
+        self.assertEqual(sorted(sent), ["U1", "U2"])
+        self.assertIn("2 bookings were canceled", sent["U1"])
+        self.assertIn("*1*", sent["U2"])
+        self.assertNotIn("*2*", sent["U2"])
+        self.assertNotIn("*3*", sent["U1"])
+
+
+    def test_sync_off_database_thread(self):
+        import asyncio
+        import threading
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Coordinator import Coordinator
+        from Database import Database
+        from DatabaseWorker import DatabaseWorker
+        from FakeUpstreams import FakeBookeo
+
+        patcher = mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        fake = FakeBookeo(bookings_per_day=0, days=0)
+        fake.add_booking(datetime.now(timezone.utc) + timedelta(days=1))
+        db = DatabaseWorker(
+            lambda: Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        )
+        self.addCleanup(db.close)
+        coordinator = Coordinator(logger, db, mock.Mock(), mock.Mock(), status_port=0)
+        asyncio.run(coordinator.renew_leadership())
+        coordinator._synced = asyncio.Queue()
+
+        # Bookeo hangs until released
+        released = threading.Event()
+        handle = fake.handle
+        fake.handle = lambda *a: released.wait(10) and handle(*a)
+
+        async def scenario():
+            sync = asyncio.create_task(coordinator.sync_bookings())
+            while not fake.requests:
+                await asyncio.sleep(0.01)
+            # The database stays available to other tasks meanwhile
+            count = await asyncio.wait_for(db.call("count_journaled_messages"), 1)
+            released.set()
+            await sync
+            return count
+
+        self.assertEqual(asyncio.run(scenario()), 0)
+        bookings, new_bookings = coordinator._synced.get_nowait()
+        self.assertEqual([b.id for b in new_bookings], [int(n) for n in fake.bookings])
+
+    def test_adaptive_polling(self):
+        import asyncio
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        import Coordinator as c
+        from Database import Database
+        from DatabaseWorker import DatabaseWorker
+        from FakeUpstreams import FakeBookeo, FakeResponse
+
+        noon = datetime(2024, 1, 15, 12, tzinfo=c.LOCAL_TIMEZONE)
+        night = datetime(2024, 1, 15, 3, tzinfo=c.LOCAL_TIMEZONE)
+        self.assertEqual(c.sync_interval(noon, False, 0), c.SYNC_INTERVAL)
+        self.assertEqual(c.sync_interval(noon, False, 2), c.SYNC_INTERVAL * 2.25)
+        self.assertEqual(c.sync_interval(noon, False, 50), c.MAX_SYNC_INTERVAL)
+        self.assertEqual(c.sync_interval(noon, True, 50), c.MIN_SYNC_INTERVAL)
+        self.assertEqual(c.sync_interval(night, False, 0), c.MAX_SYNC_INTERVAL)
+        self.assertEqual(c.sync_interval(noon, True, 0, 3600), timedelta(hours=1))
+
+        # A booking starting soon keeps the sync interval short
+        patcher = mock.patch("Bookeo.MIN_REQUEST_INTERVAL", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logger = Logger("test", level=INFO)
+        db_path, roster_path = temp_database_files(self)
+        fake = FakeBookeo(bookings_per_day=0, days=0)
+        fake.add_booking(datetime.now(timezone.utc) + timedelta(hours=1))
+        db = DatabaseWorker(
+            lambda: Database(logger, db_path, roster_path, "X", "X", bookeo_session=fake)
+        )
+        self.addCleanup(db.close)
+        coordinator = c.Coordinator(logger, db, mock.Mock(), mock.Mock(), status_port=0)
+        asyncio.run(coordinator.renew_leadership())
+        coordinator._synced = asyncio.Queue()
+        asyncio.run(coordinator.sync_bookings())
+        self.assertEqual(coordinator._idle_syncs, 0)
+        self.assertEqual(coordinator._sync_interval, c.MIN_SYNC_INTERVAL)
+        asyncio.run(coordinator.sync_bookings())
+        self.assertEqual(coordinator._idle_syncs, 1)
+
+        # Being rate limited pushes the next sync past Bookeo's Retry-After
+        fake.handle = lambda *a: FakeResponse(429, {}, {"Retry-After": "600"})
+        with self.assertRaises(ConnectionError):
+            asyncio.run(coordinator.sync_bookings())
+        self.assertGreater(coordinator._sync_interval, timedelta(minutes=9))
+        requests = fake.requests
+        with self.assertRaises(ConnectionError):
+            asyncio.run(coordinator.sync_bookings())
+        self.assertEqual(fake.requests, requests)
+
+
+class TestTenant(unittest.TestCase):
+    def test_load_tenants(self):
+        import shutil
+        import tempfile
+
+        from Tenant import load_tenants
+
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+        with open(os.path.join(dirpath, "chapel-hill.env"), "w") as f:
+            f.write('CTE_DB_PATH="data/chapel-hill.sqlite3"\n')
+            f.write('ON_CAMPUS_CATEGORY_IDS="MPJWRE, PJNEYX"\n')
+        with open(os.path.join(dirpath, "durham.env"), "w") as f:
+            f.write('CTE_DB_PATH="data/durham.sqlite3"\n')
+            f.write('SLACK_BOT_TOKEN="durham-token"\n')
+        with open(os.path.join(dirpath, "notes.txt"), "w") as f:
+            f.write("not a tenant")
+
+        defaults = {"SLACK_BOT_TOKEN": "shared-token", "CTE_DB_PATH": "data/cte.sqlite3"}
+        tenants = load_tenants(dirpath, defaults)
+        self.assertEqual([t.name for t in tenants], ["chapel-hill", "durham"])
+        self.assertEqual(tenants[0].config["SLACK_BOT_TOKEN"], "shared-token")
+        self.assertEqual(tenants[0].on_campus_category_ids, ["MPJWRE", "PJNEYX"])
+        self.assertEqual(tenants[1].config["SLACK_BOT_TOKEN"], "durham-token")
+        self.assertEqual(tenants[1].on_campus_category_ids, [])
+
+        # Tenants can't share a database file
+        with open(os.path.join(dirpath, "raleigh.env"), "w") as f:
+            f.write('CTE_DB_PATH="data/durham.sqlite3"\n')
+        with self.assertRaises(ValueError):
+            load_tenants(dirpath, defaults)
+        with self.assertRaises(OSError):
+            load_tenants("invalidpath", defaults)
 
 
 # Tests done!
+class TestStartup(unittest.TestCase):
+    STARTUP_BUDGET = 1.5  # seconds from a restart to a ready Coordinator
+
+    def test_startup_budget(self):
+        import json
+        import subprocess
+        import sys
+        from csv import DictWriter
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+
+        from Booking import Booking
+        from Database import Database
+        from PID import PID
+
+        # A database and roster as a restart finds them after a previous
+        # run: migrated, with a compiled roster snapshot and upcoming bookings
+        db_path, roster_path = temp_database_files(self)
+        with open(roster_path, "w", newline="") as f:
+            writer = DictWriter(f, fieldnames=["lastName", "firstName", "PID"])
+            writer.writeheader()
+            for i in range(50_000):
+                row = {"lastName": f"Last{i}", "firstName": "F", "PID": 730_000_000 + i}
+                writer.writerow(row)
+        db = Database(Logger("test", level=INFO), db_path, roster_path, "X", "X")
+        db.refresh_roster()
+        t = datetime.now(timezone.utc)
+        pids = [PID(730_000_000 + i, "F", f"Last{i}") for i in range(5001)]
+        db.insert_new_bookings(
+            [
+                Booking(i, t + timedelta(minutes=i), [pids[i]], t, "")
+                for i in range(1, 5001)
+            ]
+        )
+        db._conn.close()
+
+        config = {
+            "CTE_DB_PATH": db_path,
+            "CAMPUS_ROSTER_PATH": roster_path,
+            "BOOKEO_SECRET_KEY": "X",
+            "BOOKEO_API_KEY": "X",
+            "SLACK_BOT_TOKEN": "X",
+            "SLING_USERNAME": "X",
+            "SLING_PASSWORD": "X",
+        }
+        code = """if True:
+            import sys, time
+            t = time.perf_counter()
+            import app
+            print(any(m in sys.modules for m in ("requests", "asyncio", "Database")))
+
+            import asyncio, json, logging
+            from datetime import timedelta
+            from Tenant import Tenant
+
+            tenant = Tenant("default", json.loads(sys.argv[1]))
+            coordinator, db = app.build_coordinator(logging.getLogger("x"), tenant, 0)
+
+            async def ready():
+                await coordinator.load_admins()
+                await db.call("refresh_roster")
+                await db.call("get_upcoming_bookings", timedelta(days=31))
+
+            asyncio.run(ready())
+            print(time.perf_counter() - t)
+            db.close()
+        """
+        out = subprocess.run(
+            [sys.executable, "-c", code, json.dumps(config)],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(out.returncode, 0, out.stderr)
+        out = out.stdout.split()
+        # Importing the entry point alone pulls in none of the heavy modules
+        self.assertEqual(out[0], "False")
+        self.assertLess(float(out[1]), self.STARTUP_BUDGET)
+
+    def test_schema_check_cached(self):
+        import sqlite3
+        from logging import INFO, Logger
+        from unittest import mock
+
+        from Database import Database
+
+        db_path, roster_path = temp_database_files(self)
+        logger = Logger("test", level=INFO)
+        Database(logger, db_path, roster_path, "X", "X")._conn.close()
+        with mock.patch.object(Database, "_create_tables") as create:
+            Database(logger, db_path, roster_path, "X", "X")._conn.close()
+            create.assert_not_called()
+
+            # Any change to the schema is checked again
+            conn = sqlite3.connect(db_path)
+            conn.execute("DROP TABLE employees")
+            conn.close()
+            with self.assertRaises(IOError):
+                Database(logger, db_path, roster_path, "X", "X")
+
+
+class TestCLI(unittest.TestCase):
+    def test_validate(self):
+        import io
+        import sqlite3
+        from contextlib import redirect_stderr, redirect_stdout
+        from datetime import datetime, timedelta, timezone
+        from logging import INFO, Logger
+        from unittest import mock
+
+        import cli
+        from Booking import Booking
+        from Database import Database
+        from PID import PID
+
+        db = temp_database(self)
+        now = datetime.now(timezone.utc)
+        db.insert_new_bookings(
+            [
+                Booking(1, now + timedelta(days=1), [PID(1, "No", "One")], now, ""),
+                Booking(2, now - timedelta(hours=1), [PID(2, "No", "Two")], now, ""),
+            ]
+        )
+
+        opened = []
+
+        def open_database(logger, tenant):
+            paths = (db._db_filepath, db._roster_filepath)
+            opened.append(Database(Logger("test", level=INFO), *paths, "X", "X"))
+            return opened[-1]
+
+        def run(*argv):
+            out = io.StringIO()
+            with mock.patch.object(cli, "_tenant"), mock.patch.object(
+                cli, "open_database", side_effect=open_database
+            ), redirect_stdout(out), redirect_stderr(io.StringIO()):
+                self.assertEqual(cli.main(list(argv)), 0)
+            return [line.split("\t")[0] for line in out.getvalue().splitlines()]
+
+        self.assertEqual(run("validate"), ["1"])
+        self.assertEqual(run("validate", "--all"), ["2", "1"])
+        run("rebuild-roster-index")
+        # Every command closes the database it opened
+        for d in opened:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                d._conn.execute("SELECT 1")
+
+    def test_notify_dry_run(self):
+        import io
+        import time
+        from contextlib import redirect_stderr, redirect_stdout
+        from logging import INFO, Logger
+        from unittest import mock
+
+        import cli
+        from Database import Database
+        from Tenant import Tenant
+
+        db_path, roster_path = temp_database_files(self)
+        config = {
+            "CTE_DB_PATH": db_path,
+            "CAMPUS_ROSTER_PATH": roster_path,
+            "BOOKEO_SECRET_KEY": "X",
+            "BOOKEO_API_KEY": "X",
+            "SLACK_BOT_TOKEN": "X",
+            "SLING_USERNAME": "X",
+            "SLING_PASSWORD": "X",
+        }
+        db = Database(Logger("test", level=INFO), db_path, roster_path, "X", "X")
+        db.refresh_roster()
+        mtime = db._get_meta("rosterMtime")
+        db.close()
+        later = time.time() + 60
+        os.utime(roster_path, (later, later))
+
+        with mock.patch.object(
+            cli, "_tenant", return_value=Tenant("default", config)
+        ), redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(cli.main(["notify", "--dry-run"]), 0)
+        self.assertIn("Would send 0 notification(s)", err.getvalue())
+
+        # The roster that changed since was not loaded
+        db = Database(Logger("test", level=INFO), db_path, roster_path, "X", "X")
+        self.addCleanup(db.close)
+        self.assertEqual(db._get_meta("rosterMtime"), mtime)
+
+    def test_requires_command(self):
+        import io
+        from contextlib import redirect_stderr
+
+        import cli
+
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            cli.main([])
+
+
+class TestStructuredLogging(unittest.TestCase):
+    def test_json_logging(self):
+        import json
+        import logging
+        import shutil
+        import tempfile
+
+        from StructuredLogging import SAMPLE_BURST, parse_levels, setup_logging
+
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+        path = os.path.join(dirpath, "eric.log")
+        logger = logging.getLogger("test-structured")
+        logger.propagate = False
+        listener = setup_logging(
+            logger, {"LOG_PATH": path, "LOG_FORMAT": "json", "LOG_LEVELS": "test=DEBUG"}
+        )
+        for i in range(SAMPLE_BURST + 5):
+            logger.debug(f"hot {i}")
+        logger.warning("kept")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("failed")
+        listener.stop()
+
+        with open(path) as f:
+            entries = [json.loads(line) for line in f]
+        messages = [e["message"] for e in entries]
+        self.assertEqual(messages[0], "hot 0")
+        self.assertEqual(len(messages), SAMPLE_BURST + 2)
+        self.assertEqual(entries[-2]["level"], "WARNING")
+        self.assertEqual(entries[-2]["module"], "test")
+        # The traceback gets its own field rather than ending up in the message
+        self.assertEqual(entries[-1]["message"], "failed")
+        self.assertIn("ValueError: boom", entries[-1]["exception"])
+
+        self.assertEqual(
+            parse_levels("Bookeo=warning, Sling=DEBUG"),
+            {"Bookeo": logging.WARNING, "Sling": logging.DEBUG},
+        )
+        with self.assertRaises(ValueError):
+            parse_levels("Bookeo=LOUD")
+
+    def test_worker_processes_log_through_parent(self):
+        import logging
+        import multiprocessing
+        import shutil
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        from app import _init_tenant_worker
+        from StructuredLogging import setup_logging
+
+        dirpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirpath)
+        config = {"LOG_PATH": os.path.join(dirpath, "eric.log")}
+        logger = logging.getLogger("eric-cte")
+        handlers, level = list(logger.handlers), logger.level
+        self.addCleanup(setattr, logger, "handlers", handlers)
+        self.addCleanup(logger.setLevel, level)
+        log_queue = multiprocessing.Queue()
+        listener = setup_logging(logger, config, log_queue)
+
+        # Only the parent has the log file open, so only it rotates it
+        with ProcessPoolExecutor(
+            2, initializer=_init_tenant_worker, initargs=(log_queue, config)
+        ) as pool:
+            futures = [pool.submit(logger.warning, f"worker {i}") for i in range(4)]
+            for f in futures:
+                f.result()
+            worker_handlers = pool.submit(handler_names, "eric-cte").result()
+            self.assertEqual(worker_handlers, ["ExceptionQueueHandler"])
+        logger.warning("parent")
+        listener.stop()
+
+        with open(config["LOG_PATH"]) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(
+            sorted(line.split(";")[-1] for line in lines),
+            ["parent", "worker 0", "worker 1", "worker 2", "worker 3"],
+        )
+
+
 class TestSlackApp(unittest.TestCase):
     def test_valid_slack_init(self):
         from datetime import time
@@ -747,6 +2777,40 @@ def setup_db(filepath: str):
     conn.commit()
 
 
+def handler_names(logger_name: str) -> list[str]:
+    """Returns the types of a logger's handlers, e.g. in a worker process"""
+    import logging
+
+    return [type(h).__name__ for h in logging.getLogger(logger_name).handlers]
+
+
+def temp_database_files(test: unittest.TestCase) -> tuple[str, str]:
+    """Returns the paths of a throwaway database and roster that are
+    removed when the test finishes"""
+    import shutil
+    import tempfile
+
+    dirpath = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, dirpath)
+    db_path = os.path.join(dirpath, "test.sqlite3")
+    roster_path = os.path.join(dirpath, "testroster.csv")
+    setup_db(db_path)
+    setup_roster(roster_path)
+    return db_path, roster_path
+
+
+def temp_database(test: unittest.TestCase):
+    """Returns a Database backed by throwaway files"""
+    from logging import INFO, Logger
+
+    from Database import Database
+
+    db_path, roster_path = temp_database_files(test)
+    db = Database(Logger("test", level=INFO), db_path, roster_path, "X", "X")
+    test.addCleanup(db._conn.close)
+    return db
+
+
 def setup_roster(filepath: str):
     from csv import DictWriter
 
@@ -798,15 +2862,16 @@ def test_main():
     from logging.handlers import TimedRotatingFileHandler
     from time import sleep
 
-    import pytz
-    from app import connected_to_internet, get_secrets, validate_secrets
+    from zoneinfo import ZoneInfo
+
+    from app import get_secrets, validate_secrets
     from Booking import Booking
     from Database import Database
     from Employee import Employee
     from Secrets import secret_keys
     from SlackApp import SlackApp
 
-    LOCAL_TIMEZONE = pytz.timezone("America/New_York")
+    LOCAL_TIMEZONE = ZoneInfo("America/New_York")
     logger = logging.getLogger("eric-cte")
     secrets = get_secrets("config.env")
     validate_secrets(secrets, secret_keys)
@@ -843,10 +2908,6 @@ def test_main():
     last_fetch = dt.datetime.fromtimestamp(0)
 
     while True:
-        while not connected_to_internet():
-            logger.error("No Internet connection")
-            sleep(60)
-
         # Update local database
         db.clear()
         fetch_delta = dt.timedelta(days=31)